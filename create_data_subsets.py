@@ -5,10 +5,17 @@ Each individual function (for example, create_booking_rooms_with_availability_ac
 Usage: 
 """
 
-import json
 import os
+from contextlib import ExitStack
 from typing import Any, Dict, List, Tuple
 
+from large_response_QA import json_codec
+from large_response_QA.large_response_utils import (
+    DataSubsetWriter,
+    get_data_subset_file_name,
+)
+from large_response_QA.manifest import get_file_signature, load_manifest, save_manifest
+from large_response_QA.response_store import ResponseStore, is_response_store
 from large_response_QA.tasks.task_list import (
     BookingGetAvailabilityTaskList,
     BookingGetRoomListWithAvailabilityTaskList,
@@ -39,11 +46,70 @@ def filter_dataset(
     return random_seeds_num_entities_list
 
 
+def data_subset_path(
+    host: str, endpoint_name: str, token_limit: int, *tokenizer_model_name: str
+) -> str:
+    return os.path.join(
+        os.path.dirname(__file__),
+        "data/data_subsets_for_lim_experiments",
+        get_data_subset_file_name(host, endpoint_name, token_limit, *tokenizer_model_name),
+    )
+
+
+def get_data_fpath(host: str, endpoint_name: str, response_store_path: str) -> str:
+    if os.path.exists(response_store_path):
+        with ResponseStore(response_store_path) as response_store:
+            if response_store.has_endpoint(host, endpoint_name):
+                return response_store_path
+    return os.path.join(os.path.dirname(__file__), f"data/{host}_{endpoint_name}.json")
+
+
+def write_data_subset(
+    filtered_dataset: Dict[int, Any], host: str, endpoint_name: str, token_limit: int
+) -> None:
+    for key, value in filtered_dataset.items():
+        del value["num_entities"]
+    with open(data_subset_path(host, endpoint_name, token_limit), "w") as f:
+        json_codec.dump(filtered_dataset, f, indent=4)
+
+
+def add_response_format_token_counts(
+    token_counts: Dict[str, int],
+    task_list_obj: Any,
+    subset: Dict[str, Any],
+    model_name: str,
+    response_formats: List[str],
+) -> None:
+    # the prompts embed the {query_args: record} responses of the endpoint of a subset
+    for endpoint_info in subset.values():
+        for query_info in endpoint_info.values():
+            for response_format, num_tokens in task_list_obj.count_response_format_tokens(
+                query_info, model_name, response_formats
+            ).items():
+                token_counts[response_format] = token_counts.get(response_format, 0) + num_tokens
+
+
 if __name__ == "__main__":
     #This is the tokenizer used
     model_name = "meta-llama/llama-3.1-70b-instruct"
-    token_limits = [80000, 40000, 20000, 10000]  # descending order of token_limits
+    # descending order of token_limits, for long context models this can go up to 1M tokens e.g.
+    # [1000000, 512000, 256000, 128000, 80000, 40000, 20000, 10000]
+    token_limits = [80000, 40000, 20000, 10000]
     num_data_samples_to_select = 10
+    # When True, one walk per random seed creates the subsets for all the token_limits and the
+    # subsets are streamed to the output files one random seed at a time
+    nested_subsets = True
+    # When True, the random seeds are selected with approximate token counts and only the
+    # subsets of the selected random seeds are created with the tokenizer (nested_subsets only)
+    approximate_seed_selection = False
+    # Tokenizers to also create the data subsets for, with the same random seeds as model_name's
+    # tokenizer and in the same pass over the records (nested_subsets only), e.g.
+    # ["ibm-granite/granite-3.1-8b-instruct", "mistralai/Mixtral-8x22B-Instruct-v0.1"]
+    additional_tokenizer_model_names: List[str] = []
+    # Response formats of the prompts (see large_response_QA/serializers.py) whose token counts with
+    # model_name's tokenizer are reported for the data subsets (nested_subsets only), e.g.
+    # ["json", "minified_json", "yaml", "key_paths", "csv"]
+    report_response_formats: List[str] = []
     task_lists = [
         BookingGetAvailabilityTaskList,
         BookingGetRoomListWithAvailabilityTaskList,
@@ -51,57 +117,201 @@ if __name__ == "__main__":
         BookingSearchFlightsMultiStopsTaskList,
         BookingGetSeatMapTaskList
     ]
+    # The responses are read from this response store (see extract_responses_from_complex_func_bench.py)
+    # when it exists, instead of the data files
+    response_store_path = os.path.join(os.path.dirname(__file__), "data/responses.sqlite")
     random_seeds_num_entities_list: List[Any] = []
+    # records the data files, settings and random seeds of the previous run (nested_subsets only),
+    # so that only the data subsets of the changed data files or settings are created again
+    subsets_manifest_path = os.path.join(
+        os.path.dirname(__file__), "data/data_subsets_for_lim_experiments/subsets.manifest"
+    )
+    subsets_manifest = load_manifest(subsets_manifest_path) if nested_subsets else {}
+    subsets_settings = {
+        "model_name": model_name,
+        "token_limits": token_limits,
+        "num_data_samples_to_select": num_data_samples_to_select,
+        "approximate_seed_selection": approximate_seed_selection,
+        "additional_tokenizer_model_names": additional_tokenizer_model_names,
+    }
     for task_list in task_lists:
-        for token_limit in token_limits:
-            dataset = {}
-            filtered_dataset = {}
-
-            host = task_list.host
-            endpoint_name = task_list.endpoint_name
-            if len(random_seeds_num_entities_list) == 0:
-                num_iterations = [j + 1 for j in range(100)]
+        host = task_list.host
+        endpoint_name = task_list.endpoint_name
+        if nested_subsets:
+            data_fpath = get_data_fpath(host, endpoint_name, response_store_path)
+            if is_response_store(data_fpath):
+                with ResponseStore(data_fpath) as response_store:
+                    input_signature = response_store.get_endpoint_signature(
+                        host, endpoint_name
+                    )
             else:
-                num_iterations = [
-                    random_seed[0] for random_seed in random_seeds_num_entities_list
-                ]
-            for i in num_iterations:
-                task_list_obj = task_list(
-                    os.path.join(
-                        os.path.dirname(__file__),
-                        f"data/{host}_{endpoint_name}.json",
-                    ),
-                )
-                output_data_dict, num_entities = task_list_obj.create_data_subsets(
-                    token_limit,
-                    random_seed=i,
-                    model_name=model_name,
-                    min_entities=None,
-                )
-                output_data_dict["num_entities"] = num_entities
-                if output_data_dict is not None:
-                    dataset[i] = output_data_dict
-            # # Filter the dataset to keep only num_data_samples_to_select samples with the maximum possible number of entities
-            # # and it returns the random_seeds corresponding to that selection
+                input_signature = get_file_signature(data_fpath)
+            tokenizer_model_names = [model_name] + additional_tokenizer_model_names
+            task_list_obj = None
             if len(random_seeds_num_entities_list) == 0:
-                random_seeds_num_entities_list = filter_dataset(
-                    dataset, num_data_samples_to_select
+                random_seed_selection_inputs = {
+                    "task_list": task_list.__name__,
+                    "input_signature": input_signature,
+                    "settings": subsets_settings,
+                }
+                previous_selection = subsets_manifest.get("random_seed_selection", {})
+                if all(
+                    previous_selection.get(name) == value
+                    for name, value in random_seed_selection_inputs.items()
+                ):
+                    random_seeds_num_entities_list = previous_selection[
+                        "random_seeds_num_entities"
+                    ]
+                    print(
+                        f"{token_limits[0]}: {random_seeds_num_entities_list} (from {subsets_manifest_path})"
+                    )
+                else:
+                    task_list_obj = task_list(data_fpath)
+                    if not approximate_seed_selection:
+                        task_list_obj.count_subset_record_tokens(
+                            tokenizer_model_names, task_list_obj.api_response
+                        )
+                    # Only the number of entities is kept for selecting the random seeds, the selected
+                    # subsets are created again below from the cached token counts of the records
+                    dataset = {}
+                    for i in [j + 1 for j in range(100)]:
+                        _, num_entities = task_list_obj.create_nested_data_subsets(
+                            token_limits[:1],
+                            random_seed=i,
+                            model_name=model_name,
+                            api_responses=task_list_obj.api_response,
+                            approximate_token_counts=approximate_seed_selection,
+                        )[token_limits[0]]
+                        dataset[i] = {"num_entities": num_entities}
+                    random_seeds_num_entities_list = [
+                        list(random_seed_num_entities)
+                        for random_seed_num_entities in filter_dataset(
+                            dataset, num_data_samples_to_select
+                        )
+                    ]
+                    print(f"{token_limits[0]}: {random_seeds_num_entities_list}")
+                    subsets_manifest["random_seed_selection"] = {
+                        **random_seed_selection_inputs,
+                        "random_seeds_num_entities": random_seeds_num_entities_list,
+                    }
+
+            output_fpaths = [
+                data_subset_path(host, endpoint_name, token_limit, tokenizer_model_name)
+                for tokenizer_model_name in tokenizer_model_names
+                for token_limit in token_limits
+            ]
+            task_list_inputs = {
+                "input_signature": input_signature,
+                "settings": subsets_settings,
+                "random_seeds_num_entities": random_seeds_num_entities_list,
+            }
+            previous_run = subsets_manifest.get("task_lists", {}).get(task_list.__name__, {})
+            if all(
+                previous_run.get(name) == value for name, value in task_list_inputs.items()
+            ) and all(
+                os.path.exists(output_fpath)
+                and previous_run["output_signatures"].get(output_fpath)
+                == get_file_signature(output_fpath)
+                for output_fpath in output_fpaths
+            ):
+                print(
+                    f"The data of {endpoint_name} and the settings did not change, keeping its data subsets"
                 )
-                print(f"{token_limit}: {random_seeds_num_entities_list}")
+                continue
+
+            if task_list_obj is None:
+                task_list_obj = task_list(data_fpath)
+                if not approximate_seed_selection:
+                    task_list_obj.count_subset_record_tokens(
+                        tokenizer_model_names, task_list_obj.api_response
+                    )
+            with ExitStack() as stack:
+                writers = {
+                    (tokenizer_model_name, token_limit): stack.enter_context(
+                        DataSubsetWriter(
+                            data_subset_path(
+                                host, endpoint_name, token_limit, tokenizer_model_name
+                            )
+                        )
+                    )
+                    for tokenizer_model_name in tokenizer_model_names
+                    for token_limit in token_limits
+                }
+                # {token_limit: {response_format: number of tokens of the subsets}}
+                response_format_token_counts: Dict[int, Dict[str, int]] = {}
                 for random_seed, _ in random_seeds_num_entities_list:
-                    filtered_dataset[random_seed] = dataset[random_seed]
-            else:
-                filtered_dataset = dataset
-            for key, value in filtered_dataset.items():
-                del value["num_entities"]
-            json.dump(
-                filtered_dataset,
-                open(
-                    os.path.join(
-                        os.path.dirname(__file__),
-                        f"data/data_subsets_for_lim_experiments/{host}_{endpoint_name}_subset_{token_limit}.json",
-                    ),
-                    "w",
-                ),
-                indent=4,
-            )
+                    for tokenizer_model_name in tokenizer_model_names:
+                        subsets = task_list_obj.create_nested_data_subsets(
+                            token_limits,
+                            random_seed=random_seed,
+                            model_name=tokenizer_model_name,
+                            api_responses=task_list_obj.api_response,
+                        )
+                        for token_limit, (output_data_dict, _) in subsets.items():
+                            if output_data_dict is not None:
+                                writers[(tokenizer_model_name, token_limit)].write(
+                                    random_seed, output_data_dict
+                                )
+                                if (
+                                    tokenizer_model_name == model_name
+                                    and len(report_response_formats) > 0
+                                ):
+                                    add_response_format_token_counts(
+                                        response_format_token_counts.setdefault(token_limit, {}),
+                                        task_list_obj,
+                                        output_data_dict,
+                                        model_name,
+                                        report_response_formats,
+                                    )
+                for token_limit, token_counts in response_format_token_counts.items():
+                    print(
+                        f"{endpoint_name} {token_limit}: "
+                        + ", ".join(
+                            f"{response_format} {num_tokens} tokens"
+                            for response_format, num_tokens in token_counts.items()
+                        )
+                    )
+            subsets_manifest.setdefault("task_lists", {})[task_list.__name__] = {
+                **task_list_inputs,
+                "output_signatures": {
+                    output_fpath: get_file_signature(output_fpath)
+                    for output_fpath in output_fpaths
+                },
+            }
+            save_manifest(subsets_manifest, subsets_manifest_path)
+        else:
+            for token_limit in token_limits:
+                dataset = {}
+                filtered_dataset = {}
+
+                if len(random_seeds_num_entities_list) == 0:
+                    num_iterations = [j + 1 for j in range(100)]
+                else:
+                    num_iterations = [
+                        random_seed[0] for random_seed in random_seeds_num_entities_list
+                    ]
+                for i in num_iterations:
+                    task_list_obj = task_list(
+                        get_data_fpath(host, endpoint_name, response_store_path)
+                    )
+                    output_data_dict, num_entities = task_list_obj.create_data_subsets(
+                        token_limit,
+                        random_seed=i,
+                        model_name=model_name,
+                        min_entities=None,
+                    )
+                    output_data_dict["num_entities"] = num_entities
+                    if output_data_dict is not None:
+                        dataset[i] = output_data_dict
+                # # Filter the dataset to keep only num_data_samples_to_select samples with the maximum possible number of entities
+                # # and it returns the random_seeds corresponding to that selection
+                if len(random_seeds_num_entities_list) == 0:
+                    random_seeds_num_entities_list = filter_dataset(
+                        dataset, num_data_samples_to_select
+                    )
+                    print(f"{token_limit}: {random_seeds_num_entities_list}")
+                    for random_seed, _ in random_seeds_num_entities_list:
+                        filtered_dataset[random_seed] = dataset[random_seed]
+                else:
+                    filtered_dataset = dataset
+                write_data_subset(filtered_dataset, host, endpoint_name, token_limit)
@@ -1,48 +1,169 @@
-import json
-from typing import Any
+import os
+from contextlib import ExitStack
+from multiprocessing import Pool
+from typing import Any, Iterator, Optional
 
-from large_response_QA.large_response_utils import extract_endpoint_data
+from large_response_QA import json_codec
+from large_response_QA.large_response_utils import (
+    LargeResponsesWriter,
+    extract_endpoints_data,
+)
+from large_response_QA.manifest import (
+    get_file_signature,
+    get_text_hash,
+    load_manifest,
+    save_manifest,
+)
 from transformers import AutoTokenizer
 
 data_path = "./data/ComplexFuncBench.jsonl"
+output_path = "./data/large_responses_complex_func_bench.json"
+# records the input, settings and token counts of the previous run, so that a rerun only
+# tokenizes new observations and only extracts the endpoints whose responses changed
+manifest_path = "./data/extraction.manifest"
+# the extracted responses are also written to this response store, which create_data_subsets.py
+# reads instead of the data files
+response_store_path = "./data/responses.sqlite"
 min_tokens_threshold = 8000
+tokenizer_model = "meta-llama/llama-3.1-70b-instruct"
+# number of observations tokenized by the worker processes at a time
+batch_size = 256
 
-with open(data_path, "r") as file:
-    results = []
-    for line in file:
-        data = json.loads(line)
-        results.append(data)
+_tokenizer: Any = None
 
-tokenizer_model = "meta-llama/llama-3.1-70b-instruct"
-tokenizer = AutoTokenizer.from_pretrained(tokenizer_model)
-
-large_responses: dict[Any, Any] = {}
-latest_function_calls: dict[Any, Any] = {}
-for result in results:
-    conversations = result["conversations"]
-    for i, entry in enumerate(conversations):
-        role = entry["role"]
-        if role == "assistant" and "function_call" in entry.keys():
-            latest_function_calls = entry["function_call"]
-        elif role == "observation" and "content" in entry.keys():
-            observations = entry["content"]
-            for j, api_response in enumerate(observations):
-                num_tokens = len(tokenizer.tokenize(str(api_response)))
-                if num_tokens > min_tokens_threshold:
-                    api_responses = large_responses.get(
-                        latest_function_calls[j]["name"], {}
+
+def init_tokenizer(model_name: str) -> None:
+    global _tokenizer
+    _tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+
+def count_tokens(text: str) -> int:
+    return len(_tokenizer.tokenize(text))
+
+
+def iter_observations(data_path: str) -> Iterator[tuple[Any, int, Any]]:
+    """
+    Read the conversations one line at a time and yield the (function calls, index, api response)
+    of each observation, with the latest function calls of the assistant before it.
+    """
+    latest_function_calls: Any = {}
+    with open(data_path, "r") as file:
+        for line in file:
+            result = json_codec.loads(line)
+            conversations = result["conversations"]
+            for i, entry in enumerate(conversations):
+                role = entry["role"]
+                if role == "assistant" and "function_call" in entry.keys():
+                    latest_function_calls = entry["function_call"]
+                elif role == "observation" and "content" in entry.keys():
+                    observations = entry["content"]
+                    for j, api_response in enumerate(observations):
+                        yield latest_function_calls, j, api_response
+
+
+def iter_candidate_batches(
+    data_path: str, min_tokens_threshold: int, batch_size: int
+) -> Iterator[list[tuple[Any, int, Any, str]]]:
+    batch = []
+    for function_calls, j, api_response in iter_observations(data_path):
+        text = str(api_response)
+        # a token is at least one byte of the text (plus a possible prefix token), so the
+        # observations with fewer bytes than the threshold cannot have more tokens than it
+        if len(text.encode("utf-8")) < min_tokens_threshold:
+            continue
+        batch.append((function_calls, j, api_response, text))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def extract_large_responses(manifest: dict[str, Any]) -> None:
+    settings = {
+        "input_signature": get_file_signature(data_path),
+        "min_tokens_threshold": min_tokens_threshold,
+        "tokenizer": tokenizer_model,
+    }
+    previous_run = manifest.get("large_responses", {})
+    if (
+        all(previous_run.get(name) == value for name, value in settings.items())
+        and os.path.exists(output_path)
+        and previous_run.get("output_signature") == get_file_signature(output_path)
+    ):
+        print(f"{data_path} and the settings did not change, keeping {output_path}")
+        return
+    # token counts of the observations by hash of their text, for the same tokenizer
+    previous_token_counts: dict[str, int] = (
+        previous_run.get("token_counts", {})
+        if previous_run.get("tokenizer") == tokenizer_model
+        else {}
+    )
+    token_counts: dict[str, int] = {}
+
+    with ExitStack() as stack:
+        writer = stack.enter_context(
+            LargeResponsesWriter(output_path, "booking-com15.p.rapidapi.com")
+        )
+        pool: Optional[Any] = None
+        for batch in iter_candidate_batches(data_path, min_tokens_threshold, batch_size):
+            text_hashes = [get_text_hash(text) for _, _, _, text in batch]
+            texts_to_tokenize = {
+                text_hash: text
+                for text_hash, (_, _, _, text) in zip(text_hashes, batch)
+                if text_hash not in previous_token_counts and text_hash not in token_counts
+            }
+            if len(texts_to_tokenize) > 0:
+                if pool is None:
+                    # the worker processes only load the tokenizer if there is something to tokenize
+                    pool = stack.enter_context(
+                        Pool(
+                            processes=os.cpu_count(),
+                            initializer=init_tokenizer,
+                            initargs=(tokenizer_model,),
+                        )
                     )
-                    api_responses[str(latest_function_calls[j]["arguments"])] = (
-                        api_response
+                token_counts.update(
+                    zip(
+                        texts_to_tokenize.keys(),
+                        pool.map(count_tokens, texts_to_tokenize.values(), chunksize=8),
                     )
-                    large_responses[latest_function_calls[j]["name"]] = api_responses
-                    print(len(str(api_response)), num_tokens)
-large_re = {"booking-com15.p.rapidapi.com": large_responses}
-json.dump(large_re, open("./data/large_responses_complex_func_bench.json", "w"), indent=4)
+                )
+            for text_hash in text_hashes:
+                if text_hash not in token_counts:
+                    token_counts[text_hash] = previous_token_counts[text_hash]
+            for (latest_function_calls, j, api_response, text), text_hash in zip(
+                batch, text_hashes
+            ):
+                num_tokens = token_counts[text_hash]
+                if num_tokens > min_tokens_threshold:
+                    writer.add(
+                        latest_function_calls[j]["name"],
+                        str(latest_function_calls[j]["arguments"]),
+                        api_response,
+                    )
+                    print(len(text), num_tokens)
+
+    manifest["large_responses"] = {
+        **settings,
+        "output_signature": get_file_signature(output_path),
+        "token_counts": token_counts,
+    }
+
 
-extract_endpoint_data("booking-com15.p.rapidapi.com", "Get_Room_List_With_Availability")
-extract_endpoint_data("booking-com15.p.rapidapi.com", "Search_Flights_Multi_Stops")
-extract_endpoint_data("booking-com15.p.rapidapi.com", "Get_Seat_Map")
-extract_endpoint_data("booking-com15.p.rapidapi.com", "Get_Availability")
-extract_endpoint_data("booking-com15.p.rapidapi.com", "Search_Car_Rentals")
+if __name__ == "__main__":
+    manifest = load_manifest(manifest_path)
+    extract_large_responses(manifest)
+    save_manifest(manifest, manifest_path)
 
+    extract_endpoints_data(
+        [
+            ("booking-com15.p.rapidapi.com", "Get_Room_List_With_Availability"),
+            ("booking-com15.p.rapidapi.com", "Search_Flights_Multi_Stops"),
+            ("booking-com15.p.rapidapi.com", "Get_Seat_Map"),
+            ("booking-com15.p.rapidapi.com", "Get_Availability"),
+            ("booking-com15.p.rapidapi.com", "Search_Car_Rentals"),
+        ],
+        manifest_path=manifest_path,
+        response_store_path=response_store_path,
+    )
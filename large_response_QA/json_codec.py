@@ -0,0 +1,140 @@
+import json
+import math
+import re
+from typing import IO, Any, Optional
+
+# JSON loading and dumping with orjson (or simdjson for loading) when installed, and the json module
+# of the standard library otherwise. dumps() always returns the same string as json.dumps() with the
+# same indent and separators, as the prompts of the tasks contain the serialized api responses.
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None  # type: ignore[assignment]
+
+# orjson formats the floats that repr() writes with an exponent differently (1e+16 as 1e16 and
+# 1e-05 as 0.00001), its output is not used when it may contain such a float
+_ORJSON_EXPONENT = re.compile(r"e(?<=[0-9]e)")
+_ORJSON_SMALL_FLOAT = "0.0000"
+_NON_ASCII = re.compile(r"[\x7f-\U0010ffff]")
+# orjson decodes the integers that do not fit in 64 bits, e.g. the negative ones below -2**63 with 19
+# digits, as floats, json is used for the texts that may contain such an integer
+_LONG_NUMBER = b"0" * 19
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+# tuples are written as lists by both
+_ORJSON_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATACLASS
+    | orjson.OPT_PASSTHROUGH_DATETIME
+    | orjson.OPT_PASSTHROUGH_SUBCLASS
+    if orjson is not None
+    else 0
+)
+_ORJSON_INDENT_OPTIONS = orjson.OPT_INDENT_2 | _ORJSON_OPTIONS if orjson is not None else 0
+# the separators of json.dumps that orjson writes without indent
+_COMPACT_SEPARATORS = (",", ":")
+
+
+def _escape_non_ascii(match: re.Match) -> str:
+    # same escapes as json.dumps(..., ensure_ascii=True)
+    n = ord(match.group())
+    if n < 0x10000:
+        return f"\\u{n:04x}"
+    n -= 0x10000
+    return f"\\u{0xD800 | ((n >> 10) & 0x3FF):04x}\\u{0xDC00 | (n & 0x3FF):04x}"
+
+
+def loads(data: str | bytes) -> Any:
+    if orjson is None and simdjson is None:
+        return json.loads(data)
+    data_bytes = data.encode("utf-8", "surrogatepass") if isinstance(data, str) else data
+    if _LONG_NUMBER in data_bytes.translate(_DIGITS_TO_ZERO):
+        return json.loads(data)
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN, infinite floats or lone surrogates, which the json module accepts
+            pass
+    elif simdjson is not None:
+        try:
+            return simdjson.loads(data)
+        except ValueError:
+            pass
+    return json.loads(data)
+
+
+def load(f: IO) -> Any:
+    return loads(f.read())
+
+
+def load_file(fpath: str) -> Any:
+    with open(fpath, "rb") as f:
+        return loads(f.read())
+
+
+def _has_non_finite_float(obj: Any) -> bool:
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        value_type = type(value)
+        if value_type is dict:
+            stack.extend(value.values())
+        elif value_type is list or value_type is tuple:
+            stack.extend(value)
+        elif value_type is float and not math.isfinite(value):
+            return True
+    return False
+
+
+def _orjson_dumps(obj: Any, indent: Optional[int]) -> Optional[str]:
+    try:
+        # the types that orjson writes differently than json, e.g. the subclasses of str or int
+        # and datetimes, are passed to the default function, which raises a TypeError
+        data = orjson.dumps(
+            obj, option=_ORJSON_OPTIONS if indent is None else _ORJSON_INDENT_OPTIONS
+        )
+    except TypeError:
+        # e.g. non-str keys or integers that do not fit in 64 bits
+        return None
+    text = data.decode("utf-8")
+    if _ORJSON_EXPONENT.search(text) is not None or _ORJSON_SMALL_FLOAT in text:
+        return None
+    if "null" in text and _has_non_finite_float(obj):
+        # NaN and infinite floats are written as null by orjson
+        return None
+    if not text.isascii() or "\x7f" in text:
+        text = _NON_ASCII.sub(_escape_non_ascii, text)
+    if indent is not None and indent != 2:
+        # orjson indents with 2 spaces and the strings do not contain raw newlines
+        text = "\n".join(
+            [
+                (content := line.lstrip(" ")).rjust(
+                    len(content) + (len(line) - len(content)) // 2 * indent
+                )
+                for line in text.split("\n")
+            ]
+        )
+    return text
+
+
+def dumps(
+    obj: Any, indent: Optional[int] = None, separators: Optional[tuple[str, str]] = None
+) -> str:
+    # without indent, json.dumps uses its C encoder and its default ", " separators are not
+    # supported by orjson
+    if orjson is not None and (
+        (isinstance(indent, int) and indent > 0 and separators is None)
+        or (indent is None and separators == _COMPACT_SEPARATORS)
+    ):
+        text = _orjson_dumps(obj, indent)
+        if text is not None:
+            return text
+    return json.dumps(obj, indent=indent, separators=separators)
+
+
+def dump(obj: Any, f: IO, indent: Optional[int] = None) -> None:
+    f.write(dumps(obj, indent=indent))
@@ -1,74 +1,344 @@
-import copy
+from collections import OrderedDict
 from enum import Enum
 import json
 import os
-from typing import Any
+import tempfile
+from typing import Any, Optional
 from openai import AzureOpenAI
 import time
 
+from . import json_codec
+from .manifest import get_file_signature, load_manifest, save_manifest
+from .response_store import ResponseStore
+
 def extract_endpoint_data(
     app: str,
     endpoint: str,
     path_to_large_response_directory: str = "data",
     output_dir: str = "data",
+    manifest_path: Optional[str] = None,
+    response_store_path: Optional[str] = None,
 ) -> None:
-    output_file_name = f"{app}_{endpoint.replace('/', '_')}.json"
-    cache_subset_of_large_responses: Any = {}
+    extract_endpoints_data(
+        [(app, endpoint)],
+        path_to_large_response_directory=path_to_large_response_directory,
+        output_dir=output_dir,
+        manifest_path=manifest_path,
+        response_store_path=response_store_path,
+    )
 
-    for filename in os.listdir(path_to_large_response_directory):
-        response_cache = {}
-        try:
-            response_cache = json.load(
-                open(os.path.join(path_to_large_response_directory, filename), "r")
-            )
-        except BaseException:
-            continue
-        try:
-            for api_provider, responses in response_cache.items():
-                if api_provider.lower() == app.lower():
-                    for endpoint_str, api_responses in responses.items():
-                        if endpoint_str.lower() == endpoint.lower():
-                            for arguments, api_response in api_responses.items():
-                                try:
-                                    level1_dict = cache_subset_of_large_responses.get(
-                                        api_provider, {}
-                                    )
-                                    level2_dict = level1_dict.get(endpoint, {})
-                                    level2_dict[arguments] = api_response
-                                    level1_dict[endpoint] = level2_dict
-                                    cache_subset_of_large_responses[api_provider] = (
-                                        level1_dict
-                                    )
-                                except KeyError:
-                                    print(api_response)
-                                except BaseException:
-                                    print("Not KeyError", api_response)
-        except BaseException:
-            continue
-
-    json.dump(
-        cache_subset_of_large_responses,
-        open(os.path.expanduser(os.path.join(output_dir, output_file_name)), "w"),
+
+def is_response_cache_file(fpath: str) -> bool:
+    # response caches are JSON files with an object at the top level
+    if not fpath.endswith(".json") or not os.path.isfile(fpath):
+        return False
+    with open(fpath, "rb") as f:
+        return f.read(64).lstrip()[:1] == b"{"
+
+
+def load_response_cache(fpath: str) -> Any:
+    # the response cache of a response cache file, None if it cannot be read
+    try:
+        return json_codec.load_file(fpath)
+    except BaseException:
+        return None
+
+
+def get_response_cache_endpoints(response_cache: Any) -> list[list[str]]:
+    # the lowercase [api_provider, endpoint] pairs with responses in a response cache
+    endpoints: list[list[str]] = []
+    try:
+        for api_provider, responses in response_cache.items():
+            for endpoint_str in responses.keys():
+                if [api_provider.lower(), endpoint_str.lower()] not in endpoints:
+                    endpoints.append([api_provider.lower(), endpoint_str.lower()])
+    except BaseException:
+        pass
+    return endpoints
+
+
+def get_endpoint_responses(
+    response_cache: Any, keys: set[tuple[str, str]]
+) -> list[tuple[tuple[str, str], str, str, Any]]:
+    # the (lowercase (api_provider, endpoint), api_provider, arguments, api_response) of the
+    # endpoints of keys in a response cache, up to the first one that cannot be read
+    endpoint_responses = []
+    try:
+        for api_provider, responses in response_cache.items():
+            for endpoint_str, api_responses in responses.items():
+                key = (api_provider.lower(), endpoint_str.lower())
+                if key not in keys:
+                    continue
+                for arguments, api_response in api_responses.items():
+                    endpoint_responses.append((key, api_provider, arguments, api_response))
+    except BaseException:
+        pass
+    return endpoint_responses
+
+
+def extract_endpoints_data(
+    app_endpoints: list[tuple[str, str]],
+    path_to_large_response_directory: str = "data",
+    output_dir: str = "data",
+    manifest_path: Optional[str] = None,
+    response_store_path: Optional[str] = None,
+) -> None:
+    """
+    Same as extract_endpoint_data for each (app, endpoint) of app_endpoints, with a single pass
+    over the response cache files of path_to_large_response_directory.
+    With a manifest_path, the manifest records the size, modification time and endpoints of the
+    response cache files, and only the endpoints of the new, changed or removed files (or whose
+    output file is missing or changed) are extracted again, from the files that have them.
+    With a response_store_path, the extracted responses are also written to the response store.
+    """
+    response_store = (
+        ResponseStore(response_store_path) if response_store_path is not None else None
     )
+    # output file path and extracted responses of each requested (app, endpoint), by lowercase names
+    outputs: dict[tuple[str, str], tuple[str, str, Any]] = {}
+    for app, endpoint in app_endpoints:
+        output_fpath = os.path.expanduser(
+            os.path.join(output_dir, f"{app}_{endpoint.replace('/', '_')}.json")
+        )
+        outputs[(app.lower(), endpoint.lower())] = (output_fpath, endpoint, {})
+
+    fpaths = [
+        os.path.join(path_to_large_response_directory, filename)
+        for filename in os.listdir(path_to_large_response_directory)
+    ]
+    fpaths = [fpath for fpath in fpaths if is_response_cache_file(fpath)]
+    # the responses of the requested endpoints in the files that were already read, so that
+    # each file is only read once
+    read_endpoint_responses: dict[str, list[tuple[tuple[str, str], str, str, Any]]] = {}
+    if manifest_path is None:
+        endpoints_to_extract = set(outputs)
+        fpaths_to_read = fpaths
+    else:
+        manifest = load_manifest(manifest_path)
+        file_entries = manifest.get("response_cache_files", {})
+        extracted_files = manifest.get("extracted_files", {})
+        new_file_entries = {}
+        changed_endpoints: set[tuple[str, ...]] = set()
+        for fpath in fpaths:
+            signature = get_file_signature(fpath)
+            file_entry = file_entries.get(fpath)
+            if file_entry is None or file_entry["signature"] != signature:
+                if file_entry is not None:
+                    changed_endpoints.update(map(tuple, file_entry["endpoints"]))
+                response_cache = load_response_cache(fpath)
+                file_entry = {
+                    "signature": signature,
+                    "endpoints": get_response_cache_endpoints(response_cache),
+                }
+                changed_endpoints.update(map(tuple, file_entry["endpoints"]))
+                # all the requested endpoints of a changed file are extracted again
+                endpoint_responses = get_endpoint_responses(response_cache, set(outputs))
+                if len(endpoint_responses) > 0:
+                    read_endpoint_responses[fpath] = endpoint_responses
+            new_file_entries[fpath] = file_entry
+        for fpath, file_entry in file_entries.items():
+            if fpath not in new_file_entries:
+                changed_endpoints.update(map(tuple, file_entry["endpoints"]))
+        endpoints_to_extract = set()
+        for key, (output_fpath, _, _) in outputs.items():
+            if (
+                key in changed_endpoints
+                or not os.path.exists(output_fpath)
+                or (response_store is not None and not response_store.has_endpoint(*key))
+                or extracted_files.get(output_fpath) != get_file_signature(output_fpath)
+            ):
+                endpoints_to_extract.add(key)
+        fpaths_to_read = [
+            fpath
+            for fpath in fpaths
+            if any(
+                tuple(key) in endpoints_to_extract
+                for key in new_file_entries[fpath]["endpoints"]
+            )
+        ]
+        print(
+            f"Extracting {len(endpoints_to_extract)} of {len(outputs)} endpoints from {len(fpaths_to_read)} of {len(fpaths)} files"
+        )
+
+    for fpath in fpaths_to_read:
+        if fpath in read_endpoint_responses:
+            endpoint_responses = read_endpoint_responses.pop(fpath)
+        else:
+            response_cache = load_response_cache(fpath)
+            if response_cache is None:
+                continue
+            endpoint_responses = get_endpoint_responses(response_cache, endpoints_to_extract)
+        for key, api_provider, arguments, api_response in endpoint_responses:
+            if key not in endpoints_to_extract:
+                continue
+            _, endpoint, cache_subset_of_large_responses = outputs[key]
+            try:
+                level1_dict = cache_subset_of_large_responses.get(api_provider, {})
+                level2_dict = level1_dict.get(endpoint, {})
+                level2_dict[arguments] = api_response
+                level1_dict[endpoint] = level2_dict
+                cache_subset_of_large_responses[api_provider] = level1_dict
+            except KeyError:
+                print(api_response)
+            except BaseException:
+                print("Not KeyError", api_response)
+
+    for key, (output_fpath, _, cache_subset_of_large_responses) in outputs.items():
+        if key in endpoints_to_extract:
+            with open(output_fpath, "w") as f:
+                json_codec.dump(cache_subset_of_large_responses, f)
+            if response_store is not None:
+                response_store.replace_endpoint_data(cache_subset_of_large_responses, *key)
+    if response_store is not None:
+        response_store.close()
+
+    if manifest_path is not None:
+        for key, (output_fpath, _, cache_subset_of_large_responses) in outputs.items():
+            if key not in endpoints_to_extract:
+                continue
+            extracted_files[output_fpath] = get_file_signature(output_fpath)
+            # the output files are response cache files too when they are in the same directory
+            if os.path.abspath(os.path.dirname(output_fpath)) == os.path.abspath(
+                path_to_large_response_directory
+            ):
+                new_file_entries[
+                    os.path.join(
+                        path_to_large_response_directory, os.path.basename(output_fpath)
+                    )
+                ] = {
+                    "signature": extracted_files[output_fpath],
+                    "endpoints": [list(key)] if cache_subset_of_large_responses else [],
+                }
+        manifest["response_cache_files"] = new_file_entries
+        manifest["extracted_files"] = extracted_files
+        save_manifest(manifest, manifest_path)
+
+# tokenizer used for counting the tokens of the data subsets unless another one is given
+DEFAULT_TOKENIZER_MODEL = "meta-llama/llama-3.1-70b-instruct"
+
+
+def get_data_subset_file_name(
+    host: str,
+    endpoint_name: str,
+    token_limit: Any,
+    tokenizer_model_name: str = DEFAULT_TOKENIZER_MODEL,
+) -> str:
+    if tokenizer_model_name == DEFAULT_TOKENIZER_MODEL:
+        return f"{host}_{endpoint_name}_subset_{token_limit}.json"
+    return f"{host}_{endpoint_name}_{tokenizer_model_name.replace('/', '_')}_subset_{token_limit}.json"
+
+
+class DataSubsetWriter:
+    """Write a data subset file of the form {random_seed: {app: {endpoint: {query_args: record}}}}
+    one random seed at a time, so that only the subset being written is held in memory.
+    The file content is the same as json.dump(dataset, f, indent=4) of the whole dataset.
+    """
+
+    def __init__(self, fpath: str) -> None:
+        self._file = open(fpath, "w")
+        self._num_written = 0
+
+    def __enter__(self) -> "DataSubsetWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def write(self, random_seed: Any, subset: Any) -> None:
+        self._file.write("{\n" if self._num_written == 0 else ",\n")
+        self._file.write(f"    {json.dumps(str(random_seed))}: ")
+        self._file.write(json_codec.dumps(subset, indent=4).replace("\n", "\n    "))
+        self._num_written += 1
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._file.write("{}" if self._num_written == 0 else "\n}")
+        self._file.close()
+
+
+class LargeResponsesWriter:
+    """Write a file of the form {host: {endpoint: {arguments: api_response}}} from responses added
+    one at a time, as json.dump(large_responses, f, indent=4) of the whole dict would. The responses
+    are serialized to a temporary file when added and only their keys and offsets are held in
+    memory. As in a dict, a response added again for the same endpoint and arguments replaces the
+    previous one in its position.
+    """
+
+    def __init__(self, fpath: str, host: str) -> None:
+        self._fpath = fpath
+        self._host = host
+        self._spool = tempfile.TemporaryFile()
+        self._offsets: dict[str, dict[str, tuple[int, int]]] = {}
+
+    def __enter__(self) -> "LargeResponsesWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def add(self, endpoint: str, arguments: str, api_response: Any) -> None:
+        data = json_codec.dumps(api_response, indent=4).replace("\n", "\n" + " " * 12)
+        data_bytes = data.encode("utf-8")
+        offset = self._spool.seek(0, os.SEEK_END)
+        self._spool.write(data_bytes)
+        self._offsets.setdefault(endpoint, {})[arguments] = (offset, len(data_bytes))
+
+    def close(self) -> None:
+        if self._spool.closed:
+            return
+        with open(self._fpath, "w") as f:
+            f.write(f"{{\n    {json.dumps(self._host)}: ")
+            if len(self._offsets) == 0:
+                f.write("{}")
+            else:
+                f.write("{")
+                for i, (endpoint, arguments_offsets) in enumerate(self._offsets.items()):
+                    f.write(f"{',' if i > 0 else ''}\n        {json.dumps(endpoint)}: {{")
+                    for j, (arguments, (offset, length)) in enumerate(
+                        arguments_offsets.items()
+                    ):
+                        self._spool.seek(offset)
+                        api_response = self._spool.read(length).decode("utf-8")
+                        f.write(
+                            f"{',' if j > 0 else ''}\n            {json.dumps(arguments)}: {api_response}"
+                        )
+                    f.write("\n        }")
+                f.write("\n    }")
+            f.write("\n}")
+        self._spool.close()
+
+
+# {(id of an api response, index): (api response, manipulated response)} of the latest calls of
+# manipulate_response, so that all the tasks share the manipulated response of an api response
+_manipulated_responses: OrderedDict[tuple[int, int], tuple[Any, Any]] = OrderedDict()
+_max_manipulated_responses = 8
+
 
 def manipulate_response(api_response: Any, index: int) -> Any:
-    # create a new dictionary such that the first element from this dictionary is moved to the position `index`
+    """
+    Create a new dictionary such that the first element from this dictionary is moved to the
+    position `index`. The records are not copied: the new dictionary has the same record objects
+    as api_response, which must not be modified. The same dictionary is returned for the same
+    api_response object and index, e.g. for all the tasks of a task list.
+    """
     if index == 0:
         return api_response
+    key = (id(api_response), index)
+    if key in _manipulated_responses and _manipulated_responses[key][0] is api_response:
+        _manipulated_responses.move_to_end(key)
+        return _manipulated_responses[key][1]
     manipulated_response = {}
     query_args_list = list(api_response.keys())
     for i in range(1, index + 1):
-        manipulated_response[query_args_list[i]] = copy.deepcopy(
-            api_response[query_args_list[i]]
-        )
-    manipulated_response[query_args_list[0]] = copy.deepcopy(
-        api_response[query_args_list[0]]
-    )
+        manipulated_response[query_args_list[i]] = api_response[query_args_list[i]]
+    manipulated_response[query_args_list[0]] = api_response[query_args_list[0]]
     for i in range(index + 1, len(query_args_list)):
-        manipulated_response[query_args_list[i]] = copy.deepcopy(
-            api_response[query_args_list[i]]
-        )
+        manipulated_response[query_args_list[i]] = api_response[query_args_list[i]]
 
+    _manipulated_responses[key] = (api_response, manipulated_response)
+    while len(_manipulated_responses) > _max_manipulated_responses:
+        _manipulated_responses.popitem(last=False)
     return manipulated_response
 
 class LLM_Options(Enum):
@@ -111,7 +381,7 @@ def get_lm_gpt(model_id:str) -> AzureOpenAI:
 def generate(
     llm: Any,
     model_name: str,
-    prompts: list[str] | str,
+    prompts: list[str | dict[str, Any]] | str,
     temperature: float = 0,
     max_tokens: int = 256,
     stop: Any = None,
@@ -145,6 +415,7 @@ def generate(
         import gc
         import torch
         sampling_params = SamplingParams(temperature=temperature, max_tokens=max_tokens)
+        # the prompts are either text or {"prompt_token_ids": token IDs} (see prompt_tokens.py)
         completions = llm.generate(
             prompts,
             sampling_params)
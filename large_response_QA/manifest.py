@@ -0,0 +1,37 @@
+import hashlib
+import os
+from typing import Any
+
+from . import json_codec
+
+# Manifests record the inputs, settings and intermediate results (e.g. token counts) of the steps of
+# the data pipeline, so that rerunning a step only processes what changed since its previous run.
+# They are JSON files with the .manifest extension, so that they are not taken for data files.
+MANIFEST_EXTENSION = ".manifest"
+
+
+def get_file_signature(fpath: str) -> list[int]:
+    stat = os.stat(fpath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get_text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def load_manifest(fpath: str) -> dict[str, Any]:
+    if not os.path.exists(fpath):
+        return {}
+    try:
+        return json_codec.load_file(fpath)
+    except ValueError:
+        # an unreadable manifest only means that everything is processed again
+        print(f"Ignoring the manifest {fpath} that cannot be read")
+        return {}
+
+
+def save_manifest(manifest: dict[str, Any], fpath: str) -> None:
+    tmp_fpath = fpath + ".tmp"
+    with open(tmp_fpath, "w") as f:
+        json_codec.dump(manifest, f)
+    os.replace(tmp_fpath, fpath)
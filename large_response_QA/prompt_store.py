@@ -0,0 +1,315 @@
+import gzip
+import hashlib
+import importlib
+import itertools
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Iterator, Optional, Type
+
+from . import json_codec
+from .manifest import MANIFEST_EXTENSION, get_file_signature, load_manifest, save_manifest
+from .qa_store import QASet, get_task_code_hash, get_task_qa_samples, iter_endpoint_responses
+from .serializers import ResponseFormat, get_response_format
+
+# The prompts of a task list for a token limit and a position are the same for all the models
+# with the same response format, so they can be materialized once, e.g. on CPU nodes, into a
+# prompts file that the model runs stream the prompts from, without the data subsets or creating
+# the QA samples. A prompts file is a gzipped JSONL file named after the SHA-1 of its content,
+# whose first line is a header with the settings of the prompts. Each of the next lines holds
+# the prompts about one api response:
+# {"instructions": ..., "response_part": ..., "record_offsets": see Task.get_record_offsets,
+#  "prompts": [{"question_part": ..., "questions": [[sample ID, task, question, gold answer], ...]},
+#  ...], "api_response": the api response of the prompts}
+# where a prompt is "".join((instructions, response_part, question_part)) (see
+# Task.get_prompt_parts) and a prompt has several questions in the multi-question mode. The
+# "api_response" is only written when it cannot be loaded back from the serialization in the
+# response_part, e.g. for the YAML format or with tuples that JSON loads as lists. The sample
+# ID of a question, <token limit>/<position>/<random seed>/<app>/<endpoint>/<task>/<number of the
+# QA sample of the task>, is the same in both modes and in all the materializations of the prompts.
+# The prompts files of a directory are listed in its prompts.manifest by the settings of their
+# prompts; see PromptStore.
+PROMPTS_FILE_EXTENSION = ".jsonl.gz"
+PROMPTS_FILE_VERSION = 2
+PROMPTS_MANIFEST_NAME = "prompts" + MANIFEST_EXTENSION
+
+
+def get_prompt_code_hash() -> str:
+    """A hash of the code that creates the prompts: the tasks and the serialization of responses."""
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sha1 = hashlib.sha1(get_task_code_hash().encode("utf-8"))
+    for filename in ("json_codec.py", "serialization_cache.py", "serializers.py"):
+        with open(os.path.join(package_dir, filename), "rb") as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+def get_task_path(task: Type[Any]) -> str:
+    return f"{task.__module__}.{task.__qualname__}"
+
+
+@lru_cache(maxsize=None)
+def load_task_class(task_path: str) -> Type[Any]:
+    """The task class of get_task_path."""
+    module_name, _, class_name = task_path.rpartition(".")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+@dataclass
+class MaterializedPrompt:
+    question_part: str
+    # [(sample ID, task path, question, gold answer), ...] in the order of their numbers
+    questions: list[tuple[str, str, str, Any]]
+
+
+@dataclass
+class PromptGroup:
+    """The materialized prompts about one api response, in the order of the prompts file."""
+
+    api_response: Any
+    instructions: str
+    response_part: str
+    record_offsets: Optional[list[tuple[str, int, int]]]
+    prompts: list[MaterializedPrompt]
+    multi_question: bool = False
+
+    def get_prompt_parts(self, prompt: MaterializedPrompt) -> tuple[str, str, str]:
+        return self.instructions, self.response_part, prompt.question_part
+
+    def get_generation_batches(self) -> list[list[MaterializedPrompt]]:
+        """
+        The prompts that are generated together, like in run_experiments.py: the prompts of each
+        task in the single-question mode, all of them in the multi-question mode.
+        """
+        if self.multi_question:
+            return [self.prompts] if len(self.prompts) > 0 else []
+        batches: list[list[MaterializedPrompt]] = []
+        for prompt in self.prompts:
+            if len(batches) > 0 and batches[-1][0].questions[0][1] == prompt.questions[0][1]:
+                batches[-1].append(prompt)
+            else:
+                batches.append([prompt])
+        return batches
+
+
+def load_response_part(response_part: str, response_format: ResponseFormat) -> Any:
+    """
+    The api response serialized in the response_part of a prompt (see Task.get_prompt_parts), or
+    None if the response format cannot be loaded.
+    """
+    if response_format.loads is None:
+        return None
+    # the response part ends with the closing of its code block
+    end = response_part.rfind("\n```")
+    try:
+        return response_format.loads(response_part[:end])
+    except ValueError:
+        return None
+
+
+def get_prompts_key(
+    task_list_name: str,
+    token_limit: Any,
+    position: int,
+    response_format: str,
+    multi_question: bool,
+    max_questions_per_prompt: Optional[int],
+    subset_tokenizer_model_name: Optional[str],
+) -> str:
+    """The key of the prompts of these settings in the prompts.manifest of a prompts directory."""
+    return json.dumps(
+        [
+            task_list_name,
+            str(token_limit),
+            position,
+            response_format,
+            multi_question,
+            max_questions_per_prompt,
+            subset_tokenizer_model_name,
+        ]
+    )
+
+
+def iter_prompt_lines(
+    task_list: Any,
+    token_limit: Any,
+    position: int,
+    multi_question: bool = False,
+    qa_set: Optional[QASet] = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    The lines of the prompts file of task_list for the position, in the multi-question mode or
+    not, with the materialized QA samples of qa_set if given.
+    """
+    for random_seed, app, endpoint, query_info in iter_endpoint_responses(task_list):
+        endpoint_qa_samples = (
+            qa_set.get(random_seed, app, endpoint, position) if qa_set is not None else None
+        )
+        sample_id_prefix = f"{token_limit}/{position}/{random_seed}/{app}/{endpoint}"
+        task_qa_samples = []
+        sample_ids = []
+        for task in task_list.task_list:
+            task_obj = task_list.create_task(task)
+            qa_samples = get_task_qa_samples(task_obj, query_info, position, endpoint_qa_samples)
+            for i, qa_sample in enumerate(qa_samples):
+                task_qa_samples.append((task_obj, qa_sample))
+                sample_ids.append(f"{sample_id_prefix}/{task.__name__}/{i}")
+        sample_id_by_sample = {
+            id(qa_sample): sample_id
+            for (_, qa_sample), sample_id in zip(task_qa_samples, sample_ids)
+        }
+        if multi_question:
+            prompts = task_list.get_multi_question_prompt_parts(task_qa_samples)
+        else:
+            prompts = [
+                (task_obj.get_prompt_parts(qa_sample), [(task_obj, qa_sample)])
+                for task_obj, qa_sample in task_qa_samples
+            ]
+        # the prompts with the same instructions and api response parts, usually all of them
+        lines: dict[tuple[str, str], dict[str, Any]] = {}
+        for (instructions, response_part, question_part), questions in prompts:
+            task_obj, qa_sample = questions[0]
+            if (instructions, response_part) not in lines:
+                lines[(instructions, response_part)] = {
+                    "instructions": instructions,
+                    "response_part": response_part,
+                    "record_offsets": task_obj.get_record_offsets(qa_sample),
+                    "prompts": [],
+                }
+                loaded_response = load_response_part(response_part, task_obj.response_format)
+                if loaded_response != qa_sample.api_response:
+                    lines[(instructions, response_part)]["api_response"] = qa_sample.api_response
+            lines[(instructions, response_part)]["prompts"].append(
+                {
+                    "question_part": question_part,
+                    "questions": [
+                        [
+                            sample_id_by_sample[id(qa_sample)],
+                            get_task_path(type(task_obj)),
+                            qa_sample.question,
+                            qa_sample.gold_answer,
+                        ]
+                        for task_obj, qa_sample in questions
+                    ],
+                }
+            )
+        yield from lines.values()
+
+
+class PromptStore:
+    """
+    A directory of prompts files, listed in its prompts.manifest by the key of the settings of
+    their prompts (see get_prompts_key) with the data subset file and the code they were
+    materialized from. Identical prompts files are only saved once.
+    """
+
+    def __init__(self, prompt_dir: str) -> None:
+        self.prompt_dir = prompt_dir
+        self.manifest_path = os.path.join(prompt_dir, PROMPTS_MANIFEST_NAME)
+        os.makedirs(prompt_dir, exist_ok=True)
+
+    def get_prompts_path(self, key: str, data_file_path: Optional[str] = None) -> Optional[str]:
+        """
+        The path of the prompts file of key, or None if it was not materialized. If the data
+        subset file data_file_path is there, the prompts file must have been materialized from
+        it and from the current code; otherwise, e.g. on a node with only the prompts, the
+        prompts file is used as it is.
+        """
+        entry = load_manifest(self.manifest_path).get(key)
+        if entry is None:
+            return None
+        fpath = os.path.join(self.prompt_dir, entry["file"])
+        if not os.path.exists(fpath):
+            return None
+        if data_file_path is not None and os.path.exists(data_file_path):
+            if (
+                entry["data_file"] != os.path.basename(data_file_path)
+                or entry["data_signature"] != get_file_signature(data_file_path)
+                or entry["code_hash"] != get_prompt_code_hash()
+            ):
+                return None
+        return fpath
+
+    def save_prompts(
+        self,
+        key: str,
+        task_list: Any,
+        data_file_path: str,
+        token_limit: Any,
+        position: int,
+        multi_question: bool = False,
+        qa_set: Optional[QASet] = None,
+    ) -> str:
+        """Materialize the prompts of key into a prompts file and return its path."""
+        header = {
+            "version": PROMPTS_FILE_VERSION,
+            "task_list": type(task_list).__name__,
+            "token_limit": str(token_limit),
+            "position": position,
+            "response_format": task_list.response_format,
+            "multi_question": multi_question,
+            "max_questions_per_prompt": task_list.max_questions_per_prompt,
+        }
+        tmp_fpath = os.path.join(self.prompt_dir, f"prompts.{os.getpid()}.tmp")
+        sha1 = hashlib.sha1()
+        num_prompts = 0
+        try:
+            # without the modification time in the gzip header, the same prompts give the same file
+            with gzip.GzipFile(tmp_fpath, "wb", mtime=0) as f:
+                lines = iter_prompt_lines(task_list, token_limit, position, multi_question, qa_set)
+                for line in itertools.chain([header], lines):
+                    data = (json_codec.dumps(line, separators=(",", ":")) + "\n").encode("utf-8")
+                    sha1.update(data)
+                    f.write(data)
+                    num_prompts += len(line.get("prompts", []))
+            file_name = sha1.hexdigest() + PROMPTS_FILE_EXTENSION
+            os.replace(tmp_fpath, os.path.join(self.prompt_dir, file_name))
+        except BaseException:
+            if os.path.exists(tmp_fpath):
+                os.remove(tmp_fpath)
+            raise
+        manifest = load_manifest(self.manifest_path)
+        manifest[key] = {
+            "file": file_name,
+            "data_file": os.path.basename(data_file_path),
+            "data_signature": get_file_signature(data_file_path),
+            "code_hash": get_prompt_code_hash(),
+            "num_prompts": num_prompts,
+        }
+        save_manifest(manifest, self.manifest_path)
+        print(f"Saved {num_prompts} prompts to {file_name}")
+        return os.path.join(self.prompt_dir, file_name)
+
+
+def iter_prompt_groups(fpath: str) -> Iterator[PromptGroup]:
+    """Stream the PromptGroups of a prompts file."""
+    with gzip.open(fpath, "rt", encoding="utf-8") as f:
+        header = json_codec.loads(f.readline())
+        if header.get("version") not in (1, PROMPTS_FILE_VERSION):
+            raise ValueError(f"Unknown version of the prompts file {fpath}")
+        response_format = get_response_format(header["response_format"])
+        for line in f:
+            group = json_codec.loads(line)
+            yield PromptGroup(
+                api_response=(
+                    group["api_response"]
+                    if "api_response" in group
+                    else load_response_part(group["response_part"], response_format)
+                ),
+                instructions=group["instructions"],
+                response_part=group["response_part"],
+                record_offsets=(
+                    None
+                    if group["record_offsets"] is None
+                    else [tuple(offsets) for offsets in group["record_offsets"]]
+                ),
+                prompts=[
+                    MaterializedPrompt(
+                        question_part=prompt["question_part"],
+                        questions=[tuple(question) for question in prompt["questions"]],
+                    )
+                    for prompt in group["prompts"]
+                ],
+                multi_question=header["multi_question"],
+            )
@@ -0,0 +1,253 @@
+import os
+from collections import OrderedDict
+from typing import Any, Optional, Union
+
+import numpy as np
+
+from .manifest import get_text_hash
+from .tasks.task_list import get_tokenizer
+
+# The prompts of the vLLM inference can be given as token IDs instead of text. The api response
+# part of a prompt (see Task.get_prompt_parts) is the same for all the questions about an api
+# response, so it is only tokenized once: its token IDs are saved as a .npy file in the cache
+# directory and memory-mapped when they are used again, by any worker process or later run.
+# The question parts are short and tokenized for each prompt.
+# When the character offsets of the records in the api response part are known (see
+# SerializationCache.get_record_offsets), its token IDs are instead joined from the token IDs
+# of the records, which are tokenized once for all the positions of the records.
+PROMPT_TOKEN_IDS_DTYPE = np.int32
+# number of characters on each side of a boundary between the parts whose token IDs are joined
+# that can change the tokens around it, e.g. the end of a record, the separator and the
+# indentation of the next record
+RECORD_BOUNDARY_CONTEXT_CHARS = 8
+
+
+class PromptTokenCache:
+    """
+    Splices the token IDs of the parts of the prompts for model_name's tokenizer. The first time
+    an api response part is tokenized, the spliced token IDs of its prompt are checked against
+    the tokenization of the full prompt text. The token IDs of the api response part are only
+    cached (and used) if they match; otherwise its prompts are passed as text, which the
+    inference engine tokenizes as before. As the api response part ends with the closing of
+    its code block and all the question parts start with "Question:", the check of one prompt
+    holds for the other questions about the same api response.
+    The token IDs joined from the records of an api response part are checked the same way,
+    and the api response part is tokenized as a whole if they do not match. As the tokens only
+    change around the boundaries of the joined parts, the result of the check is kept, in the
+    cache directory, for the text around the boundaries, which is the same for the prompts of
+    most orders of the same records.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: str,
+        max_loaded_responses: int = 64,
+        max_chunk_chars: int = 64_000_000,
+    ) -> None:
+        self.model_name = model_name
+        self.cache_dir = os.path.join(cache_dir, model_name.replace("/", "_"))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_loaded_responses = max_loaded_responses
+        self.max_chunk_chars = max_chunk_chars
+        self.num_spliced_prompts = 0
+        self.num_text_prompts = 0
+        self._tokenizer = get_tokenizer(model_name)
+        # {instructions part: its token IDs}, there is one per response format
+        self._instructions_token_ids: dict[str, list[int]] = {}
+        # {hash of the instructions and api response parts: token IDs of the api response part,
+        # or None if its spliced token IDs did not match}
+        self._response_token_ids: OrderedDict[str, Any] = OrderedDict()
+        # {text of a record and the separator after it: its token IDs}
+        self._chunk_token_ids: OrderedDict[str, list[int]] = OrderedDict()
+        self._num_chunk_chars = 0
+        # {hash of the text around the boundaries of the joined parts: whether the token IDs
+        # joined from the records match the tokenization of the full prompt}
+        self._can_join_records: OrderedDict[str, bool] = OrderedDict()
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {
+            "model_name": self.model_name,
+            "cache_dir": os.path.dirname(self.cache_dir),
+            "max_loaded_responses": self.max_loaded_responses,
+            "max_chunk_chars": self.max_chunk_chars,
+        }
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__init__(**state)  # type: ignore[misc]
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:
+        return self._tokenizer.encode(text, add_special_tokens=add_special_tokens)
+
+    def _encode_instructions(self, instructions: str) -> list[int]:
+        if instructions not in self._instructions_token_ids:
+            # the special tokens, e.g. the BOS token, are added at the start of the prompt
+            self._instructions_token_ids[instructions] = self.encode(
+                instructions, add_special_tokens=True
+            )
+        return self._instructions_token_ids[instructions]
+
+    def _get_response_token_ids(
+        self, instructions: str, api_response: str, question: str
+    ) -> Any:
+        key = get_text_hash(instructions + api_response)
+        if key in self._response_token_ids:
+            self._response_token_ids.move_to_end(key)
+            return self._response_token_ids[key]
+        fpath = os.path.join(self.cache_dir, f"{key}.npy")
+        if os.path.exists(fpath):
+            token_ids: Any = np.load(fpath, mmap_mode="r")
+        else:
+            token_ids = np.asarray(self.encode(api_response), dtype=PROMPT_TOKEN_IDS_DTYPE)
+            spliced_token_ids = (
+                self._encode_instructions(instructions)
+                + token_ids.tolist()
+                + self.encode(question)
+            )
+            full_token_ids = self.encode(
+                instructions + api_response + question, add_special_tokens=True
+            )
+            if spliced_token_ids == full_token_ids:
+                tmp_fpath = f"{fpath}.{os.getpid()}.tmp"
+                with open(tmp_fpath, "wb") as f:
+                    np.save(f, token_ids)
+                os.replace(tmp_fpath, fpath)
+            else:
+                print(
+                    f"The spliced token IDs of a prompt do not match its tokenization with the "
+                    f"tokenizer of {self.model_name}, its prompts are passed as text"
+                )
+                token_ids = None
+        self._response_token_ids[key] = token_ids
+        while len(self._response_token_ids) > self.max_loaded_responses:
+            self._response_token_ids.popitem(last=False)
+        return token_ids
+
+    def _encode_chunk(self, chunk: str) -> list[int]:
+        if chunk in self._chunk_token_ids:
+            self._chunk_token_ids.move_to_end(chunk)
+            return self._chunk_token_ids[chunk]
+        token_ids = self.encode(chunk)
+        self._chunk_token_ids[chunk] = token_ids
+        self._num_chunk_chars += len(chunk)
+        while len(self._chunk_token_ids) > 1 and self._num_chunk_chars > self.max_chunk_chars:
+            evicted_chunk, _ = self._chunk_token_ids.popitem(last=False)
+            self._num_chunk_chars -= len(evicted_chunk)
+        return token_ids
+
+    def get_response_token_ids(
+        self, api_response: str, record_offsets: list[tuple[str, int, int]]
+    ) -> tuple[list[int], list[tuple[str, int, int]]]:
+        """
+        The token IDs of an api response part joined from the token IDs of the text before its
+        first record and of each of its records with the text after it, up to the next record,
+        and the (query_args, start, end) token offsets of the records (with the text after them)
+        in the token IDs.
+        """
+        if len(record_offsets) == 0:
+            return self._encode_chunk(api_response), []
+        token_ids = list(self._encode_chunk(api_response[: record_offsets[0][1]]))
+        record_token_offsets = []
+        for i, (query_args, start, _) in enumerate(record_offsets):
+            end = record_offsets[i + 1][1] if i + 1 < len(record_offsets) else len(api_response)
+            chunk_token_ids = self._encode_chunk(api_response[start:end])
+            record_token_offsets.append(
+                (query_args, len(token_ids), len(token_ids) + len(chunk_token_ids))
+            )
+            token_ids.extend(chunk_token_ids)
+        return token_ids, record_token_offsets
+
+    def _get_record_boundaries_key(
+        self,
+        instructions: str,
+        api_response: str,
+        question: str,
+        record_offsets: list[tuple[str, int, int]],
+    ) -> str:
+        # the merges of the tokens across the records depend on their text, e.g. a string value
+        # ending with a space before the separator, so the text around each boundary is part of
+        # the key, in any order of the records
+        prompt = instructions + api_response + question
+        boundaries = [len(instructions), len(instructions) + len(api_response)] + [
+            len(instructions) + start for _, start, _ in record_offsets
+        ]
+        boundary_contexts = sorted(
+            {
+                prompt[max(0, boundary - RECORD_BOUNDARY_CONTEXT_CHARS) : boundary]
+                + "\0"
+                + prompt[boundary : boundary + RECORD_BOUNDARY_CONTEXT_CHARS]
+                for boundary in boundaries
+            }
+        )
+        return get_text_hash("\0".join([instructions] + boundary_contexts))
+
+    def _check_joined_records(
+        self,
+        instructions: str,
+        api_response: str,
+        question: str,
+        record_offsets: list[tuple[str, int, int]],
+    ) -> bool:
+        key = self._get_record_boundaries_key(
+            instructions, api_response, question, record_offsets
+        )
+        if key in self._can_join_records:
+            self._can_join_records.move_to_end(key)
+            return self._can_join_records[key]
+        fpath = os.path.join(self.cache_dir, f"{key}.joined")
+        if os.path.exists(fpath):
+            with open(fpath) as f:
+                can_join_records = f.read() == "1"
+        else:
+            response_token_ids, _ = self.get_response_token_ids(api_response, record_offsets)
+            can_join_records = self._encode_instructions(
+                instructions
+            ) + response_token_ids + self.encode(question) == self.encode(
+                instructions + api_response + question, add_special_tokens=True
+            )
+            if not can_join_records:
+                print(
+                    f"The token IDs joined from the records of a prompt do not match its "
+                    f"tokenization with the tokenizer of {self.model_name}, the api responses "
+                    f"with the same text around their records are tokenized as a whole"
+                )
+            tmp_fpath = f"{fpath}.{os.getpid()}.tmp"
+            with open(tmp_fpath, "w") as f:
+                f.write("1" if can_join_records else "0")
+            os.replace(tmp_fpath, fpath)
+        self._can_join_records[key] = can_join_records
+        while len(self._can_join_records) > self.max_loaded_responses:
+            self._can_join_records.popitem(last=False)
+        return can_join_records
+
+    def get_prompt(
+        self,
+        prompt_parts: tuple[str, str, str],
+        record_offsets: Optional[list[tuple[str, int, int]]] = None,
+    ) -> Union[str, dict[str, Any]]:
+        """
+        The prompt of Task.get_prompt_parts for vLLM: {"prompt_token_ids": token IDs}, or the
+        prompt text if its api response part cannot be spliced. With the record_offsets of
+        the api response part, its token IDs are joined from the token IDs of its records.
+        """
+        instructions, api_response, question = prompt_parts
+        if record_offsets is not None and self._check_joined_records(
+            instructions, api_response, question, record_offsets
+        ):
+            response_token_ids, _ = self.get_response_token_ids(api_response, record_offsets)
+            self.num_spliced_prompts += 1
+            return {
+                "prompt_token_ids": self._encode_instructions(instructions)
+                + response_token_ids
+                + self.encode(question)
+            }
+        token_ids = self._get_response_token_ids(instructions, api_response, question)
+        if token_ids is None:
+            self.num_text_prompts += 1
+            return "".join(prompt_parts)
+        self.num_spliced_prompts += 1
+        return {
+            "prompt_token_ids": self._encode_instructions(instructions)
+            + token_ids.tolist()
+            + self.encode(question)
+        }
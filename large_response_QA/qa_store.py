@@ -0,0 +1,257 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+
+from .large_response_utils import manipulate_response
+from .manifest import get_file_signature
+from .subset_store import BinaryDataSubset, BinaryEndpointResponses
+from .tasks.data_structures import LongResponseQASample
+
+# The questions and gold answers of the tasks of a task list only depend on the data subset file,
+# the code of the tasks and the position of the answer record, not on the model. They are
+# materialized once into a QA file next to the data subset file, with the .qa.jsonl extension,
+# and loaded by the runs of all the models instead of calling get_qa_samples again.
+# The first line of a QA file is a header with the task list, the signature of the data subset
+# file and a hash of the code of the tasks; the QA file is materialized again when one of them
+# changes. Each of the next lines holds the QA samples of one api response and position:
+# [random_seed, app, endpoint, position, answer record key, [[task, question, gold answer], ...]]
+# where the answer record key is the query_args of the record that the questions are about, the
+# first record of the api response, which manipulate_response moves to the position.
+QA_FILE_EXTENSION = ".qa.jsonl"
+QA_FILE_VERSION = 1
+
+
+def get_qa_file_path(data_file_path: str) -> str:
+    return data_file_path + QA_FILE_EXTENSION
+
+
+def get_task_code_hash() -> str:
+    """A hash of the code that creates the QA samples: the tasks package and manipulate_response."""
+    tasks_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks")
+    sha1 = hashlib.sha1()
+    for filename in sorted(os.listdir(tasks_dir)):
+        if filename.endswith(".py"):
+            sha1.update(filename.encode("utf-8"))
+            with open(os.path.join(tasks_dir, filename), "rb") as f:
+                sha1.update(f.read())
+    sha1.update(inspect.getsource(manipulate_response).encode("utf-8"))
+    return sha1.hexdigest()
+
+
+@dataclass
+class EndpointQASamples:
+    # the query_args of the first record of the api response, None if it has no records
+    record_key: Optional[str]
+    # {task name: [(question, gold answer), ...]}
+    samples: dict[str, list[tuple[str, Any]]]
+
+    def get_qa_samples(
+        self, task: Any, api_response: Any, index: int
+    ) -> Optional[list[LongResponseQASample]]:
+        """
+        The QA samples of task for api_response at position index, as task.get_qa_samples
+        returns them, or None if api_response is not the one they were materialized for.
+        """
+        if next(iter(api_response), None) != self.record_key:
+            return None
+        samples = self.samples.get(type(task).__name__, [])
+        if len(samples) == 0:
+            # there are no samples for the positions out of the api response
+            return []
+        manipulated_response = manipulate_response(api_response, index)
+        return [
+            LongResponseQASample(
+                api_response=manipulated_response, question=question, gold_answer=gold_answer
+            )
+            for question, gold_answer in samples
+        ]
+
+
+class QASet:
+    """The EndpointQASamples of the api responses of a data subset file by position."""
+
+    def __init__(self, num_positions: int) -> None:
+        self.num_positions = num_positions
+        # {(random_seed, app, endpoint, position): EndpointQASamples}
+        self._endpoint_samples: dict[tuple[str, str, str, int], EndpointQASamples] = {}
+
+    def __len__(self) -> int:
+        return len(self._endpoint_samples)
+
+    def add(
+        self, random_seed: str, app: str, endpoint: str, position: int, samples: EndpointQASamples
+    ) -> None:
+        self._endpoint_samples[(random_seed, app, endpoint, position)] = samples
+
+    def get(
+        self, random_seed: str, app: str, endpoint: str, position: int
+    ) -> Optional[EndpointQASamples]:
+        return self._endpoint_samples.get((random_seed, app, endpoint, position))
+
+    def items(self) -> Iterator[tuple[tuple[str, str, str, int], EndpointQASamples]]:
+        return iter(self._endpoint_samples.items())
+
+
+def _get_header(task_list: Any, data_file_path: str, num_positions: int) -> dict[str, Any]:
+    return {
+        "version": QA_FILE_VERSION,
+        "task_list": type(task_list).__name__,
+        "tasks": [task.__name__ for task in task_list.task_list],
+        "data_signature": get_file_signature(data_file_path),
+        "code_hash": get_task_code_hash(),
+        "num_positions": num_positions,
+    }
+
+
+def iter_endpoint_responses(task_list: Any) -> Iterator[tuple[str, str, str, Any]]:
+    """The (random_seed, app, endpoint, {query_args: record}) api responses of task_list."""
+    for random_seed in task_list.api_response:
+        if isinstance(task_list.api_response, BinaryDataSubset):
+            data = task_list.api_response.endpoint_responses(random_seed)
+        else:
+            data = task_list.api_response[random_seed]
+        for app, endpoint_info in data.items():
+            for endpoint, endpoint_responses in endpoint_info.items():
+                if isinstance(endpoint_responses, BinaryEndpointResponses):
+                    yield random_seed, app, endpoint, endpoint_responses.load()
+                else:
+                    yield random_seed, app, endpoint, endpoint_responses
+
+
+def materialize_qa_samples(task_list: Any, num_positions: int) -> QASet:
+    """The QA samples of the tasks of task_list for its api responses and the positions."""
+    qa_set = QASet(num_positions)
+    for random_seed, app, endpoint, query_info in iter_endpoint_responses(task_list):
+        record_key = next(iter(query_info), None)
+        for position in range(num_positions):
+            samples = {}
+            for task in task_list.task_list:
+                task_obj = task_list.create_task(task)
+                qa_samples = task_obj.get_qa_samples(query_info, index=position)
+                for qa_sample in qa_samples:
+                    manipulated_response = manipulate_response(query_info, position)
+                    if qa_sample.api_response is not manipulated_response and list(
+                        qa_sample.api_response
+                    ) != list(manipulated_response):
+                        raise ValueError(
+                            f"The QA samples of {task.__name__} are not about the api response "
+                            f"at position {position}, they cannot be materialized"
+                        )
+                samples[task.__name__] = [
+                    (qa_sample.question, qa_sample.gold_answer) for qa_sample in qa_samples
+                ]
+            qa_set.add(
+                random_seed, app, endpoint, position, EndpointQASamples(record_key, samples)
+            )
+    return qa_set
+
+
+def save_qa_set(qa_set: QASet, header: dict[str, Any], fpath: str) -> None:
+    tmp_fpath = f"{fpath}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_fpath, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header, separators=(",", ":")) + "\n")
+            for (random_seed, app, endpoint, position), endpoint_samples in qa_set.items():
+                samples = [
+                    [task_name, question, gold_answer]
+                    for task_name, task_samples in endpoint_samples.samples.items()
+                    for question, gold_answer in task_samples
+                ]
+                line = [random_seed, app, endpoint, position, endpoint_samples.record_key, samples]
+                f.write(json.dumps(line, separators=(",", ":"), ensure_ascii=False) + "\n")
+    except BaseException:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
+        raise
+    os.replace(tmp_fpath, fpath)
+
+
+def load_qa_set(header: dict[str, Any], fpath: str) -> Optional[QASet]:
+    """
+    The QA set of the QA file, or None if there is no QA file or it was materialized for
+    another header, i.e. another task list, data subset file or code of the tasks, or for
+    fewer positions.
+    """
+    if not os.path.exists(fpath):
+        return None
+    try:
+        with open(fpath, encoding="utf-8") as f:
+            file_header = json.loads(f.readline())
+            if any(
+                file_header.get(key) != value
+                for key, value in header.items()
+                if key != "num_positions"
+            ) or file_header["num_positions"] < header["num_positions"]:
+                return None
+            qa_set = QASet(file_header["num_positions"])
+            for line in f:
+                random_seed, app, endpoint, position, record_key, samples = json.loads(line)
+                task_samples: dict[str, list[tuple[str, Any]]] = {
+                    task_name: [] for task_name in header["tasks"]
+                }
+                for task_name, question, gold_answer in samples:
+                    task_samples[task_name].append((question, gold_answer))
+                qa_set.add(
+                    random_seed,
+                    app,
+                    endpoint,
+                    position,
+                    EndpointQASamples(record_key, task_samples),
+                )
+    except (ValueError, KeyError, TypeError):
+        # an unreadable QA file only means that the QA samples are materialized again
+        print(f"Ignoring the QA file {fpath} that cannot be read")
+        return None
+    return qa_set
+
+
+def get_task_qa_samples(
+    task_obj: Any,
+    api_response: Any,
+    index: int,
+    endpoint_qa_samples: Optional[EndpointQASamples] = None,
+) -> list[LongResponseQASample]:
+    """
+    The QA samples of a task for the api response at position index, from its materialized QA
+    samples if they are given, or created by the task.
+    """
+    if endpoint_qa_samples is not None:
+        qa_samples = endpoint_qa_samples.get_qa_samples(task_obj, api_response, index)
+        if qa_samples is not None:
+            return qa_samples
+    return task_obj.get_qa_samples(api_response, index=index)
+
+
+def get_qa_set(task_list: Any, data_file_path: str, num_positions: int) -> QASet:
+    """
+    The QA samples of the tasks of task_list, created from its data subset file data_file_path,
+    for the positions up to num_positions, loaded from the QA file of the data subset file or
+    materialized and saved to it.
+    """
+    header = _get_header(task_list, data_file_path, num_positions)
+    fpath = get_qa_file_path(data_file_path)
+    qa_set = load_qa_set(header, fpath)
+    if qa_set is not None:
+        print(f"Loaded the materialized QA samples from {fpath}")
+        return qa_set
+    qa_set = materialize_qa_samples(task_list, num_positions)
+    try:
+        save_qa_set(qa_set, header, fpath)
+        print(f"Saved the materialized QA samples to {fpath}")
+    except (OSError, TypeError, ValueError) as e:
+        # e.g. a read-only data directory, the QA samples are then only used by this run
+        print(f"The QA samples cannot be saved to {fpath}: {e}")
+    return qa_set
+
+
+if __name__ == "__main__":
+    # python -m large_response_QA.qa_store <task list> <number of positions> <data subset files>
+    from .tasks import task_list as task_list_module
+
+    task_list_class = getattr(task_list_module, sys.argv[1])
+    for data_file_path in sys.argv[3:]:
+        get_qa_set(task_list_class(data_file_path), data_file_path, int(sys.argv[2]))
@@ -0,0 +1,204 @@
+import sqlite3
+import time
+import zlib
+from typing import Any, Iterable, Mapping
+
+from . import json_codec
+
+# A response store is an SQLite file with the {host: {endpoint: {query_args: response}}} api
+# responses of the data files. The responses are compressed and indexed by host and endpoint,
+# which the data extraction replaces and the task lists and the data subset creation read, and
+# the token counts of the records are kept per tokenizer and code of the record cleanup (see
+# TaskList.prepare_subset_record), whose output is what is tokenized.
+RESPONSE_STORE_EXTENSION = ".sqlite"
+# the version of the schema, the tables of the previous versions are dropped
+_SCHEMA_VERSION = 2
+
+_SCHEMA = """
+DROP TABLE IF EXISTS entity_keys;
+DROP INDEX IF EXISTS responses_canonical_args;
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    query_args TEXT NOT NULL,
+    response BLOB NOT NULL,
+    UNIQUE (host, endpoint, query_args)
+);
+CREATE INDEX IF NOT EXISTS responses_endpoint ON responses (lower(host), lower(endpoint));
+CREATE TABLE IF NOT EXISTS token_counts (
+    response_id INTEGER NOT NULL REFERENCES responses (id) ON DELETE CASCADE,
+    tokenizer TEXT NOT NULL,
+    code_hash TEXT NOT NULL,
+    num_tokens INTEGER NOT NULL,
+    PRIMARY KEY (response_id, tokenizer, code_hash)
+);
+CREATE TABLE IF NOT EXISTS endpoints (
+    host TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    num_responses INTEGER NOT NULL,
+    updated_at_ns INTEGER NOT NULL,
+    PRIMARY KEY (host, endpoint)
+);
+"""
+
+
+def is_response_store(fpath: str) -> bool:
+    return fpath.endswith(RESPONSE_STORE_EXTENSION)
+
+
+class ResponseStore:
+    def __init__(self, fpath: str) -> None:
+        self.fpath = fpath
+        self._connection = sqlite3.connect(fpath)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        (schema_version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if schema_version != _SCHEMA_VERSION:
+            # the token counts of the previous versions are not keyed by the cleanup code
+            self._connection.execute("DROP TABLE IF EXISTS token_counts")
+        self._connection.executescript(_SCHEMA)
+        self._connection.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+    def __enter__(self) -> "ResponseStore":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _update_endpoint(self, host: str, endpoint: str) -> None:
+        (num_responses,) = self._connection.execute(
+            "SELECT count(*) FROM responses WHERE host = ? AND endpoint = ?",
+            (host, endpoint),
+        ).fetchone()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO endpoints VALUES (?, ?, ?, ?)",
+            (host, endpoint, num_responses, time.time_ns()),
+        )
+
+    def add_responses(
+        self, host: str, endpoint: str, responses: Mapping[str, Any]
+    ) -> None:
+        """
+        Add the {query_args: response} responses of an endpoint. As in a dict, the response of
+        query args that are already in the store is replaced and keeps its position.
+        """
+        with self._connection:
+            for query_args, response in responses.items():
+                self._connection.execute(
+                    "INSERT INTO responses (host, endpoint, query_args, response) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (host, endpoint, query_args) "
+                    "DO UPDATE SET response = excluded.response",
+                    (
+                        host,
+                        endpoint,
+                        query_args,
+                        zlib.compress(json_codec.dumps(response).encode("utf-8")),
+                    ),
+                )
+                (response_id,) = self._connection.execute(
+                    "SELECT id FROM responses WHERE host = ? AND endpoint = ? AND query_args = ?",
+                    (host, endpoint, query_args),
+                ).fetchone()
+                # the token counts of a replaced response are out of date
+                self._connection.execute(
+                    "DELETE FROM token_counts WHERE response_id = ?", (response_id,)
+                )
+            self._update_endpoint(host, endpoint)
+
+    def replace_endpoint_data(
+        self, endpoint_data: Mapping[str, Any], host: str, endpoint: str
+    ) -> None:
+        """
+        Replace the responses of an endpoint (for any case of the host and endpoint names) with the
+        {host: {endpoint: {query_args: response}}} endpoint_data of a data file.
+        """
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM responses WHERE lower(host) = lower(?) AND lower(endpoint) = lower(?)",
+                (host, endpoint),
+            )
+            self._connection.execute(
+                "DELETE FROM endpoints WHERE lower(host) = lower(?) AND lower(endpoint) = lower(?)",
+                (host, endpoint),
+            )
+        for data_host, endpoint_info in endpoint_data.items():
+            for data_endpoint, responses in endpoint_info.items():
+                self.add_responses(data_host, data_endpoint, responses)
+        if not self.has_endpoint(host, endpoint):
+            # an endpoint without responses is still recorded as extracted
+            with self._connection:
+                self._update_endpoint(host, endpoint)
+
+    def has_endpoint(self, host: str, endpoint: str) -> bool:
+        return (
+            self._connection.execute(
+                "SELECT 1 FROM endpoints "
+                "WHERE lower(host) = lower(?) AND lower(endpoint) = lower(?)",
+                (host, endpoint),
+            ).fetchone()
+            is not None
+        )
+
+    def get_endpoint_signature(self, host: str, endpoint: str) -> list[Any]:
+        # changes when the responses of the endpoint change, like the signature of a data file
+        return [
+            list(row)
+            for row in self._connection.execute(
+                "SELECT host, endpoint, num_responses, updated_at_ns FROM endpoints "
+                "WHERE lower(host) = lower(?) AND lower(endpoint) = lower(?) "
+                "ORDER BY host, endpoint",
+                (host, endpoint),
+            )
+        ]
+
+    def get_endpoint_data(
+        self, host: str, endpoint: str
+    ) -> dict[str, dict[str, dict[str, Any]]]:
+        """The {host: {endpoint: {query_args: response}}} responses of an endpoint, as in its data file."""
+        endpoint_data: dict[str, dict[str, dict[str, Any]]] = {}
+        for data_host, data_endpoint, query_args, response in self._connection.execute(
+            "SELECT host, endpoint, query_args, response FROM responses "
+            "WHERE lower(host) = lower(?) AND lower(endpoint) = lower(?) ORDER BY id",
+            (host, endpoint),
+        ):
+            endpoint_data.setdefault(data_host, {}).setdefault(data_endpoint, {})[
+                query_args
+            ] = json_codec.loads(zlib.decompress(response))
+        return endpoint_data
+
+    def get_token_counts(
+        self, tokenizer: str, code_hash: str, host: str, endpoint: str
+    ) -> dict[tuple[str, str, str], int]:
+        """
+        The token counts of the responses of an endpoint for a tokenizer, counted on the records
+        cleaned up by the code of code_hash.
+        """
+        return {
+            (data_host, data_endpoint, query_args): num_tokens
+            for data_host, data_endpoint, query_args, num_tokens in self._connection.execute(
+                "SELECT host, endpoint, query_args, num_tokens FROM token_counts "
+                "JOIN responses ON responses.id = token_counts.response_id "
+                "WHERE tokenizer = ? AND code_hash = ? "
+                "AND lower(host) = lower(?) AND lower(endpoint) = lower(?)",
+                (tokenizer, code_hash, host, endpoint),
+            )
+        }
+
+    def add_token_counts(
+        self,
+        tokenizer: str,
+        code_hash: str,
+        token_counts: Iterable[tuple[tuple[str, str, str], int]],
+    ) -> None:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO token_counts SELECT id, ?, ?, ? FROM responses "
+                "WHERE host = ? AND endpoint = ? AND query_args = ?",
+                [
+                    (tokenizer, code_hash, num_tokens, host, endpoint, query_args)
+                    for (host, endpoint, query_args), num_tokens in token_counts
+                ],
+            )
@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from . import json_codec
+from .serializers import (
+    DEFAULT_RESPONSE_FORMAT,
+    dumps_json_record,
+    is_json_record_response,
+    join_json_records,
+    serialize_response,
+)
+
+
+class SerializationCache:
+    """
+    Bounded LRU cache of the serialized api responses of the prompts. All the QA samples that a
+    task creates for an api response share the same response object, so it is only serialized
+    once for all of their prompts, and for the other tasks of the task list that get the same
+    object. Entries are keyed by the identity of the response and the response format (see
+    serializers.py) or formatting options, and keep a reference to the response so that its id
+    cannot be reused by another object while it is cached. The responses must not be modified
+    after they are serialized.
+    The json serialization of a {query_args: record} api response is joined from the cached
+    serializations of its records, which are shared by the responses with the same record
+    objects in another order, e.g. the ones of manipulate_response for the other positions, and
+    the character offsets of the records in it are kept (see get_record_offsets).
+    The least recently used entries are evicted when there are more than max_entries of them
+    or more than max_chars characters of serialized text, and the least recently used records
+    when there are more than max_chars characters of them. Pickling only copies the bounds.
+    """
+
+    def __init__(self, max_entries: int = 8, max_chars: int = 64_000_000) -> None:
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.num_hits = 0
+        self.num_misses = 0
+        # {(id(response), options): (response, text, character offsets of the records or None)}
+        self._entries: OrderedDict[
+            tuple[int, Hashable], tuple[Any, str, Optional[list[tuple[str, int, int]]]]
+        ] = OrderedDict()
+        self._num_chars = 0
+        # {(id(record), query_args): (record, dumps_json_record(query_args, record))}
+        self._record_fragments: OrderedDict[tuple[int, str], tuple[Any, str]] = OrderedDict()
+        self._num_record_chars = 0
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {"max_entries": self.max_entries, "max_chars": self.max_chars}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__init__(**state)  # type: ignore[misc]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._num_chars = 0
+        self._record_fragments.clear()
+        self._num_record_chars = 0
+
+    def dumps(self, obj: Any, indent: Optional[int] = None) -> str:
+        """json_codec.dumps(obj, indent=indent), serialized once while it is cached."""
+        return self._get(
+            obj, ("indent", indent), lambda: (json_codec.dumps(obj, indent=indent), None)
+        )[1]
+
+    def serialize(self, obj: Any, response_format: str) -> str:
+        """serialize_response(obj, response_format), serialized once while it is cached."""
+        return self._get(
+            obj,
+            ("response_format", response_format),
+            lambda: self._serialize(obj, response_format),
+        )[1]
+
+    def get_record_offsets(
+        self, obj: Any, response_format: str
+    ) -> Optional[list[tuple[str, int, int]]]:
+        """
+        The (query_args, start, end) character offsets of the records of obj in serialize(obj,
+        response_format), or None if its serialization is not joined from its records.
+        """
+        return self._get(
+            obj,
+            ("response_format", response_format),
+            lambda: self._serialize(obj, response_format),
+        )[2]
+
+    def _serialize(
+        self, obj: Any, response_format: str
+    ) -> tuple[str, Optional[list[tuple[str, int, int]]]]:
+        if response_format == DEFAULT_RESPONSE_FORMAT and is_json_record_response(obj):
+            return join_json_records(
+                [
+                    (query_args, self._get_record_fragment(query_args, record))
+                    for query_args, record in obj.items()
+                ]
+            )
+        return serialize_response(obj, response_format), None
+
+    def _get_record_fragment(self, query_args: str, record: Any) -> str:
+        key = (id(record), query_args)
+        entry = self._record_fragments.get(key)
+        if entry is not None and entry[0] is record:
+            self._record_fragments.move_to_end(key)
+            return entry[1]
+        fragment = dumps_json_record(query_args, record)
+        if entry is not None:
+            self._num_record_chars -= len(entry[1])
+        self._record_fragments[key] = (record, fragment)
+        self._num_record_chars += len(fragment)
+        while len(self._record_fragments) > 1 and self._num_record_chars > self.max_chars:
+            _, (_, evicted_fragment) = self._record_fragments.popitem(last=False)
+            self._num_record_chars -= len(evicted_fragment)
+        return fragment
+
+    def _get(
+        self,
+        obj: Any,
+        options: Hashable,
+        serialize: Callable[[], tuple[str, Optional[list[tuple[str, int, int]]]]],
+    ) -> tuple[Any, str, Optional[list[tuple[str, int, int]]]]:
+        key = (id(obj), options)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is obj:
+            self._entries.move_to_end(key)
+            self.num_hits += 1
+            return entry
+        self.num_misses += 1
+        text, record_offsets = serialize()
+        entry = (obj, text, record_offsets)
+        self._add(key, entry)
+        return entry
+
+    def _add(
+        self,
+        key: tuple[int, Hashable],
+        entry: tuple[Any, str, Optional[list[tuple[str, int, int]]]],
+    ) -> None:
+        previous_entry = self._entries.pop(key, None)
+        if previous_entry is not None:
+            self._num_chars -= len(previous_entry[1])
+        self._entries[key] = entry
+        self._num_chars += len(entry[1])
+        # the latest entry is kept even if it is larger than max_chars on its own
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._num_chars > self.max_chars
+        ):
+            _, (_, evicted_text, _) = self._entries.popitem(last=False)
+            self._num_chars -= len(evicted_text)
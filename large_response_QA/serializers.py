@@ -0,0 +1,196 @@
+import csv
+import io
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional
+
+from . import json_codec
+
+# Serializations of the api responses embedded in the prompts. "json", the default, is the
+# json.dumps(indent=4) the prompts were created with; the other ones are more compact renderings
+# of the same data, to compare the accuracy and the number of tokens of the prompts across them.
+DEFAULT_RESPONSE_FORMAT = "json"
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*\Z")
+
+
+def dumps_json(obj: Any) -> str:
+    return json_codec.dumps(obj, indent=4)
+
+
+def is_json_record_response(obj: Any) -> bool:
+    # api responses of {query_args: record}, whose json serialization can be joined from the
+    # serializations of their records
+    return isinstance(obj, dict) and all(isinstance(key, str) for key in obj)
+
+
+def dumps_json_record(query_args: str, record: Any) -> str:
+    """
+    The serialization of a record in dumps_json of a {query_args: record} api response, indented
+    as in the api response and without the separators between the records.
+    """
+    # the JSON strings cannot have newlines, so all the newlines are between the lines
+    return f"    {json.dumps(query_args)}: " + dumps_json(record).replace("\n", "\n    ")
+
+
+def join_json_records(
+    record_fragments: list[tuple[str, str]]
+) -> tuple[str, list[tuple[str, int, int]]]:
+    """
+    dumps_json of a {query_args: record} api response from the (query_args, dumps_json_record)
+    of its records, in their order in the api response, and the (query_args, start, end)
+    character offsets of the records in it.
+    """
+    if len(record_fragments) == 0:
+        return "{}", []
+    parts = ["{\n"]
+    record_offsets = []
+    offset = 2
+    for i, (query_args, fragment) in enumerate(record_fragments):
+        if i > 0:
+            parts.append(",\n")
+            offset += 2
+        parts.append(fragment)
+        record_offsets.append((query_args, offset, offset + len(fragment)))
+        offset += len(fragment)
+    parts.append("\n}")
+    return "".join(parts), record_offsets
+
+
+def dumps_minified_json(obj: Any) -> str:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def dumps_yaml(obj: Any) -> str:
+    import yaml
+
+    return yaml.safe_dump(
+        obj,
+        sort_keys=False,
+        allow_unicode=True,
+        default_flow_style=False,
+        width=float("inf"),
+    ).rstrip("\n")
+
+
+def _join_key_path(path: str, key: Any) -> str:
+    if isinstance(key, int):
+        return f"{path}[{key}]"
+    if _IDENTIFIER.match(key):
+        return f"{path}.{key}" if path else key
+    return f"{path}[{json.dumps(key, ensure_ascii=False)}]"
+
+
+def _scalar_text(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _iter_key_path_lines(path: str, obj: Any, tables: bool) -> Iterator[str]:
+    if isinstance(obj, dict) and len(obj) > 0:
+        for key, value in obj.items():
+            yield from _iter_key_path_lines(_join_key_path(path, key), value, tables)
+    elif isinstance(obj, list) and len(obj) > 0:
+        if tables and is_homogeneous_array(obj):
+            yield from _iter_table_lines(path, obj)
+        else:
+            for i, value in enumerate(obj):
+                yield from _iter_key_path_lines(_join_key_path(path, i), value, tables)
+    else:
+        yield f"{path} = {_scalar_text(obj)}"
+
+
+def is_homogeneous_array(obj: list[Any]) -> bool:
+    # arrays of objects, e.g. the seats, cars or flight offers, are rendered as tables
+    return len(obj) > 1 and all(isinstance(value, dict) for value in obj)
+
+
+def _flatten_row(path: str, obj: Any, row: dict[str, Any]) -> None:
+    if isinstance(obj, dict) and len(obj) > 0:
+        for key, value in obj.items():
+            _flatten_row(_join_key_path(path, key), value, row)
+    else:
+        row[path] = obj
+
+
+def _cell_text(value: Any) -> str:
+    # strings are written as is, the other values as JSON, e.g. null, true or nested lists
+    return value if isinstance(value, str) else _scalar_text(value)
+
+
+def _iter_table_lines(path: str, obj: list[dict[Any, Any]]) -> Iterator[str]:
+    rows: list[dict[str, Any]] = []
+    columns: dict[str, None] = {}
+    for value in obj:
+        row: dict[str, Any] = {}
+        _flatten_row("", value, row)
+        rows.append(row)
+        columns.update(dict.fromkeys(row))
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(columns)
+    for row in rows:
+        # a missing column is an empty cell
+        writer.writerow(
+            _cell_text(row[column]) if column in row else "" for column in columns
+        )
+    yield f"{path} = table with {len(rows)} rows:"
+    yield output.getvalue().rstrip("\n")
+
+
+def dumps_key_paths(obj: Any) -> str:
+    return "\n".join(_iter_key_path_lines("", obj, tables=False))
+
+
+def dumps_tables(obj: Any) -> str:
+    return "\n".join(_iter_key_path_lines("", obj, tables=True))
+
+
+@dataclass(frozen=True)
+class ResponseFormat:
+    name: str
+    dumps: Callable[[Any], str]
+    description: str  # how the prompt describes the format of the api response
+    code_block_language: str
+    source_name: str  # how the prompt refers to the api response in the answer instructions
+    # the inverse of dumps, for the formats that the api response can be loaded back from
+    loads: Optional[Callable[[str], Any]] = None
+
+
+RESPONSE_FORMATS = {
+    response_format.name: response_format
+    for response_format in [
+        ResponseFormat("json", dumps_json, "JSON format", "json", "JSON", json_codec.loads),
+        ResponseFormat(
+            "minified_json", dumps_minified_json, "JSON format", "json", "JSON", json_codec.loads
+        ),
+        ResponseFormat("yaml", dumps_yaml, "YAML format", "yaml", "YAML"),
+        ResponseFormat(
+            "key_paths",
+            dumps_key_paths,
+            "key path format, one `path = value` line per value",
+            "text",
+            "API response",
+        ),
+        ResponseFormat(
+            "csv",
+            dumps_tables,
+            "key path format, one `path = value` line per value, with the arrays of objects "
+            "as CSV tables with one column per key path",
+            "text",
+            "API response",
+        ),
+    ]
+}
+
+
+def get_response_format(name: str) -> ResponseFormat:
+    if name not in RESPONSE_FORMATS:
+        raise ValueError(
+            f"Unknown response format {name}, the response formats are {list(RESPONSE_FORMATS)}"
+        )
+    return RESPONSE_FORMATS[name]
+
+
+def serialize_response(obj: Any, response_format: str = DEFAULT_RESPONSE_FORMAT) -> str:
+    return get_response_format(response_format).dumps(obj)
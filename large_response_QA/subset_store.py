@@ -0,0 +1,218 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Mapping
+from typing import Any, Iterator, Optional
+
+from . import json_codec
+from .manifest import get_file_signature
+
+# Binary data subset files hold the records of a data subset file
+# {random_seed: {app: {endpoint: {query_args: record}}}} as length-prefixed compact JSON documents,
+# followed by an index of the offsets of the records and a footer with the offset of the index.
+# The file is memory-mapped and a random seed (or a single endpoint of a random seed) is only
+# decoded when it is accessed, so that a data subset can be opened without parsing it and shared
+# with worker processes by file path. The length-prefixed header after the magic holds the
+# signature of the JSON data subset file that the binary one was converted from, if any, so
+# that a binary file is not used after its JSON file is created again.
+BINARY_DATA_SUBSET_EXTENSION = ".bin"
+_MAGIC = b"LRQASUB2"
+_LENGTH = struct.Struct("<I")
+_FOOTER = struct.Struct("<Q")
+
+
+def get_binary_data_subset_path(json_fpath: str) -> str:
+    return os.path.splitext(json_fpath)[0] + BINARY_DATA_SUBSET_EXTENSION
+
+
+def is_binary_data_subset(fpath: str) -> bool:
+    return fpath.endswith(BINARY_DATA_SUBSET_EXTENSION)
+
+
+class BinaryDataSubsetWriter:
+    """Write a binary data subset file one random seed at a time, like DataSubsetWriter."""
+
+    def __init__(self, fpath: str, source_signature: Optional[list[int]] = None) -> None:
+        self._file = open(fpath, "wb")
+        header = json.dumps({"source_signature": source_signature}).encode("utf-8")
+        self._file.write(_MAGIC)
+        self._file.write(_LENGTH.pack(len(header)))
+        self._file.write(header)
+        self._offset = len(_MAGIC) + _LENGTH.size + len(header)
+        # [[random_seed, [[app, endpoint, [[query_args, offset, length], ...]], ...]], ...]
+        self._index: list[Any] = []
+
+    def __enter__(self) -> "BinaryDataSubsetWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def write(self, random_seed: Any, subset: Any) -> None:
+        endpoints_index = []
+        for app, endpoint_info in subset.items():
+            for endpoint, query_info in endpoint_info.items():
+                records_index = []
+                for query_args, record in query_info.items():
+                    data = json.dumps(record, separators=(",", ":")).encode("utf-8")
+                    self._file.write(_LENGTH.pack(len(data)))
+                    self._file.write(data)
+                    records_index.append(
+                        [query_args, self._offset + _LENGTH.size, len(data)]
+                    )
+                    self._offset += _LENGTH.size + len(data)
+                endpoints_index.append([app, endpoint, records_index])
+        self._index.append([str(random_seed), endpoints_index])
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._file.write(json.dumps(self._index, separators=(",", ":")).encode("utf-8"))
+        self._file.write(_FOOTER.pack(self._offset))
+        self._file.close()
+
+
+class BinaryEndpointResponses(Mapping):
+    """The {query_args: record} responses of one endpoint of one random seed of a binary data subset.
+    Records are decoded when accessed; load() decodes all of them into a dict. Pickling only
+    copies the file path and the offsets of the records.
+    """
+
+    def __init__(self, data_subset: "BinaryDataSubset", records_index: list[Any]) -> None:
+        self._data_subset = data_subset
+        self._records_index = {
+            query_args: (offset, length) for query_args, offset, length in records_index
+        }
+
+    def __getitem__(self, query_args: str) -> Any:
+        offset, length = self._records_index[query_args]
+        return self._data_subset.decode(offset, length)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records_index)
+
+    def __len__(self) -> int:
+        return len(self._records_index)
+
+    def load(self) -> dict[str, Any]:
+        return {
+            query_args: self._data_subset.decode(offset, length)
+            for query_args, (offset, length) in self._records_index.items()
+        }
+
+
+class BinaryDataSubset(Mapping):
+    """Read-only {random_seed: {app: {endpoint: {query_args: record}}}} view of a binary data
+    subset file. Accessing a random seed decodes its records into plain dicts, equal to the
+    ones json.load gives for the JSON data subset file.
+    """
+
+    def __init__(self, fpath: str) -> None:
+        self.fpath = fpath
+        self._open()
+
+    def _open(self) -> None:
+        with open(self.fpath, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{self.fpath} is not a binary data subset file")
+        (index_offset,) = _FOOTER.unpack_from(self._mmap, len(self._mmap) - _FOOTER.size)
+        self._index = {
+            random_seed: endpoints_index
+            for random_seed, endpoints_index in json.loads(
+                self._mmap[index_offset : len(self._mmap) - _FOOTER.size]
+            )
+        }
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {"fpath": self.fpath}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.fpath = state["fpath"]
+        self._open()
+
+    def decode(self, offset: int, length: int) -> Any:
+        return json_codec.loads(self._mmap[offset : offset + length])
+
+    def endpoint_responses(
+        self, random_seed: str
+    ) -> dict[str, dict[str, BinaryEndpointResponses]]:
+        """The {app: {endpoint: responses}} of a random seed without decoding any record."""
+        endpoint_responses: dict[str, dict[str, BinaryEndpointResponses]] = {}
+        for app, endpoint, records_index in self._index[random_seed]:
+            endpoint_responses.setdefault(app, {})[endpoint] = BinaryEndpointResponses(
+                self, records_index
+            )
+        return endpoint_responses
+
+    def __getitem__(self, random_seed: str) -> dict[str, dict[str, dict[str, Any]]]:
+        return {
+            app: {
+                endpoint: responses.load() for endpoint, responses in endpoint_info.items()
+            }
+            for app, endpoint_info in self.endpoint_responses(random_seed).items()
+        }
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+def read_binary_data_subset_header(fpath: str) -> Optional[dict[str, Any]]:
+    """The header of a binary data subset file, or None if it is not one of the current version."""
+    with open(fpath, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            return None
+        (header_length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+        return json.loads(f.read(header_length))
+
+
+def get_converted_data_subset_path(json_fpath: str) -> Optional[str]:
+    """
+    The path of the binary data subset file converted from the JSON data subset file json_fpath,
+    or None if there is none or it was converted from another version of the JSON file. Without
+    the JSON file, e.g. on a node with only the binary files, the binary file is used as it is.
+    """
+    binary_fpath = get_binary_data_subset_path(json_fpath)
+    if not os.path.exists(binary_fpath):
+        return None
+    if os.path.exists(json_fpath):
+        header = read_binary_data_subset_header(binary_fpath)
+        if header is None or header["source_signature"] != get_file_signature(json_fpath):
+            print(
+                f"{binary_fpath} was not converted from the current {json_fpath}, "
+                "which is used instead"
+            )
+            return None
+    return binary_fpath
+
+
+def convert_json_data_subset(json_fpath: str, binary_fpath: Optional[str] = None) -> str:
+    """Convert a JSON data subset file created by create_data_subsets.py to a binary data subset file."""
+    if binary_fpath is None:
+        binary_fpath = get_binary_data_subset_path(json_fpath)
+    source_signature = get_file_signature(json_fpath)
+    dataset = json_codec.load_file(json_fpath)
+    with BinaryDataSubsetWriter(binary_fpath, source_signature) as writer:
+        for random_seed, subset in dataset.items():
+            writer.write(random_seed, subset)
+    return binary_fpath
+
+
+if __name__ == "__main__":
+    # python -m large_response_QA.subset_store <JSON data subset files or directories>
+    for path in sys.argv[1:]:
+        if os.path.isdir(path):
+            json_fpaths = sorted(
+                os.path.join(path, filename)
+                for filename in os.listdir(path)
+                if filename.endswith(".json")
+            )
+        else:
+            json_fpaths = [path]
+        for json_fpath in json_fpaths:
+            print(f"{json_fpath} -> {convert_json_data_subset(json_fpath)}")
@@ -1,17 +1,51 @@
-import json
+import ast
 from abc import ABC, abstractmethod
-from typing import Any
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
 
 import numpy as np
 
+from .. import json_codec
+from ..serialization_cache import SerializationCache
+from ..serializers import (
+    DEFAULT_RESPONSE_FORMAT,
+    get_response_format,
+    serialize_response,
+)
 from .data_structures import LongResponseQASample, TaskAttributes
 
 
+@lru_cache(maxsize=None)
+def parse_query_args(query_args: str) -> Mapping[str, Any]:
+    """
+    Parse a key of an API response, the str() of the arguments of the API call, into a read-only
+    dict of the arguments. Each key is only parsed once and the same object is returned afterwards.
+    """
+    try:
+        query_args_dict = ast.literal_eval(query_args)
+    except (ValueError, SyntaxError):
+        # arguments given as a JSON string
+        query_args_dict = json_codec.loads(query_args)
+    return MappingProxyType(query_args_dict)
+
+
 class Task(ABC):
 
     EVALUATION_CRITERIAS: list[Any] = []
     TASK_ATTRIBUTES: list[TaskAttributes] = []
 
+    def __init__(
+        self,
+        serialization_cache: Optional[SerializationCache] = None,
+        response_format: str = DEFAULT_RESPONSE_FORMAT,
+    ) -> None:
+        # the api responses of the prompts are serialized once while they are in the cache,
+        # which TaskList.create_task shares between the tasks of a task list
+        self.serialization_cache = serialization_cache
+        # how the api responses are serialized in the prompts, see serializers.py
+        self.response_format = get_response_format(response_format)
+
     @abstractmethod
     def get_qa_samples(
         self, api_response: dict[Any, Any]
@@ -42,21 +76,59 @@ class Task(ABC):
         result_avg = np.average(result, axis=0)
         return result_avg
 
-    def get_prompt(self, qa_sample: LongResponseQASample) -> str:
+    def get_prompt_parts(self, qa_sample: LongResponseQASample) -> tuple[str, str, str]:
+        """
+        The prompt split into the instructions, the api response and the question parts. The
+        instructions are the same for all the prompts of a response format and the api response
+        part (which ends with the closing of its code block) for all the questions about an api
+        response, so they can be tokenized once (see prompt_tokens.py).
+        """
 
-        prompt_template = (
-            "You are given a response from an API call (in JSON format). "
+        instructions_template = (
+            "You are given a response from an API call (in {format_description}). "
             "Answer the question based on the information provided in the API response.\n\n"
-            "```json\n{api_response}\n```\n\n"
+            "```{code_block_language}\n"
+        )
+        api_response_template = "{api_response}\n```\n\n"
+        question_template = (
             "Question: {question}\n\n"
             "Only respond with the answer. Do not include any other text or json in the response."
-            "Do not rephrase the answer or write it in complete sentence, return exactly as is from the JSON.\n\n"
+            "Do not rephrase the answer or write it in complete sentence, return exactly as is from the {source_name}.\n\n"
             "Answer:"
         )
 
-        prompt = prompt_template.format(
-            api_response=json.dumps(qa_sample.api_response, indent=4),
-            question=qa_sample.question,
+        if self.serialization_cache is not None:
+            api_response = self.serialization_cache.serialize(
+                qa_sample.api_response, self.response_format.name
+            )
+        else:
+            api_response = serialize_response(
+                qa_sample.api_response, self.response_format.name
+            )
+        return (
+            instructions_template.format(
+                format_description=self.response_format.description,
+                code_block_language=self.response_format.code_block_language,
+            ),
+            api_response_template.format(api_response=api_response),
+            question_template.format(
+                question=qa_sample.question,
+                source_name=self.response_format.source_name,
+            ),
+        )
+
+    def get_record_offsets(
+        self, qa_sample: LongResponseQASample
+    ) -> Optional[list[tuple[str, int, int]]]:
+        """
+        The (query_args, start, end) character offsets of the records in the api response part
+        of the prompt, if the serialization cache joined it from its records.
+        """
+        if self.serialization_cache is None:
+            return None
+        return self.serialization_cache.get_record_offsets(
+            qa_sample.api_response, self.response_format.name
         )
 
-        return prompt
+    def get_prompt(self, qa_sample: LongResponseQASample) -> str:
+        return "".join(self.get_prompt_parts(qa_sample))
@@ -1,78 +1,79 @@
 import json
-from typing import Any, Union
+from typing import Any, Iterator, Union
 
 from ..large_response_utils import manipulate_response
 
 from . import evals
 from .base import Task
 from .data_structures import LongResponseQASample, TaskAttributes
-
-
-class GetLabel(Task):
-    """Get the label for id for Get_Availability.
-    The tool spec for Get_Availability can be found at https://github.com/THUDM/ComplexFuncBench/blob/main/utils/tool_info.json
-    """
-
-    EVALUATION_CRITERIAS = [evals.accuracy_string]
-    TASK_ATTRIBUTES = [TaskAttributes.EXTRACTIVE]
-
-    # example answer: "A Full Day in Kyoto with a Local: Private & Personalized"
-    def get_answer(self, api_response: dict[Any, Any], id: str) -> str:
-        for _, query_result in api_response.items():
-            data_arr = query_result["data"]
-            for data_elem in data_arr:
-                timeslot_offers = data_elem["timeSlotOffers"]
-                for timeslot_offer in timeslot_offers:
-                    timeslot_id = timeslot_offer["id"]
-                    if timeslot_id == id:
-                        return str(timeslot_offer["label"])
-        return "None"
-
-    # example question: "What is the label for the OFB6PSYrVsTY?"
-    def get_question(self, id: str) -> str:
-        return f"What is the label for the {id}?"
-
-    # This signature deviates from the base class as we added index. Should we add it to the base?
-    def get_qa_samples(
-        self, api_response: dict[Any, Any], index: int = 0
-    ) -> list[LongResponseQASample]:
-
-        qa_samples: list[LongResponseQASample] = []
-        query_args_list = list(api_response.keys())
-        try:
-            query_args = query_args_list[0]
-            query_result = api_response[query_args]
-            api_response = manipulate_response(api_response, index)
-
-            ids_considered = []
-
-            data_arr = query_result["data"]
-            for data_elem in data_arr:
-                timeslot_offers = data_elem["timeSlotOffers"]
-                for timeslot_offer in timeslot_offers:
-                    timeslot_id = timeslot_offer["id"]
-                    if timeslot_id not in ids_considered:
-                        ids_considered.append(timeslot_id)
-                        question = self.get_question(id=timeslot_id)
-                        answer = self.get_answer(
-                            api_response=api_response, id=timeslot_id
-                        )
-
-                        if (
-                            answer is not None
-                            and answer != "None"
-                            and len(qa_samples) < 5
-                        ):
-                            task = LongResponseQASample(
-                                api_response=api_response,
-                                question=question,
-                                gold_answer=answer,
-                            )
-                            qa_samples.append(task)
-        except BaseException:
-            pass
-
-        return qa_samples
+from .entity_tables import EntityTableSpec, get_entity_table
+from .response_index import get_response_index
+from .task_spec import TaskSpec, compile_task_spec
+
+
+def iter_data_elems_by_start_time(api_response: dict[Any, Any]) -> Iterator[tuple[str, Any]]:
+    for _, query_result in api_response.items():
+        for data_elem in query_result["data"]:
+            yield data_elem["start"], data_elem
+
+
+def iter_timeslot_offers_by_id(api_response: dict[Any, Any]) -> Iterator[tuple[str, Any]]:
+    for _, query_result in api_response.items():
+        for data_elem in query_result["data"]:
+            for timeslot_offer in data_elem["timeSlotOffers"]:
+                yield timeslot_offer["id"], timeslot_offer
+
+
+def iter_timeslot_offers_with_items_by_id(
+    api_response: dict[Any, Any]
+) -> Iterator[tuple[str, Any]]:
+    # same as iter_timeslot_offers_by_id, for the scans that get the items of each timeslot
+    # offer before its id
+    for _, query_result in api_response.items():
+        for data_elem in query_result["data"]:
+            for timeslot_offer in data_elem["timeSlotOffers"]:
+                timeslot_offer["items"]
+                yield timeslot_offer["id"], timeslot_offer
+
+
+def iter_timeslot_offer_items_by_offer_item_id(
+    api_response: dict[Any, Any]
+) -> Iterator[tuple[str, Any]]:
+    for _, query_result in api_response.items():
+        for data_elem in query_result["data"]:
+            for timeslot_offer in data_elem["timeSlotOffers"]:
+                for timeslot_offer_item in timeslot_offer["items"]:
+                    yield timeslot_offer_item["offerItemId"], timeslot_offer_item
+
+
+# the items of each timeslot offer, by timeslot offer id
+TIMESLOT_OFFER_ITEM_TABLE = EntityTableSpec(
+    iter_parents=iter_timeslot_offers_with_items_by_id,
+    iter_entities=lambda timeslot_offer: timeslot_offer["items"],
+    columns={
+        "charge_amount": lambda item: item["convertedPrice"]["chargeAmount"],
+        "currency": lambda item: item["convertedPrice"]["currency"],
+    },
+)
+
+
+# Get the label for id for Get_Availability.
+# The tool spec for Get_Availability can be found at https://github.com/THUDM/ComplexFuncBench/blob/main/utils/tool_info.json
+# example answer: "A Full Day in Kyoto with a Local: Private & Personalized"
+# example question: "What is the label for the OFB6PSYrVsTY?"
+GetLabel = compile_task_spec(
+    TaskSpec(
+        name="GetLabel",
+        question="What is the label for the {id}?",
+        entities="data[].timeSlotOffers[]",
+        arguments={"id": "id"},
+        match={"id": "id"},
+        value="label",
+        evaluation_criterias=(evals.accuracy_string,),
+        task_attributes=(TaskAttributes.EXTRACTIVE,),
+    ),
+    __name__,
+)
 
 
 class GetAgeRange(Task):
@@ -85,23 +86,15 @@ class GetAgeRange(Task):
 
     # example answer: (age 13-99)
     def get_answer(self, api_response: dict[Any, Any], offer_item_id: str) -> str:
-        for _, query_result in api_response.items():
-            data_arr = query_result["data"]
-            for data_elem in data_arr:
-                timeslot_offers = data_elem["timeSlotOffers"]
-                for timeslot_offer in timeslot_offers:
-                    timeslot_offer_items = timeslot_offer["items"]
-                    for timeslot_offer_item in timeslot_offer_items:
-                        timeslot_offer_item_id = timeslot_offer_item["offerItemId"]
-                        if (
-                            timeslot_offer_item_id == offer_item_id
-                            and "constraint" in timeslot_offer_item
-                        ):
-                            constraint_label = timeslot_offer_item["constraint"][
-                                "label"
-                            ]
-                            if constraint_label.startswith("(age"):
-                                return str(constraint_label)
+        timeslot_offer_items = get_response_index(
+            api_response, iter_timeslot_offer_items_by_offer_item_id
+        )
+        for timeslot_offer_item in timeslot_offer_items.get(offer_item_id):
+            if "constraint" in timeslot_offer_item:
+                constraint_label = timeslot_offer_item["constraint"]["label"]
+                if constraint_label.startswith("(age"):
+                    return str(constraint_label)
+        timeslot_offer_items.raise_scan_error()
         return "None"
 
     # example question: "What is the age range for offer item OImC2WSOFMoG?"
@@ -171,24 +164,22 @@ class GetPrice(Task):
         start_time: str,
         language_code: str,
     ) -> str:
-        for _, query_result in api_response.items():
-            data_arr = query_result["data"]
-            for data_elem in data_arr:
-                data_start_time = data_elem["start"]
-                if data_start_time == start_time:
-                    timeslot_offers = data_elem["timeSlotOffers"]
-                    for timeslot_offer in timeslot_offers:
-                        data_label = timeslot_offer["label"]
-                        if data_label == label:
-                            timeslot_offer_items = timeslot_offer["items"]
-                            for timeslot_offer_item in timeslot_offer_items:
-                                data_language_code = timeslot_offer_item[
-                                    "languageOption"
-                                ]["language"]
-                                if data_language_code == language_code:
-                                    price = timeslot_offer_item["convertedPrice"]
-                                    if price["currency"].strip().lower() == "usd":
-                                        return str(price["publicAmount"])
+        data_elems = get_response_index(api_response, iter_data_elems_by_start_time)
+        for data_elem in data_elems.get(start_time):
+            timeslot_offers = data_elem["timeSlotOffers"]
+            for timeslot_offer in timeslot_offers:
+                data_label = timeslot_offer["label"]
+                if data_label == label:
+                    timeslot_offer_items = timeslot_offer["items"]
+                    for timeslot_offer_item in timeslot_offer_items:
+                        data_language_code = timeslot_offer_item[
+                            "languageOption"
+                        ]["language"]
+                        if data_language_code == language_code:
+                            price = timeslot_offer_item["convertedPrice"]
+                            if price["currency"].strip().lower() == "usd":
+                                return str(price["publicAmount"])
+        data_elems.raise_scan_error()
         return "None"
 
     # example question: What is the price in USD for the A Full Day in Kyoto with a Local: Private & Personalized tour that starts at 2024-12-01T08:00:00+09:00 and is in en language?
@@ -264,21 +255,17 @@ class GetIdsPerMinPerReservation(Task):
         self, api_response: dict[Any, Any], timeslot_offer_id: str, num: int
     ) -> str:
         ids_list = []
-        for _, query_result in api_response.items():
-            data_arr = query_result["data"]
-            for data_elem in data_arr:
-                timeslot_offers = data_elem["timeSlotOffers"]
-                for timeslot_offer in timeslot_offers:
-                    data_timeslot_offer_id = timeslot_offer["id"]
-                    if data_timeslot_offer_id == timeslot_offer_id:
-                        timeslot_offer_items = timeslot_offer["items"]
-                        for timeslot_offer_item in timeslot_offer_items:
-                            min_per_reservation = timeslot_offer_item[
-                                "minPerReservation"
-                            ]
-                            id = timeslot_offer_item["id"]
-                            if min_per_reservation == num and id not in ids_list:
-                                ids_list.append(id)
+        timeslot_offers = get_response_index(api_response, iter_timeslot_offers_by_id)
+        for timeslot_offer in timeslot_offers.get(timeslot_offer_id):
+            timeslot_offer_items = timeslot_offer["items"]
+            for timeslot_offer_item in timeslot_offer_items:
+                min_per_reservation = timeslot_offer_item[
+                    "minPerReservation"
+                ]
+                id = timeslot_offer_item["id"]
+                if min_per_reservation == num and id not in ids_list:
+                    ids_list.append(id)
+        timeslot_offers.raise_scan_error()
         return ", ".join(ids_list)
 
     # example question: What is the price in USD for the A Full Day in Kyoto with a Local: Private & Personalized tour that starts at 2024-12-01T08:00:00+09:00 and is in en language?
@@ -348,24 +335,22 @@ class GetNumLanguage(Task):
         self, api_response: dict[Any, Any], id: str, language_code: str
     ) -> str:
         item_id_list = []
-        for _, query_result in api_response.items():
-            data_arr = query_result["data"]
-            for data_elem in data_arr:
-                timeslot_offers = data_elem["timeSlotOffers"]
-                for timeslot_offer in timeslot_offers:
-                    timeslot_offer_items = timeslot_offer["items"]
-                    timeslot_offer_id = timeslot_offer["id"]
-                    if timeslot_offer_id == id:
-                        for timeslot_offer_item in timeslot_offer_items:
-                            data_language_code = timeslot_offer_item["languageOption"][
-                                "language"
-                            ]
-                            item_id = timeslot_offer_item["id"]
-                            if (
-                                data_language_code == language_code
-                                and item_id not in item_id_list
-                            ):
-                                item_id_list.append(item_id)
+        timeslot_offers = get_response_index(
+            api_response, iter_timeslot_offers_with_items_by_id
+        )
+        for timeslot_offer in timeslot_offers.get(id):
+            timeslot_offer_items = timeslot_offer["items"]
+            for timeslot_offer_item in timeslot_offer_items:
+                data_language_code = timeslot_offer_item["languageOption"][
+                    "language"
+                ]
+                item_id = timeslot_offer_item["id"]
+                if (
+                    data_language_code == language_code
+                    and item_id not in item_id_list
+                ):
+                    item_id_list.append(item_id)
+        timeslot_offers.raise_scan_error()
         if len(item_id_list) > 0:
             return str(len(item_id_list))
         else:
@@ -436,25 +421,17 @@ class GetMinPrice(Task):
 
     def get_answer(self, api_response: dict[Any, Any], id: str) -> str:
         min_price: Union[float, None] = None
-        for _, query_result in api_response.items():
-            data_arr = query_result["data"]
-            for data_elem in data_arr:
-                timeslot_offers = data_elem["timeSlotOffers"]
-                for timeslot_offer in timeslot_offers:
-                    timeslot_offer_items = timeslot_offer["items"]
-                    timeslot_offer_id = timeslot_offer["id"]
-                    if timeslot_offer_id == id:
-                        for timeslot_offer_item in timeslot_offer_items:
-                            item_price = timeslot_offer_item["convertedPrice"][
-                                "chargeAmount"
-                            ]
-                            price_currency = timeslot_offer_item["convertedPrice"][
-                                "currency"
-                            ]
-                            if price_currency == "USD" and (
-                                min_price is None or item_price < min_price
-                            ):
-                                min_price = item_price
+        timeslot_offer_items = get_entity_table(api_response, TIMESLOT_OFFER_ITEM_TABLE)
+        rows = timeslot_offer_items.get_rows(timeslot_offer_items.get_parents(id))
+        for item_price, price_currency in zip(
+            timeslot_offer_items.get_values("charge_amount", rows),
+            timeslot_offer_items.get_values("currency", rows),
+        ):
+            if price_currency == "USD" and (
+                min_price is None or item_price < min_price
+            ):
+                min_price = item_price
+        timeslot_offer_items.raise_scan_error()
         return str(min_price)
 
     # example question:
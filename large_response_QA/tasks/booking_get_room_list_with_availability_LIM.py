@@ -1,79 +1,66 @@
 import json
-from typing import Any, Union
+from typing import Any, Iterator, Union
 
 import numpy as np
 from ..large_response_utils import manipulate_response
 
 from . import evals
-from .base import Task
+from .base import Task, parse_query_args
 from .data_structures import LongResponseQASample, TaskAttributes
-
-
-class GetRoomCount(Task):
-    """Get the number of available rooms for Get_Room_List_With_Availability.
-    The tool spec for Get_Room_List_With_Availability can be found at https://github.com/THUDM/ComplexFuncBench/blob/main/utils/tool_info.json
-    """
-
-    EVALUATION_CRITERIAS = [evals.accuracy_string]
-    TASK_ATTRIBUTES = [TaskAttributes.EXTRACTIVE]
-
-    # example answer: "20"
-    def get_answer(self, api_response: dict[Any, Any], name: str, hotel_id: str) -> str:
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            resp_hotel_id = query_args_dict["hotel_id"]
-            if resp_hotel_id.strip().lower() == hotel_id.strip().lower():
-                available_rooms = query_result["available"]
-
-                for room_kind in available_rooms:
-                    room_kind_name = room_kind["name"]
-                    if room_kind_name.strip().lower() == name.strip().lower():
-                        return str(room_kind["room_count"])
-
-        return "None"
-
-    # example question: "What is the total number of available rooms of the kind Executive Twin Room - Free cancellation in hotel 12345?""
-    def get_question(self, name: str, hotel_id: str) -> str:
-        return f"What is the total number of available rooms of the kind {name} in hotel {hotel_id}?"
-
-    # This signature deviates from the base class as we added index. Should we add it to the base?
-    def get_qa_samples(
-        self, api_response: dict[Any, Any], index: int = 0
-    ) -> list[LongResponseQASample]:
-
-        qa_samples: list[LongResponseQASample] = []
-        query_args_list = list(api_response.keys())
-        try:
-            query_args = query_args_list[0]
-            query_result = api_response[query_args]
-            api_response = manipulate_response(api_response, index)
-
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            hotel_id = query_args_dict["hotel_id"]
-            available_rooms = query_result["available"]
-            considered_room_kinds = []
-            for room_kind in available_rooms:
-                room_kind_name = room_kind["name"]
-                if room_kind_name not in considered_room_kinds:
-                    considered_room_kinds.append(room_kind_name)
-                    question = self.get_question(name=room_kind_name, hotel_id=hotel_id)
-                    answer = self.get_answer(
-                        api_response=api_response,
-                        name=room_kind_name,
-                        hotel_id=hotel_id,
-                    )
-
-                    if answer is not None and answer != "None" and len(qa_samples) < 5:
-                        task = LongResponseQASample(
-                            api_response=api_response,
-                            question=question,
-                            gold_answer=answer,
-                        )
-                        qa_samples.append(task)
-        except BaseException:
-            pass
-
-        return qa_samples
+from .entity_tables import EntityTableSpec, get_entity_table
+from .response_index import get_response_index
+from .task_spec import TaskSpec, compile_task_spec, normalize_text
+
+
+def iter_results_by_hotel_id(api_response: dict[Any, Any]) -> Iterator[tuple[str, Any]]:
+    for query_args, query_result in api_response.items():
+        yield parse_query_args(query_args)["hotel_id"].strip().lower(), query_result
+
+
+def get_vat_amounts(room_kind: dict[str, Any]) -> list[Any]:
+    # the VAT amounts of the price breakdown of a room, up to its first item without a name or
+    # an amount
+    product_prices = room_kind["product_price_breakdown"]
+    vat_amounts = []
+    try:
+        for item in product_prices["items"]:
+            if item["name"] == "VAT":
+                vat_amounts.append(item["item_amount"]["value"])
+    except KeyError:
+        pass
+    return vat_amounts
+
+
+# the rooms of each record, by hotel_id
+ROOM_TABLE = EntityTableSpec(
+    iter_parents=iter_results_by_hotel_id,
+    iter_entities=lambda query_result: query_result["available"],
+    columns={
+        "all_inclusive_amount": lambda room_kind: room_kind["product_price_breakdown"][
+            "all_inclusive_amount"
+        ]["value"],
+        "vat_amounts": get_vat_amounts,
+    },
+)
+
+
+# Get the number of available rooms for Get_Room_List_With_Availability.
+# The tool spec for Get_Room_List_With_Availability can be found at https://github.com/THUDM/ComplexFuncBench/blob/main/utils/tool_info.json
+# example answer: "20"
+GetRoomCount = compile_task_spec(
+    TaskSpec(
+        name="GetRoomCount",
+        question="What is the total number of available rooms of the kind {name} in hotel {hotel_id}?",
+        entities="available[]",
+        arguments={"name": "name", "hotel_id": "$query_args.hotel_id"},
+        match={"name": "name", "hotel_id": "$query_args.hotel_id"},
+        value="room_count",
+        normalize=normalize_text,
+        evaluation_criterias=(evals.accuracy_string,),
+        task_attributes=(TaskAttributes.EXTRACTIVE,),
+    ),
+    __name__,
+)
 
 
 class GetRoomArea(Task):
@@ -86,18 +73,17 @@ class GetRoomArea(Task):
 
     # example answer: "301.3894912"
     def get_answer(self, api_response: dict[Any, Any], name: str, hotel_id: str) -> str:
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            resp_hotel_id = query_args_dict["hotel_id"]
-            if resp_hotel_id.strip().lower() == hotel_id.strip().lower():
-                available_rooms = query_result["available"]
-                for room_kind in available_rooms:
-                    room_kind_name = room_kind["name"]
-                    if room_kind_name.strip().lower() == name.strip().lower():
-                        try:
-                            return str(room_kind["room_surface_in_feet2"])
-                        except KeyError:
-                            return "None"
+        hotel_results = get_response_index(api_response, iter_results_by_hotel_id)
+        for query_result in hotel_results.get(hotel_id.strip().lower()):
+            available_rooms = query_result["available"]
+            for room_kind in available_rooms:
+                room_kind_name = room_kind["name"]
+                if room_kind_name.strip().lower() == name.strip().lower():
+                    try:
+                        return str(room_kind["room_surface_in_feet2"])
+                    except KeyError:
+                        return "None"
+        hotel_results.raise_scan_error()
         return "None"
 
     # example question: "What is the area in square feet of Executive Twin Room - Free cancellation?""
@@ -115,7 +101,7 @@ class GetRoomArea(Task):
             query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
 
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             hotel_id = query_args_dict["hotel_id"]
             available_rooms = query_result["available"]
             considered_room_kinds = []
@@ -156,18 +142,17 @@ class GetRoomsWithPriceLessThanAmount(Task):
         self, api_response: dict[Any, Any], amount: float, hotel_id: str
     ) -> str:
         result_rooms = []
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            resp_hotel_id = query_args_dict["hotel_id"]
-            if resp_hotel_id.strip().lower() == hotel_id.strip().lower():
-                available_rooms = query_result["available"]
-                for room_kind in available_rooms:
-                    room_kind_name = room_kind["name"]
-                    product_prices = room_kind["product_price_breakdown"]
-                    gross_amount = product_prices["gross_amount_per_night"]["value"]
-
-                    if gross_amount < amount and room_kind_name not in result_rooms:
-                        result_rooms.append(room_kind_name)
+        hotel_results = get_response_index(api_response, iter_results_by_hotel_id)
+        for query_result in hotel_results.get(hotel_id.strip().lower()):
+            available_rooms = query_result["available"]
+            for room_kind in available_rooms:
+                room_kind_name = room_kind["name"]
+                product_prices = room_kind["product_price_breakdown"]
+                gross_amount = product_prices["gross_amount_per_night"]["value"]
+
+                if gross_amount < amount and room_kind_name not in result_rooms:
+                    result_rooms.append(room_kind_name)
+        hotel_results.raise_scan_error()
 
         if len(result_rooms) > 0:
             return ", ".join(result_rooms)
@@ -189,7 +174,7 @@ class GetRoomsWithPriceLessThanAmount(Task):
             query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
 
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             hotel_id = query_args_dict["hotel_id"]
             available_rooms = query_result["available"]
             gross_amounts = []
@@ -228,19 +213,18 @@ class GetRoomsWithMealPlan(Task):
         self, api_response: dict[Any, Any], mealplan: str, hotel_id: str
     ) -> str:
         result_rooms = []
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            resp_hotel_id = query_args_dict["hotel_id"]
-            if resp_hotel_id.strip().lower() == hotel_id.strip().lower():
-                available_rooms = query_result["available"]
-                for room_kind in available_rooms:
-                    mealplan_name = room_kind["mealplan"]
-                    room_kind_name = room_kind["name"]
-                    if (
-                        mealplan_name.lower() == mealplan.lower()
-                        and room_kind_name not in result_rooms
-                    ):
-                        result_rooms.append(room_kind_name)
+        hotel_results = get_response_index(api_response, iter_results_by_hotel_id)
+        for query_result in hotel_results.get(hotel_id.strip().lower()):
+            available_rooms = query_result["available"]
+            for room_kind in available_rooms:
+                mealplan_name = room_kind["mealplan"]
+                room_kind_name = room_kind["name"]
+                if (
+                    mealplan_name.lower() == mealplan.lower()
+                    and room_kind_name not in result_rooms
+                ):
+                    result_rooms.append(room_kind_name)
+        hotel_results.raise_scan_error()
 
         if len(result_rooms) > 0:
             return ", ".join(result_rooms)
@@ -262,7 +246,7 @@ class GetRoomsWithMealPlan(Task):
             query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
 
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             hotel_id = query_args_dict["hotel_id"]
             available_rooms = query_result["available"]
             considered_mealplans = []
@@ -303,19 +287,15 @@ class GetLowestCost(Task):
     def get_answer(self, api_response: dict[Any, Any], hotel_id: str) -> str:
         lowest_gross_amount: Union[float, None] = None
 
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            resp_hotel_id = query_args_dict["hotel_id"]
-            if resp_hotel_id.strip().lower() == hotel_id.strip().lower():
-                available_rooms = query_result["available"]
-                for room_kind in available_rooms:
-                    product_prices = room_kind["product_price_breakdown"]
-                    gross_amount = product_prices["all_inclusive_amount"]["value"]
-                    if (
-                        lowest_gross_amount is None
-                        or gross_amount < lowest_gross_amount
-                    ):
-                        lowest_gross_amount = gross_amount
+        rooms = get_entity_table(api_response, ROOM_TABLE)
+        rows = rooms.get_rows(rooms.get_parents(hotel_id.strip().lower()))
+        for gross_amount in rooms.get_values("all_inclusive_amount", rows):
+            if (
+                lowest_gross_amount is None
+                or gross_amount < lowest_gross_amount
+            ):
+                lowest_gross_amount = gross_amount
+        rooms.raise_scan_error()
         return str(lowest_gross_amount)
 
     # example question: "What is all inclusive cost in USD for the cheapest type of available room?"
@@ -332,7 +312,7 @@ class GetLowestCost(Task):
             query_args = query_args_list[0]
             api_response = manipulate_response(api_response, index)
 
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             hotel_id = query_args_dict["hotel_id"]
             question = self.get_question(hotel_id=hotel_id)
             answer = self.get_answer(api_response=api_response, hotel_id=hotel_id)
@@ -360,26 +340,16 @@ class GetHighestVAT(Task):
     # example answer: 1.7419819603841
     def get_answer(self, api_response: dict[Any, Any], hotel_id: str) -> str:
         highest_vat_amount: Union[float, None] = None
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            resp_hotel_id = query_args_dict["hotel_id"]
-            if resp_hotel_id.strip().lower() == hotel_id.strip().lower():
-                available_rooms = query_result["available"]
-
-                for room_kind in available_rooms:
-                    product_prices = room_kind["product_price_breakdown"]
-                    try:
-                        product_price_items = product_prices["items"]
-                        for item in product_price_items:
-                            if item["name"] == "VAT":
-                                vat_amount = item["item_amount"]["value"]
-                                if (
-                                    highest_vat_amount is None
-                                    or vat_amount > highest_vat_amount
-                                ):
-                                    highest_vat_amount = vat_amount
-                    except KeyError:
-                        pass
+        rooms = get_entity_table(api_response, ROOM_TABLE)
+        rows = rooms.get_rows(rooms.get_parents(hotel_id.strip().lower()))
+        for vat_amounts in rooms.get_values("vat_amounts", rows):
+            for vat_amount in vat_amounts:
+                if (
+                    highest_vat_amount is None
+                    or vat_amount > highest_vat_amount
+                ):
+                    highest_vat_amount = vat_amount
+        rooms.raise_scan_error()
 
         if highest_vat_amount is not None and highest_vat_amount > 0:
             return str(highest_vat_amount)
@@ -400,7 +370,7 @@ class GetHighestVAT(Task):
             query_args = query_args_list[0]
             api_response = manipulate_response(api_response, index)
 
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             hotel_id = query_args_dict["hotel_id"]
             question = self.get_question(hotel_id=hotel_id)
             answer = self.get_answer(api_response=api_response, hotel_id=hotel_id)
@@ -1,12 +1,41 @@
-from typing import Any
+from typing import Any, Iterator
 
 from . import evals
-from .base import Task
+from .base import Task, parse_query_args
 from .data_structures import LongResponseQASample, TaskAttributes
+from .entity_tables import EntityTableSpec, get_entity_table
+from .response_index import get_response_index
 from ..large_response_utils import manipulate_response
 import json
 import os
 
+
+def iter_results_by_offer_token(api_response: dict[Any, Any]) -> Iterator[tuple[str, Any]]:
+    for query_args, query_result in api_response.items():
+        yield parse_query_args(query_args)["offerToken"], query_result
+
+
+def iter_cabins(query_result: dict[str, Any]) -> Iterator[Any]:
+    for seatMapOption in query_result["data"]["seatMap"]["seatMapOption"]:
+        yield from seatMapOption["cabins"]
+
+
+# the cabins of each record, by offerToken, with the (description, column) of their columns
+# and the (seat id, column id) of their seats
+CABIN_TABLE = EntityTableSpec(
+    iter_parents=iter_results_by_offer_token,
+    iter_entities=iter_cabins,
+    columns={
+        "columns": lambda cabin: [(col["description"], col) for col in cabin["columns"]],
+        "seats": lambda cabin: [
+            (str(row["id"]) + seat["colId"], seat["colId"])
+            for row in cabin["rows"]
+            for seat in row["seats"]
+        ],
+    },
+)
+
+
 class GetInsurancePrice(Task):
     EVALUATION_CRITERIAS = [evals.accuracy_string]
     TASK_ATTRIBUTES = [TaskAttributes.EXTRACTIVE]
@@ -17,20 +46,20 @@ class GetInsurancePrice(Task):
     def get_answer(
         self, api_response: dict[Any, Any], insurance_plan: str, offer_token: str
     ) -> str:
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            if offer_token == query_args_dict["offerToken"]:
-                if (
-                    query_result["data"]["travelInsurance"]["options"]["type"]
-                    == insurance_plan
-                ):
-                    if str(
-                        query_result["data"]["travelInsurance"]["options"][
-                            "priceBreakdown"
-                        ]["total"]["currencyCode"]
-                    )== "USD":
-                        return str(query_result["data"]["travelInsurance"]["options"][
-                            "priceBreakdown"]["total"]["units"])
+        offer_results = get_response_index(api_response, iter_results_by_offer_token)
+        for query_result in offer_results.get(offer_token):
+            if (
+                query_result["data"]["travelInsurance"]["options"]["type"]
+                == insurance_plan
+            ):
+                if str(
+                    query_result["data"]["travelInsurance"]["options"][
+                        "priceBreakdown"
+                    ]["total"]["currencyCode"]
+                )== "USD":
+                    return str(query_result["data"]["travelInsurance"]["options"][
+                        "priceBreakdown"]["total"]["units"])
+        offer_results.raise_scan_error()
         return "None"
 
     def get_qa_samples(
@@ -42,7 +71,7 @@ class GetInsurancePrice(Task):
             query_args = query_args_list[0]
             query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             offer_token = query_args_dict["offerToken"]
             insurance_plan = query_result["data"]["travelInsurance"]["options"][
                 "type"
@@ -79,41 +108,41 @@ class GetLuggageAllowance(Task):
         return f'What is the maximum luggage allowance per check-in bag for the flight with offerToken "{offer_token}"? Return the a comma separated list of type of allowance, weight, and unit.'
 
     def get_answer(self, api_response: dict[Any, Any], offer_token: str) -> str:
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            if offer_token == query_args_dict["offerToken"]:
-                if "checkedInBaggage" in query_result["data"]:
-                    return str(
+        offer_results = get_response_index(api_response, iter_results_by_offer_token)
+        for query_result in offer_results.get(offer_token):
+            if "checkedInBaggage" in query_result["data"]:
+                return str(
+                    query_result["data"]["checkedInBaggage"]["options"][0][
+                        "luggageAllowance"
+                    ]["luggageType"]
+                    + ","
+                    + str(
                         query_result["data"]["checkedInBaggage"]["options"][0][
                             "luggageAllowance"
-                        ]["luggageType"]
-                        + ","
-                        + str(
-                            query_result["data"]["checkedInBaggage"]["options"][0][
-                                "luggageAllowance"
-                            ]["maxWeightPerPiece"]
-                        ) + ","
-                        + query_result["data"]["checkedInBaggage"]["options"][0][
-                            "luggageAllowance"
-                        ]["massUnit"]
-                    )
-                elif "cabinBaggagePerTraveller" in query_result["data"]:
-                    return str(
+                        ]["maxWeightPerPiece"]
+                    ) + ","
+                    + query_result["data"]["checkedInBaggage"]["options"][0][
+                        "luggageAllowance"
+                    ]["massUnit"]
+                )
+            elif "cabinBaggagePerTraveller" in query_result["data"]:
+                return str(
+                    query_result["data"]["cabinBaggagePerTraveller"][
+                        "luggageAllowance"
+                    ]["luggageType"]
+                    + ","
+                    + str(
                         query_result["data"]["cabinBaggagePerTraveller"][
                             "luggageAllowance"
-                        ]["luggageType"]
-                        + ","
-                        + str(
-                            query_result["data"]["cabinBaggagePerTraveller"][
-                                "luggageAllowance"
-                            ]["maxWeightPerPiece"]
-                        ) + ", "
-                        + query_result["data"]["cabinBaggagePerTraveller"][
-                            "luggageAllowance"
-                        ]["massUnit"]
-                    )
-                else:
-                    return "None"
+                        ]["maxWeightPerPiece"]
+                    ) + ", "
+                    + query_result["data"]["cabinBaggagePerTraveller"][
+                        "luggageAllowance"
+                    ]["massUnit"]
+                )
+            else:
+                return "None"
+        offer_results.raise_scan_error()
         return "None"
 
     def get_qa_samples(
@@ -125,7 +154,7 @@ class GetLuggageAllowance(Task):
             query_args = query_args_list[0]
             #query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             offer_token = query_args_dict["offerToken"]
 
             question = self.get_question(offer_token=offer_token)
@@ -156,14 +185,14 @@ class ListSeatOptions(Task):
 
     def get_answer(self, api_response: dict[Any, Any], offer_token: str) -> str:
         seat_ids = []
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            if offer_token == query_args_dict["offerToken"]:
-                for seatMapOption in query_result["data"]["seatMap"]["seatMapOption"]:
-                    for cabin in seatMapOption["cabins"]:
-                        for row in cabin["rows"]:
-                            for seat in row["seats"]:
-                                seat_ids.append(str(row["id"]) + seat["colId"])
+        offer_results = get_response_index(api_response, iter_results_by_offer_token)
+        for query_result in offer_results.get(offer_token):
+            for seatMapOption in query_result["data"]["seatMap"]["seatMapOption"]:
+                for cabin in seatMapOption["cabins"]:
+                    for row in cabin["rows"]:
+                        for seat in row["seats"]:
+                            seat_ids.append(str(row["id"]) + seat["colId"])
+        offer_results.raise_scan_error()
         return ", ".join(seat_ids)
 
     def get_qa_samples(
@@ -175,7 +204,7 @@ class ListSeatOptions(Task):
             query_args = query_args_list[0]
             #query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             offer_token = query_args_dict["offerToken"]
             question = self.get_question(offer_token=offer_token)
             answer = self.get_answer(
@@ -207,19 +236,19 @@ class ListSeatOptionsBySeatType(Task):
         self, api_response: dict[Any, Any], seat_type: str, offer_token: str
     ) -> str:
         seat_ids = []
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            if offer_token == query_args_dict["offerToken"]:
-                for seatMapOption in query_result["data"]["seatMap"]["seatMapOption"]:
-                    for cabin in seatMapOption["cabins"]:
-                        seat_type_id = []
-                        for col in cabin["columns"]:
-                            if seat_type in col["description"]:
-                                seat_type_id.append(col["id"])
-                        for row in cabin["rows"]:
-                            for seat in row["seats"]:
-                                if seat["colId"] in seat_type_id:
-                                    seat_ids.append(str(row["id"]) + seat["colId"])
+        offer_results = get_response_index(api_response, iter_results_by_offer_token)
+        for query_result in offer_results.get(offer_token):
+            for seatMapOption in query_result["data"]["seatMap"]["seatMapOption"]:
+                for cabin in seatMapOption["cabins"]:
+                    seat_type_id = []
+                    for col in cabin["columns"]:
+                        if seat_type in col["description"]:
+                            seat_type_id.append(col["id"])
+                    for row in cabin["rows"]:
+                        for seat in row["seats"]:
+                            if seat["colId"] in seat_type_id:
+                                seat_ids.append(str(row["id"]) + seat["colId"])
+        offer_results.raise_scan_error()
         return ", ".join(seat_ids)
 
     def get_qa_samples(
@@ -231,7 +260,7 @@ class ListSeatOptionsBySeatType(Task):
             query_args = query_args_list[0]
             query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             combined_criteria = []
             offer_token = query_args_dict["offerToken"]
             for column in query_result["data"]["seatMap"]["seatMapOption"][0][
@@ -271,16 +300,11 @@ class CountSeatOptions(Task):
         return f'How many seat options do I have for the flight with offer token "{offer_token}"?'
 
     def get_answer(self, api_response: dict[Any, Any], offer_token: str) -> str:
-        seat_ids = []
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            if offer_token == query_args_dict["offerToken"]:
-                for seatMapOption in query_result["data"]["seatMap"]["seatMapOption"]:
-                    for cabin in seatMapOption["cabins"]:
-                        for row in cabin["rows"]:
-                            for seat in row["seats"]:
-                                seat_ids.append(str(row["id"]) + seat["colId"])
-        return str(len(seat_ids))
+        cabins = get_entity_table(api_response, CABIN_TABLE)
+        rows = cabins.get_rows(cabins.get_parents(offer_token))
+        num_seats = sum(len(seats) for seats in cabins.get_values("seats", rows))
+        cabins.raise_scan_error()
+        return str(num_seats)
 
     def get_qa_samples(
         self, api_response: dict[Any, Any], index: int = 0
@@ -291,7 +315,7 @@ class CountSeatOptions(Task):
             query_args = query_args_list[0]
             #query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             offer_token = query_args_dict["offerToken"]
             question = self.get_question(offer_token=offer_token)
             answer = self.get_answer(
@@ -324,20 +348,20 @@ class PercentSeatType(Task):
     ) -> str:
         seat_ids = []
         all_seat_ids = []
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            if offer_token == query_args_dict["offerToken"]:
-                for seatMapOption in query_result["data"]["seatMap"]["seatMapOption"]:
-                    for cabin in seatMapOption["cabins"]:
-                        seat_type_id = []
-                        for col in cabin["columns"]:
-                            if seat_type in col["description"]:
-                                seat_type_id.append(col["id"])
-                        for row in cabin["rows"]:
-                            for seat in row["seats"]:
-                                all_seat_ids.append(str(row["id"]) + seat["colId"])
-                                if seat["colId"] in seat_type_id:
-                                    seat_ids.append(str(row["id"]) + seat["colId"])
+        cabins = get_entity_table(api_response, CABIN_TABLE)
+        rows = cabins.get_rows(cabins.get_parents(offer_token))
+        for columns, seats in zip(
+            cabins.get_values("columns", rows), cabins.get_values("seats", rows)
+        ):
+            seat_type_id = []
+            for description, col in columns:
+                if seat_type in description:
+                    seat_type_id.append(col["id"])
+            for seat_id, col_id in seats:
+                all_seat_ids.append(seat_id)
+                if col_id in seat_type_id:
+                    seat_ids.append(seat_id)
+        cabins.raise_scan_error()
         return str(100 * len(seat_ids) / len(all_seat_ids))
 
     def get_qa_samples(
@@ -349,7 +373,7 @@ class PercentSeatType(Task):
             query_args = query_args_list[0]
             query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             combined_criteria = []
             offer_token = query_args_dict["offerToken"]
             for column in query_result["data"]["seatMap"]["seatMapOption"][0][
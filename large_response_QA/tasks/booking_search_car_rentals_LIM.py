@@ -1,11 +1,46 @@
-from typing import Any
+from typing import Any, Iterator
 
 from ..large_response_utils import manipulate_response
 
 from . import evals
-from .base import Task
+from .base import Task, parse_query_args
 from .data_structures import LongResponseQASample, TaskAttributes
-import json
+from .entity_tables import EntityTable, EntityTableSpec, get_entity_table
+from .response_index import get_response_index
+
+
+def iter_cars_by_vehicle_id(api_response: dict[Any, Any]) -> Iterator[tuple[str, Any]]:
+    for query_result in api_response.values():
+        for car in query_result["data"]["search_results"]:
+            yield car["vehicle_id"].strip().lower(), car
+
+
+# the cars of each record, by query args
+CAR_TABLE = EntityTableSpec(
+    iter_parents=lambda api_response: iter(api_response.items()),
+    iter_entities=lambda query_result: query_result["data"]["search_results"],
+    columns={
+        "base_price": lambda car: car["pricing_info"]["base_price"],
+        "transmission": lambda car: car["vehicle_info"]["transmission"].strip().lower(),
+    },
+)
+
+
+def get_pick_up_parents(
+    cars: EntityTable, pick_up_latitude: str, pick_up_longitude: str, pick_up_date: str
+) -> list[int]:
+    # the records of the pick-up location and date, in scan order
+    parents = []
+    for parent, query_args in enumerate(cars.parent_keys):
+        query_args_dict = parse_query_args(query_args)
+        if (
+            query_args_dict["pick_up_latitude"] == pick_up_latitude
+            and query_args_dict["pick_up_longitude"] == pick_up_longitude
+            and query_args_dict["pick_up_date"] == pick_up_date
+        ):
+            parents.append(parent)
+    return parents
+
 
 class GetCleanlinessRating(Task):
     EVALUATION_CRITERIAS = [evals.accuracy_string]
@@ -15,10 +50,10 @@ class GetCleanlinessRating(Task):
         return f'What is the cleanliness rating of "{vehicle_id}"?'
 
     def get_answer(self, api_response: dict[Any, Any], vehicle_id: str) -> str:
-        for query_args, query_result in api_response.items():
-            for car in query_result["data"]["search_results"]:
-                if car["vehicle_id"].strip().lower() == vehicle_id.strip().lower():
-                    return str(car["rating_info"]["cleanliness"])
+        cars = get_response_index(api_response, iter_cars_by_vehicle_id)
+        for car in cars.get(vehicle_id.strip().lower()):
+            return str(car["rating_info"]["cleanliness"])
+        cars.raise_scan_error()
         return "None"
 
     def get_qa_samples(
@@ -59,10 +94,10 @@ class GetFuelPolicy(Task):
         return f'What is the fuel policy of "{vehicle_id}"?'
 
     def get_answer(self, api_response: dict[Any, Any], vehicle_id: str) -> str:
-        for query_args, query_result in api_response.items():
-            for car in query_result["data"]["search_results"]:
-                if car["vehicle_id"].strip().lower() == vehicle_id.strip().lower():
-                    return str(car["vehicle_info"]["fuel_policy"])
+        cars = get_response_index(api_response, iter_cars_by_vehicle_id)
+        for car in cars.get(vehicle_id.strip().lower()):
+            return str(car["vehicle_info"]["fuel_policy"])
+        cars.raise_scan_error()
         return "None"
 
     def get_qa_samples(
@@ -119,7 +154,7 @@ class ListCarInCurrency(Task):
         vehicle_list = []
         at_least_one = False
         for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             if (
                 query_args_dict["pick_up_latitude"] == pick_up_latitude
                 and query_args_dict["pick_up_longitude"] == pick_up_longitude
@@ -147,7 +182,7 @@ class ListCarInCurrency(Task):
             query_result = api_response[query_args]
             api_response = manipulate_response(api_response, index)
 
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             pick_up_latitude = query_args_dict["pick_up_latitude"]
             pick_up_longitude = query_args_dict["pick_up_longitude"]
             pick_up_date = query_args_dict["pick_up_date"]
@@ -204,7 +239,7 @@ class ListCarFreeCancellation(Task):
         vehicle_list = []
         at_least_one = False
         for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             if (
                 query_args_dict["pick_up_latitude"] == pick_up_latitude
                 and query_args_dict["pick_up_longitude"] == pick_up_longitude
@@ -231,7 +266,7 @@ class ListCarFreeCancellation(Task):
             query_args = query_args_list[0]
             api_response = manipulate_response(api_response, index)
 
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             pick_up_latitude = query_args_dict["pick_up_latitude"]
             pick_up_longitude = query_args_dict["pick_up_longitude"]
             pick_up_date = query_args_dict["pick_up_date"]
@@ -279,21 +314,14 @@ class CountCarsByTransmission(Task):
         pick_up_longitude: str,
         pick_up_date: str,
     ) -> str:
-        car_count = 0
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            if (
-                query_args_dict["pick_up_latitude"] == pick_up_latitude
-                and query_args_dict["pick_up_longitude"] == pick_up_longitude
-                and query_args_dict["pick_up_date"] == pick_up_date
-            ):
-                for car in query_result["data"]["search_results"]:
-                    if (
-                        car["vehicle_info"]["transmission"].strip().lower()
-                        == transmission_type.strip().lower()
-                    ):
-                        car_count += 1
-        return str(car_count)
+        cars = get_entity_table(api_response, CAR_TABLE)
+        rows = cars.get_rows(
+            get_pick_up_parents(cars, pick_up_latitude, pick_up_longitude, pick_up_date)
+        )
+        transmissions = cars.get_values("transmission", rows)
+        if len(transmissions) == 0:
+            return "0"
+        return str(transmissions.count(transmission_type.strip().lower()))
 
     def get_qa_samples(
         self, api_response: dict[Any, Any], index: int = 0
@@ -306,7 +334,7 @@ class CountCarsByTransmission(Task):
             api_response = manipulate_response(api_response, index)
 
             query_result = api_response[query_args]
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             pick_up_latitude = query_args_dict["pick_up_latitude"]
             pick_up_longitude = query_args_dict["pick_up_longitude"]
             pick_up_date = query_args_dict["pick_up_date"]
@@ -355,16 +383,11 @@ class CheapestCar(Task):
         pick_up_longitude: str,
         pick_up_date: str,
     ) -> str:
-        car_price = []
-        for query_args, query_result in api_response.items():
-            query_args_dict = json.loads(query_args.replace("'", '"'))
-            if (
-                query_args_dict["pick_up_latitude"] == pick_up_latitude
-                and query_args_dict["pick_up_longitude"] == pick_up_longitude
-                and query_args_dict["pick_up_date"] == pick_up_date
-            ):
-                for car in query_result["data"]["search_results"]:
-                    car_price.append(car["pricing_info"]["base_price"])
+        cars = get_entity_table(api_response, CAR_TABLE)
+        rows = cars.get_rows(
+            get_pick_up_parents(cars, pick_up_latitude, pick_up_longitude, pick_up_date)
+        )
+        car_price = cars.get_values("base_price", rows)
         return str(min(car_price))
 
     def get_qa_samples(
@@ -375,7 +398,7 @@ class CheapestCar(Task):
         try:
             query_args = query_args_list[0]
             api_response = manipulate_response(api_response, index)
-            query_args_dict = json.loads(query_args.replace("'", '"'))
+            query_args_dict = parse_query_args(query_args)
             pick_up_latitude = query_args_dict["pick_up_latitude"]
             pick_up_longitude = query_args_dict["pick_up_longitude"]
             pick_up_date = query_args_dict["pick_up_date"]
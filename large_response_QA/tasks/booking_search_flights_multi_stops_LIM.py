@@ -1,153 +1,164 @@
 import json
 from datetime import datetime
-from typing import Any, Union
+from typing import Any, Callable, Iterator, Union
 
 from ..large_response_utils import manipulate_response
 
 from . import evals
 from .base import Task
 from .data_structures import LongResponseQASample, TaskAttributes
+from .response_index import get_response_view
+from .task_spec import TaskSpec, compile_task_spec
 
 
-class GetDestinationAirport(Task):
-    """Get the destination airport code for a flight number.
-    The tool spec for Search_Flights_Multi_Stops can be found at https://github.com/THUDM/ComplexFuncBench/blob/main/utils/tool_info.json
-    """
+def iter_flight_segments(query_result: dict[str, Any]) -> Iterator[Any]:
+    for flight_offer in query_result["data"]["flightOffers"]:
+        yield from flight_offer["segments"]
 
-    EVALUATION_CRITERIAS = [evals.accuracy_string]
-    TASK_ATTRIBUTES = [TaskAttributes.EXTRACTIVE]
 
-    # example answer: AMS
-    def get_answer(self, api_response: dict[Any, Any], flight_number: int) -> str:
-        for _, query_result in api_response.items():
-            flight_offers = query_result["data"]["flightOffers"]
-            for flight_offer in flight_offers:
-                flight_segments = flight_offer["segments"]
-                for flight_segment in flight_segments:
-                    flight_legs = flight_segment["legs"]
-                    for flight_leg in flight_legs:
-                        flightInfo = flight_leg["flightInfo"]
-                        if flightInfo["flightNumber"] == flight_number:
-                            return str(flight_leg["arrivalAirport"]["code"])
-        return "None"
+def get_operating_carrier(segment: dict[str, Any]) -> Union[str, None]:
+    flight_info = segment["legs"][0]["flightInfo"]
+    if "carrierInfo" not in flight_info:
+        return None
+    return str(flight_info["carrierInfo"]["operatingCarrier"])
 
-    # example question: "What is the arrival airport code for flight 606?"
-    def get_question(self, flight_number: int) -> str:
-        return f"What is the arrival airport code for flight {flight_number}?"
 
-    # This signature deviates from the base class as we added index. Should we add it to the base?
-    def get_qa_samples(
-        self, api_response: dict[Any, Any], index: int = 0
-    ) -> list[LongResponseQASample]:
+# {name: the value of a flight segment} of the segments of a FlightRouteIndex
+FLIGHT_SEGMENT_VALUES: dict[str, Callable[[Any], Any]] = {
+    "total_time": lambda segment: segment["totalTime"],
+    # format: "departureTime": "2024-12-30T08:02:00",
+    "departure_time": lambda segment: datetime.fromisoformat(segment["departureTime"]),
+    "num_legs": lambda segment: len(segment["legs"]),
+    "flight_number": lambda segment: segment["legs"][0]["flightInfo"]["flightNumber"],
+    "operating_carrier": get_operating_carrier,
+}
 
-        qa_samples: list[LongResponseQASample] = []
-        query_args_list = list(api_response.keys())
-        try:
-            query_args = query_args_list[0]
-            query_result = api_response[query_args]
-            considered_flight_numbers = []
-            api_response = manipulate_response(api_response, index)
-            flight_offers = query_result["data"]["flightOffers"]
-            for flight_offer in flight_offers:
-                flight_segments = flight_offer["segments"]
-                for flight_segment in flight_segments:
-                    flight_legs = flight_segment["legs"]
-                    for flight_leg in flight_legs:
-                        flightInfo = flight_leg["flightInfo"]
-                        flight_number = flightInfo["flightNumber"]
-                        if flight_number not in considered_flight_numbers:
-                            considered_flight_numbers.append(flight_number)
-                            question = self.get_question(flight_number=flight_number)
-                            answer = self.get_answer(
-                                api_response=api_response, flight_number=flight_number
-                            )
 
-                            if (
-                                answer is not None
-                                and answer != "None"
-                                and len(qa_samples) < 5
-                            ):
-                                task = LongResponseQASample(
-                                    api_response=api_response,
-                                    question=question,
-                                    gold_answer=answer,
-                                )
-                                qa_samples.append(task)
-        except BaseException:
-            pass
+class _ValueError:
+    # the error of reading a value of a flight segment, raised when the value is used
+    __slots__ = ("error",)
 
-        return qa_samples
+    def __init__(self, error: Exception) -> None:
+        self.error = error
 
 
-class GetFlightDuration(Task):
-    """Get the flight duration for a flight number.
-    The tool spec for Search_Flights_Multi_Stops can be found at https://github.com/THUDM/ComplexFuncBench/blob/main/utils/tool_info.json
+class FlightSegment:
+    """
+    A flight segment of a FlightRouteIndex, with its airport codes and FLIGHT_SEGMENT_VALUES.
+    A value that cannot be read, e.g. the departure time of a segment without one, is kept as
+    its error and raised by get, so that the questions fail on the same api responses as the
+    scans of the flight offers.
     """
 
-    EVALUATION_CRITERIAS = [evals.accuracy_string]
-    TASK_ATTRIBUTES = [TaskAttributes.EXTRACTIVE]
-
-    # example answer: 4260
-    def get_answer(self, api_response: dict[Any, Any], flight_number: int) -> str:
-        for _, query_result in api_response.items():
-            flight_offers = query_result["data"]["flightOffers"]
-            for flight_offer in flight_offers:
-                flight_segments = flight_offer["segments"]
-                for flight_segment in flight_segments:
-                    flight_legs = flight_segment["legs"]
-                    for flight_leg in flight_legs:
-                        flightInfo = flight_leg["flightInfo"]
-                        if flightInfo["flightNumber"] == flight_number:
-                            return str(flight_leg["totalTime"])
-        return "None"
-
-    # example question: How long is the flight 676? Please only output the duration without the unit and nothing else.
-    def get_question(self, flight_number: int) -> str:
-        return f"How long is the flight {flight_number}? Please only output the duration without the unit and nothing else."
+    __slots__ = ("departure_airport", "arrival_airport", "_values")
 
-    # This signature deviates from the base class as we added index. Should we add it to the base?
-    def get_qa_samples(
-        self, api_response: dict[Any, Any], index: int = 0
-    ) -> list[LongResponseQASample]:
+    def __init__(self, departure_airport: str, arrival_airport: str, segment: Any) -> None:
+        self.departure_airport = departure_airport
+        self.arrival_airport = arrival_airport
+        self._values: dict[str, Any] = {}
+        for name, get_value in FLIGHT_SEGMENT_VALUES.items():
+            try:
+                self._values[name] = get_value(segment)
+            except Exception as e:
+                self._values[name] = _ValueError(e)
 
-        qa_samples: list[LongResponseQASample] = []
-        query_args_list = list(api_response.keys())
-        try:
-            query_args = query_args_list[0]
-            query_result = api_response[query_args]
-            considered_flight_numbers = []
-            api_response = manipulate_response(api_response, index)
+    def get(self, name: str) -> Any:
+        value = self._values[name]
+        if isinstance(value, _ValueError):
+            raise value.error.with_traceback(None)
+        return value
 
-            flight_offers = query_result["data"]["flightOffers"]
-            for flight_offer in flight_offers:
-                flight_segments = flight_offer["segments"]
-                for flight_segment in flight_segments:
-                    flight_legs = flight_segment["legs"]
-                    for flight_leg in flight_legs:
-                        flightInfo = flight_leg["flightInfo"]
-                        flight_number = flightInfo["flightNumber"]
-                        if flight_number not in considered_flight_numbers:
-                            considered_flight_numbers.append(flight_number)
-                            question = self.get_question(flight_number=flight_number)
-                            answer = self.get_answer(
-                                api_response=api_response, flight_number=flight_number
-                            )
 
-                            if (
-                                answer is not None
-                                and answer != "None"
-                                and len(qa_samples) < 5
-                            ):
-                                task = LongResponseQASample(
-                                    api_response=api_response,
-                                    question=question,
-                                    gold_answer=answer,
-                                )
-                                qa_samples.append(task)
-        except BaseException:
-            pass
+class FlightRouteIndex:
+    """
+    The flight segments of the records of an api response by their route, the stripped and
+    lowercase (departure airport, arrival airport) codes, in scan order. The route questions
+    look up the segments of their route instead of going through all the flight offers. If the
+    scan fails, or the arrival airport code of a segment from a departure airport cannot be
+    normalized, the error is raised by the lookups (of the routes from that airport), like the
+    scans of the flight offers that compare the airport codes.
+    """
 
-        return qa_samples
+    def __init__(self, api_response: dict[Any, Any]) -> None:
+        self.num_segments = 0
+        self._routes: dict[tuple[str, str], list[FlightSegment]] = {}
+        self._departure_airports: set[str] = set()
+        self._arrival_errors: dict[str, Exception] = {}
+        self._scan_error: Union[Exception, None] = None
+        try:
+            for query_result in api_response.values():
+                for segment in iter_flight_segments(query_result):
+                    departure_airport = segment["departureAirport"]["code"]
+                    arrival_airport = segment["arrivalAirport"]["code"]
+                    departure_key = departure_airport.strip().lower()
+                    self.num_segments += 1
+                    self._departure_airports.add(departure_key)
+                    try:
+                        arrival_key = arrival_airport.strip().lower()
+                    except Exception as e:
+                        self._arrival_errors.setdefault(departure_key, e)
+                        continue
+                    self._routes.setdefault((departure_key, arrival_key), []).append(
+                        FlightSegment(departure_airport, arrival_airport, segment)
+                    )
+        except Exception as e:
+            self._scan_error = e
+
+    def get_route(
+        self, departure_airport_code: str, arrival_airport_code: str
+    ) -> list[FlightSegment]:
+        """The segments of the route, in scan order. The list must not be modified."""
+        if self._scan_error is not None:
+            raise self._scan_error.with_traceback(None)
+        if self.num_segments == 0:
+            return []
+        departure_key = departure_airport_code.strip().lower()
+        if departure_key not in self._departure_airports:
+            return []
+        if departure_key in self._arrival_errors:
+            raise self._arrival_errors[departure_key].with_traceback(None)
+        return self._routes.get((departure_key, arrival_airport_code.strip().lower()), [])
+
+
+def get_flight_route_index(api_response: dict[Any, Any]) -> FlightRouteIndex:
+    """The FlightRouteIndex of api_response, see get_response_view."""
+    return get_response_view(api_response, FlightRouteIndex, FlightRouteIndex)
+
+
+# Get the destination airport code for a flight number.
+# The tool spec for Search_Flights_Multi_Stops can be found at https://github.com/THUDM/ComplexFuncBench/blob/main/utils/tool_info.json
+# example answer: AMS
+GetDestinationAirport = compile_task_spec(
+    TaskSpec(
+        name="GetDestinationAirport",
+        question="What is the arrival airport code for flight {flight_number}?",
+        entities="data.flightOffers[].segments[].legs[]",
+        arguments={"flight_number": "flightInfo.flightNumber"},
+        match={"flight_number": "flightInfo.flightNumber"},
+        value="arrivalAirport.code",
+        evaluation_criterias=(evals.accuracy_string,),
+        task_attributes=(TaskAttributes.EXTRACTIVE,),
+    ),
+    __name__,
+)
+
+
+# Get the flight duration for a flight number.
+# The tool spec for Search_Flights_Multi_Stops can be found at https://github.com/THUDM/ComplexFuncBench/blob/main/utils/tool_info.json
+# example answer: 4260
+GetFlightDuration = compile_task_spec(
+    TaskSpec(
+        name="GetFlightDuration",
+        question="How long is the flight {flight_number}? Please only output the duration without the unit and nothing else.",
+        entities="data.flightOffers[].segments[].legs[]",
+        arguments={"flight_number": "flightInfo.flightNumber"},
+        match={"flight_number": "flightInfo.flightNumber"},
+        value="totalTime",
+        evaluation_criterias=(evals.accuracy_string,),
+        task_attributes=(TaskAttributes.EXTRACTIVE,),
+    ),
+    __name__,
+)
 
 
 class GetNonstopFlightsFromSrcToDest(Task):
@@ -166,25 +177,12 @@ class GetNonstopFlightsFromSrcToDest(Task):
         arrival_airport_code: str,
     ) -> str:
         flight_numbers = []
-        for _, query_result in api_response.items():
-            flight_offers = query_result["data"]["flightOffers"]
-            for flight_offer in flight_offers:
-                flight_segments = flight_offer["segments"]
-                for flight_segment in flight_segments:
-                    departure_airport = flight_segment["departureAirport"]["code"]
-                    arrival_airport = flight_segment["arrivalAirport"]["code"]
-                    if (
-                        departure_airport.strip().lower()
-                        == departure_airport_code.strip().lower()
-                        and arrival_airport.strip().lower()
-                        == arrival_airport_code.strip().lower()
-                    ):
-                        flight_legs = flight_segment["legs"]
-                        if len(flight_legs) == 1:  # non-stop flights
-                            flight_leg = flight_legs[0]
-                            flightInfo = flight_leg["flightInfo"]
-                            if str(flightInfo["flightNumber"]) not in flight_numbers:
-                                flight_numbers.append(str(flightInfo["flightNumber"]))
+        routes = get_flight_route_index(api_response)
+        for flight_segment in routes.get_route(departure_airport_code, arrival_airport_code):
+            if flight_segment.get("num_legs") == 1:  # non-stop flights
+                flight_number = str(flight_segment.get("flight_number"))
+                if flight_number not in flight_numbers:
+                    flight_numbers.append(flight_number)
         if len(flight_numbers) > 0:
             return ", ".join(flight_numbers)
         else:
@@ -266,33 +264,16 @@ class GetOperatingCarriers(Task):
         arrival_airport_code: str,
     ) -> str:
         operating_carriers = []
-        for _, query_result in api_response.items():
-            flight_offers = query_result["data"]["flightOffers"]
-            for flight_offer in flight_offers:
-                flight_segments = flight_offer["segments"]
-                for flight_segment in flight_segments:
-                    departure_airport = flight_segment["departureAirport"]["code"]
-                    arrival_airport = flight_segment["arrivalAirport"]["code"]
-                    if (
-                        departure_airport.strip().lower()
-                        == departure_airport_code.strip().lower()
-                        and arrival_airport.strip().lower()
-                        == arrival_airport_code.strip().lower()
-                    ):
-                        flight_legs = flight_segment["legs"]
-                        if (
-                            len(flight_legs) == 1
-                        ):  # non-stop flights so the segment airport codes match.
-                            flight_leg = flight_legs[0]
-                            flightInfo = flight_leg["flightInfo"]
-                            if (
-                                "carrierInfo" in flightInfo
-                                and str(flightInfo["carrierInfo"]["operatingCarrier"])
-                                not in operating_carriers
-                            ):
-                                operating_carriers.append(
-                                    str(flightInfo["carrierInfo"]["operatingCarrier"])
-                                )
+        routes = get_flight_route_index(api_response)
+        for flight_segment in routes.get_route(departure_airport_code, arrival_airport_code):
+            # non-stop flights so the segment airport codes match.
+            if flight_segment.get("num_legs") == 1:
+                operating_carrier = flight_segment.get("operating_carrier")
+                if (
+                    operating_carrier is not None
+                    and operating_carrier not in operating_carriers
+                ):
+                    operating_carriers.append(operating_carrier)
         if len(operating_carriers) > 0:
             return ", ".join(operating_carriers)
         else:
@@ -375,25 +356,12 @@ class GetShortestFlight(Task):
         arrival_airport_code: str,
     ) -> str:
         shortest_time: Union[int, None] = None
-        for _, query_result in api_response.items():
-            flight_offers = query_result["data"]["flightOffers"]
-            for flight_offer in flight_offers:
-                flight_segments = flight_offer["segments"]
-                for flight_segment in flight_segments:
-                    departure_airport = flight_segment["departureAirport"]["code"]
-                    arrival_airport = flight_segment["arrivalAirport"]["code"]
-                    if (
-                        departure_airport.strip().lower()
-                        == departure_airport_code.strip().lower()
-                        and arrival_airport.strip().lower()
-                        == arrival_airport_code.strip().lower()
-                    ):
-                        time_duration = flight_segment["totalTime"]
-                        print(
-                            departure_airport_code, arrival_airport_code, time_duration
-                        )
-                        if shortest_time is None or time_duration < shortest_time:
-                            shortest_time = time_duration
+        routes = get_flight_route_index(api_response)
+        for flight_segment in routes.get_route(departure_airport_code, arrival_airport_code):
+            time_duration = flight_segment.get("total_time")
+            print(departure_airport_code, arrival_airport_code, time_duration)
+            if shortest_time is None or time_duration < shortest_time:
+                shortest_time = time_duration
         if shortest_time is not None:
             return str(shortest_time)
         else:
@@ -477,29 +445,17 @@ class GetEarliestFlight(Task):
     ) -> str:
         earliest_time: Union[datetime, None] = None
         earliest_flight = "None"
-        for _, query_result in api_response.items():
-            flight_offers = query_result["data"]["flightOffers"]
-            for flight_offer in flight_offers:
-                flight_segments = flight_offer["segments"]
-                for flight_segment in flight_segments:
-                    departure_airport = flight_segment["departureAirport"]["code"]
-                    arrival_airport = flight_segment["arrivalAirport"]["code"]
-                    if (
-                        departure_airport.strip().lower()
-                        == departure_airport_code.strip().lower()
-                        and arrival_airport.strip().lower()
-                        == arrival_airport_code.strip().lower()
-                    ):
-                        # format: "departureTime": "2024-12-30T08:02:00",
-                        departure_time = datetime.fromisoformat(
-                            flight_segment["departureTime"]
-                        )
-                        if (earliest_time is None) or (departure_time < earliest_time):
-                            print(departure_airport, arrival_airport, departure_time)
-                            earliest_time = departure_time
-                            earliest_flight = flight_segment["legs"][0]["flightInfo"][
-                                "flightNumber"
-                            ]
+        routes = get_flight_route_index(api_response)
+        for flight_segment in routes.get_route(departure_airport_code, arrival_airport_code):
+            departure_time = flight_segment.get("departure_time")
+            if (earliest_time is None) or (departure_time < earliest_time):
+                print(
+                    flight_segment.departure_airport,
+                    flight_segment.arrival_airport,
+                    departure_time,
+                )
+                earliest_time = departure_time
+                earliest_flight = flight_segment.get("flight_number")
         return str(earliest_flight)
 
     # example question: Get the earliest flight from DFW to ORD. Only output flight number and no other information.
@@ -17,3 +17,36 @@ class LongResponseQASample:
     pred_answer: Any = None
     metrics: Any = None
     task_type: Union[list[TaskAttributes], None] = None
+    # the stable ID of the question of a materialized prompt, see prompt_store.py
+    sample_id: Union[str, None] = None
+
+
+@dataclass
+class SubsetRecordInfo:
+    query_args: str
+    record: Any  # the record as written to the data subset
+    tokenized_record: Any  # the part of the record whose tokens are counted
+    features: Any  # eligibility features of the record used by the data subset walk
+    # False if the record could not be prepared, it is then never part of a data subset
+    preparable: bool = True
+
+
+@dataclass
+class SubsetWalkStep:
+    query_args: str
+    record: Any  # the record as written to the data subset
+    cumulative_tokens: int  # running token count of the walk after this step
+    include: bool  # whether the record is eligible to be part of the subset
+
+
+@dataclass
+class SubsetWalk:
+    app: Any
+    endpoint: Any
+    steps: list[SubsetWalkStep]
+    num_tokens: int
+    token_limit_reached: bool  # False if the walk stopped after a full cycle without progress
+    num_ineligible_visits: int
+    # number of the last steps that the walk would repeat until the token limit if it went on,
+    # 0 if it reached the token limit or could not reach it
+    num_repeated_steps: int = 0
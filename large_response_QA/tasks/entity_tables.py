@@ -0,0 +1,119 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional
+
+from .response_index import get_response_view
+
+# The aggregation tasks, e.g. the cheapest car or the lowest cost of the rooms of a hotel, read a
+# few values of all the entities of some records of an api response. The entities are flattened
+# once per api response into a table with one list of values per column and a row per entity,
+# grouped by their parent (e.g. the record or the timeslot offer with the entities), so that the
+# questions only go through the values of the rows of their parents instead of walking the
+# nested dicts. The values keep their types, so the answers are the same str() of the values.
+# The columns are plain lists rather than numpy or pandas columns, whose dtypes would change the
+# str() of e.g. mixed int and float prices. A question must only read the rows of its own parents:
+# a malformed entity of another parent fails it only if the nested scan read that entity too.
+
+
+@dataclass(frozen=True, eq=False)
+class EntityTableSpec:
+    # (parent key, parent) of the api response, in scan order
+    iter_parents: Callable[[Any], Iterator[tuple[Hashable, Any]]]
+    # the entities of a parent, in scan order
+    iter_entities: Callable[[Any], Iterable[Any]]
+    # {column name: the value of an entity}
+    columns: dict[str, Callable[[Any], Any]]
+
+
+class _CellError:
+    # the error of getting the value of an entity, raised when the value is used
+    __slots__ = ("error",)
+
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+
+
+class EntityTable:
+    """
+    The entities of an api response as columns. The parents are numbered in scan order, and
+    the rows of a parent are the numbers of its entities. If getting a value, the entities of a
+    parent or the parents fails, e.g. with a KeyError, the error is kept and only raised when
+    the value or the rows of the parent are used, or by raise_scan_error, so that the tasks fail
+    on the same api responses as the scans of the nested dicts.
+    """
+
+    def __init__(self, api_response: Any, spec: EntityTableSpec) -> None:
+        self.columns: dict[str, list[Any]] = {name: [] for name in spec.columns}
+        self.parent_keys: list[Hashable] = []
+        self._parent_rows: list[range] = []
+        self._parent_errors: list[Optional[Exception]] = []
+        self._parents_by_key: dict[Hashable, list[int]] = {}
+        # (key, parent) of the keys that cannot be hashed, compared with == as in the nested scans,
+        # see ResponseIndex
+        self._unhashable_parents: list[tuple[Any, int]] = []
+        self._scan_error: Optional[Exception] = None
+        num_rows = 0
+        try:
+            for key, parent in spec.iter_parents(api_response):
+                start = num_rows
+                parent_error = None
+                try:
+                    for entity in spec.iter_entities(parent):
+                        for name, get_value in spec.columns.items():
+                            try:
+                                value = get_value(entity)
+                            except Exception as e:
+                                value = _CellError(e)
+                            self.columns[name].append(value)
+                        num_rows += 1
+                except Exception as e:
+                    parent_error = e
+                try:
+                    self._parents_by_key.setdefault(key, []).append(len(self.parent_keys))
+                except TypeError:
+                    self._unhashable_parents.append((key, len(self.parent_keys)))
+                self.parent_keys.append(key)
+                self._parent_rows.append(range(start, num_rows))
+                self._parent_errors.append(parent_error)
+        except Exception as e:
+            self._scan_error = e
+
+    @property
+    def num_parents(self) -> int:
+        return len(self.parent_keys)
+
+    def get_parents(self, key: Any) -> list[int]:
+        """The parents with the key, in scan order. The list must not be modified."""
+        try:
+            return self._parents_by_key.get(key, [])
+        except TypeError:
+            return [
+                parent for parent_key, parent in self._unhashable_parents if parent_key == key
+            ]
+
+    def get_rows(self, parents: Iterable[int]) -> list[int]:
+        rows: list[int] = []
+        for parent in parents:
+            parent_error = self._parent_errors[parent]
+            if parent_error is not None:
+                raise parent_error.with_traceback(None)
+            rows.extend(self._parent_rows[parent])
+        return rows
+
+    def get_values(self, column: str, rows: Iterable[int]) -> list[Any]:
+        column_values = self.columns[column]
+        values = [column_values[row] for row in rows]
+        for value in values:
+            if isinstance(value, _CellError):
+                raise value.error.with_traceback(None)
+        return values
+
+    def raise_scan_error(self) -> None:
+        if self._scan_error is not None:
+            raise self._scan_error.with_traceback(None)
+
+
+def get_entity_table(api_response: Any, spec: EntityTableSpec) -> EntityTable:
+    """The EntityTable of spec for api_response, see get_response_view."""
+    return get_response_view(
+        api_response, spec, lambda api_response: EntityTable(api_response, spec)
+    )
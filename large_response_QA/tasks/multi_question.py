@@ -0,0 +1,66 @@
+import re
+from typing import Any, Optional
+
+from .. import json_codec
+
+# In the multi-question mode, a prompt asks all the questions about an api response at once and
+# the model answers with a JSON object of the answers by question number, instead of one prompt
+# (with the same api response) per question.
+
+_ANSWER_LINE = re.compile(r'^\s*"?(\d+)"?\s*[:.)]\s*(.*?)\s*,?\s*$')
+
+
+def get_multi_question_part(questions: list[str], source_name: str) -> str:
+    """The part of a multi-question prompt after the api response, see Task.get_prompt_parts."""
+    numbered_questions = "".join(
+        f"{number}. {question}\n" for number, question in enumerate(questions, start=1)
+    )
+    answers_example = ", ".join(
+        f'"{number}": "<answer {number}>"' for number in range(1, len(questions) + 1)
+    )
+    return (
+        f"Questions:\n{numbered_questions}\n"
+        "Answer each question based on the information provided in the API response. "
+        "Only respond with a JSON object with the answer of each question by its number, "
+        f"e.g. {{{answers_example}}}. Do not include any other text in the response. "
+        "Do not rephrase the answers or write them in complete sentences, return them exactly "
+        f"as is from the {source_name}.\n\n"
+        "Answers:"
+    )
+
+
+def _get_answer_text(answer: Any) -> str:
+    # the gold answers are str() of the values, and the lists are joined with ", "
+    if isinstance(answer, (list, tuple)):
+        return ", ".join(_get_answer_text(element) for element in answer)
+    return answer if isinstance(answer, str) else str(answer)
+
+
+def parse_multi_question_answers(generation: str, num_questions: int) -> list[Optional[str]]:
+    """
+    The answers of the num_questions questions of a multi-question prompt, by question number.
+    The answers are read from the JSON object of the generation, or from its "<number>: <answer>"
+    lines if it is not valid JSON. The answers that are missing are None.
+    """
+    answers: dict[int, str] = {}
+    start = generation.find("{")
+    end = generation.rfind("}")
+    parsed: Any = None
+    if 0 <= start < end:
+        try:
+            parsed = json_codec.loads(generation[start : end + 1])
+        except ValueError:
+            parsed = None
+    if isinstance(parsed, dict):
+        for number, answer in parsed.items():
+            if str(number).strip().isdigit():
+                answers[int(str(number).strip())] = _get_answer_text(answer)
+    else:
+        for line in generation.splitlines():
+            match = _ANSWER_LINE.match(line)
+            if match is not None:
+                answer = match.group(2)
+                if len(answer) >= 2 and answer[0] == answer[-1] == '"':
+                    answer = answer[1:-1]
+                answers.setdefault(int(match.group(1)), answer)
+    return [answers.get(number) for number in range(1, num_questions + 1)]
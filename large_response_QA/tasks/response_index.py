@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+# The gold answers of most tasks look up the records or nested items of an api response by an
+# identifier, e.g. a vehicle_id, an offerToken or a flight number. Instead of scanning the api
+# response for each question, its items are indexed by their identifier once, and the index is
+# shared by all the questions and tasks (of a task list) with the same api response object.
+
+ResponseItems = Callable[[Any], Iterator[tuple[Hashable, Any]]]
+
+
+class ResponseIndex:
+    """
+    The (key, item) pairs of iter_items(api_response) by key, in the order in which the scan of
+    the api response visits them. If the scan fails, e.g. with a KeyError on an item without the
+    identifier, only the items before the failure are indexed and raise_scan_error re-raises the
+    error. A lookup that goes through the items of its key and then calls raise_scan_error
+    behaves like the scan: it returns the first matching item before the failure, or fails.
+    The keys that cannot be hashed, e.g. an identifier that is a list in the api response, are
+    compared with == as in the scan.
+    """
+
+    def __init__(self, api_response: Any, iter_items: ResponseItems) -> None:
+        self._items: dict[Hashable, list[Any]] = {}
+        # (key, item) of the keys that cannot be hashed, in scan order. The values of an api
+        # response that can be hashed are never equal to the ones that cannot.
+        self._unhashable_items: list[tuple[Any, Any]] = []
+        self._scan_error: Optional[Exception] = None
+        try:
+            for key, item in iter_items(api_response):
+                try:
+                    self._items.setdefault(key, []).append(item)
+                except TypeError:
+                    self._unhashable_items.append((key, item))
+        except Exception as e:
+            self._scan_error = e
+
+    def get(self, key: Any) -> list[Any]:
+        """The items with the key, in scan order. The list must not be modified."""
+        try:
+            return self._items.get(key, [])
+        except TypeError:
+            return [item for item_key, item in self._unhashable_items if item_key == key]
+
+    def raise_scan_error(self) -> None:
+        if self._scan_error is not None:
+            raise self._scan_error.with_traceback(None)
+
+
+# {(id of an api response, key): (api response, what get_response_view built for them)} of the
+# latest calls of get_response_view
+_response_views: OrderedDict[tuple[int, Hashable], tuple[Any, Any]] = OrderedDict()
+_max_response_views = 32
+
+
+def get_response_view(api_response: Any, key: Hashable, build: Callable[[Any], Any]) -> Any:
+    """
+    build(api_response), e.g. an index or a table of the api response, built once for the same
+    api_response object and key. api_response must not be modified.
+    """
+    cache_key = (id(api_response), key)
+    if cache_key in _response_views and _response_views[cache_key][0] is api_response:
+        _response_views.move_to_end(cache_key)
+        return _response_views[cache_key][1]
+    view = build(api_response)
+    _response_views[cache_key] = (api_response, view)
+    while len(_response_views) > _max_response_views:
+        _response_views.popitem(last=False)
+    return view
+
+
+def get_response_index(api_response: Any, iter_items: ResponseItems) -> ResponseIndex:
+    """The ResponseIndex of the items of iter_items(api_response), see get_response_view."""
+    return get_response_view(
+        api_response, iter_items, lambda api_response: ResponseIndex(api_response, iter_items)
+    )
@@ -1,9 +1,21 @@
-import json
+import inspect
 import random
+from functools import lru_cache
 from typing import Any, Optional, Type
 
 from transformers import AutoTokenizer
 
+from .. import json_codec
+from ..manifest import get_text_hash
+from ..response_store import ResponseStore, is_response_store
+from ..serialization_cache import SerializationCache
+from ..serializers import DEFAULT_RESPONSE_FORMAT, serialize_response
+from ..subset_store import BinaryDataSubset, is_binary_data_subset
+from ..token_counting import (
+    ApproximateTokenCounter,
+    fit_approximate_token_counter,
+    sample_calibration_records,
+)
 from . import (
     base,
     booking_get_availability_LIM,
@@ -12,11 +24,66 @@ from . import (
     booking_get_seat_map_LIM,
     booking_search_flights_multi_stops_LIM
     )
+from .data_structures import (
+    LongResponseQASample,
+    SubsetRecordInfo,
+    SubsetWalk,
+    SubsetWalkStep,
+)
+from .multi_question import get_multi_question_part
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name: str) -> Any:
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+def count_repeated_entities(walk: SubsetWalk, token_limit: int) -> int:
+    """
+    The number of included steps that a walk stopped early would add by going on until
+    token_limit tokens are counted, by repeating its last num_repeated_steps steps. The included
+    records are already in the subset, but each of their visits counts as an entity.
+    """
+    cycle = walk.steps[-walk.num_repeated_steps :]
+    cycle_start_tokens = (
+        walk.steps[-walk.num_repeated_steps - 1].cumulative_tokens
+        if len(walk.steps) > walk.num_repeated_steps
+        else 0
+    )
+    cycle_tokens = walk.num_tokens - cycle_start_tokens
+    # the cycles that end below token_limit are counted whole, then the steps of the last one
+    num_cycles = max(0, (token_limit - 1 - walk.num_tokens) // cycle_tokens)
+    num_entities = num_cycles * sum(step.include for step in cycle)
+    num_tokens = walk.num_tokens + num_cycles * cycle_tokens
+    for step in cycle:
+        if num_tokens + step.cumulative_tokens - cycle_start_tokens >= token_limit:
+            break
+        if step.include:
+            num_entities += 1
+    return num_entities
 
 
 class TaskList:
+    # the host and endpoint of the api responses of the task list, set by the subclasses
+    host: str
+    endpoint_name: str
+    # number of records used to fit the approximate token counter of an endpoint
+    approximate_token_counter_sample_size: int = 20
+    # how the api responses are serialized in the prompts of the tasks, see serializers.py
+    response_format: str = DEFAULT_RESPONSE_FORMAT
+    # maximum number of questions of a prompt in the multi-question mode, None for no maximum
+    max_questions_per_prompt: Optional[int] = None
+
     def __init__(self, api_response_fpath: str) -> None:
         self._api_response_fpath = api_response_fpath
+        # token counts of the records visited by the data subset walks, reused across random seeds
+        self._subset_token_counts: dict[tuple[str, bool, Any, Any, str], int] = {}
+        self._subset_record_index: Optional[tuple[Any, Any]] = None
+        self._approximate_token_counters: dict[
+            tuple[str, Any, Any], ApproximateTokenCounter
+        ] = {}
+        # serialized api responses of the prompts, shared by the tasks of the task list
+        self.serialization_cache = SerializationCache()
 
         self.api_response = self.read_api_response()
         self.task_list = self.init_task_list()
@@ -24,9 +91,408 @@ class TaskList:
     def init_task_list(self) -> list[Type[base.Task]]:
         raise NotImplementedError
 
+    def create_task(self, task: Type[base.Task]) -> base.Task:
+        return task(
+            serialization_cache=self.serialization_cache,
+            response_format=self.response_format,
+        )
+
+    def get_multi_question_prompt_parts(
+        self, task_qa_samples: list[tuple[base.Task, LongResponseQASample]]
+    ) -> list[tuple[tuple[str, str, str], list[tuple[base.Task, LongResponseQASample]]]]:
+        """
+        Group the QA samples of the tasks of the task list whose prompts have the same api
+        response, and ask the questions of each group (of at most max_questions_per_prompt
+        questions) in one prompt. Returns the prompt parts, as in Task.get_prompt_parts, and the
+        (task, QA sample) of the questions of each prompt, in the order of their numbers.
+        """
+        groups: dict[tuple[str, str], list[tuple[base.Task, LongResponseQASample]]] = {}
+        for task_obj, qa_sample in task_qa_samples:
+            instructions, api_response, _ = task_obj.get_prompt_parts(qa_sample)
+            groups.setdefault((instructions, api_response), []).append(
+                (task_obj, qa_sample)
+            )
+        multi_question_prompts = []
+        for (instructions, api_response), group in groups.items():
+            max_questions = self.max_questions_per_prompt or len(group)
+            for start in range(0, len(group), max_questions):
+                questions = group[start : start + max_questions]
+                question_part = get_multi_question_part(
+                    [qa_sample.question for _, qa_sample in questions],
+                    questions[0][0].response_format.source_name,
+                )
+                multi_question_prompts.append(
+                    ((instructions, api_response, question_part), questions)
+                )
+        return multi_question_prompts
+
+    def count_response_format_tokens(
+        self, api_response: Any, model_name: str, response_formats: list[str]
+    ) -> dict[str, int]:
+        """
+        The number of tokens of the {query_args: record} api_response of an endpoint, as it is
+        embedded in the prompts, for each of the response_formats.
+        """
+        tokenizer = get_tokenizer(model_name)
+        return {
+            response_format: len(
+                tokenizer.tokenize(serialize_response(api_response, response_format))
+            )
+            for response_format in response_formats
+        }
+
     def read_api_response(self) -> Any:
-        with open(self._api_response_fpath, "r") as f:
-            return json.load(f)
+        if is_binary_data_subset(self._api_response_fpath):
+            return BinaryDataSubset(self._api_response_fpath)
+        if is_response_store(self._api_response_fpath):
+            # the responses of the endpoint of the task list, as in its data file
+            with ResponseStore(self._api_response_fpath) as response_store:
+                return response_store.get_endpoint_data(self.host, self.endpoint_name)
+        return json_codec.load_file(self._api_response_fpath)
+
+    def prepare_subset_record(
+        self, query_args: str, query_result: Any
+    ) -> tuple[Any, Any, Any]:
+        """
+        Clean up a record for the data subsets. Returns the record as it is written to the
+        subset, the part of it whose tokens are counted and its eligibility features, which
+        are passed to is_subset_record_eligible when the record is visited by a walk.
+        """
+        raise NotImplementedError
+
+    def get_subset_record_code_hash(self) -> str:
+        """
+        The hash of the code of prepare_subset_record, which cleans up the records whose tokens
+        are counted, so that the token counts kept for the next runs change with it.
+        """
+        return get_text_hash(inspect.getsource(type(self).prepare_subset_record))
+
+    def is_subset_record_eligible(
+        self, features: Any, walk_state: dict[str, Any]
+    ) -> tuple[bool, bool]:
+        """
+        Returns whether the tokens of a record visited by the data subset walk are added to
+        the running count and whether it is eligible to be part of the subset. walk_state is
+        shared by all the records visited in one walk.
+        """
+        return True, True
+
+    def get_subset_record_index(
+        self, api_responses: Any
+    ) -> dict[tuple[Any, Any], list[SubsetRecordInfo]]:
+        """
+        Prepare all the records of api_responses once. The index is kept for as long as the
+        walks are done over the same api_responses object. A record that cannot be prepared is
+        kept in the index, but is not eligible.
+        """
+        if (
+            self._subset_record_index is None
+            or self._subset_record_index[0] is not api_responses
+        ):
+            index: dict[tuple[Any, Any], list[SubsetRecordInfo]] = {}
+            for app, endpoint_info in api_responses.items():
+                for endpoint, queries in endpoint_info.items():
+                    record_infos = []
+                    for query_args, query_result in queries.items():
+                        try:
+                            record_info = SubsetRecordInfo(
+                                query_args,
+                                *self.prepare_subset_record(query_args, query_result),
+                            )
+                        except Exception as e:
+                            print(
+                                f"The record {query_args} of {endpoint} cannot be prepared for "
+                                f"the data subsets, it is not eligible: {e!r}"
+                            )
+                            record_info = SubsetRecordInfo(
+                                query_args, query_result, query_result, None, preparable=False
+                            )
+                        record_infos.append(record_info)
+                    index[(app, endpoint)] = record_infos
+            self._subset_record_index = (api_responses, index)
+        return self._subset_record_index[1]
+
+    def count_subset_record_tokens(
+        self, model_names: list[str], api_responses: Any
+    ) -> None:
+        """
+        Count the tokens of all the records of api_responses for each of the tokenizers of
+        model_names in a single pass over the records, so that the walks for any of them do
+        not need to tokenize the records again. When the task list reads a response store, the
+        token counts are kept in it for the next runs.
+        """
+        subset_record_index = self.get_subset_record_index(api_responses)
+        response_store = (
+            ResponseStore(self._api_response_fpath)
+            if is_response_store(self._api_response_fpath)
+            and api_responses is self.api_response
+            else None
+        )
+        code_hash = self.get_subset_record_code_hash()
+        if response_store is not None:
+            # token counts of the previous runs, with the same record cleanup
+            for model_name in model_names:
+                stored_token_counts = response_store.get_token_counts(
+                    model_name, code_hash, self.host, self.endpoint_name
+                )
+                for (app, endpoint, query_args), num_tokens in stored_token_counts.items():
+                    self._subset_token_counts.setdefault(
+                        (model_name, False, app, endpoint, query_args), num_tokens
+                    )
+        tokenizers: dict[str, Any] = {}
+        new_token_counts: dict[str, list[tuple[tuple[Any, Any, str], int]]] = {}
+        for (app, endpoint), record_infos in subset_record_index.items():
+            for record_info in record_infos:
+                if not record_info.preparable:
+                    continue
+                query_args_text = str(record_info.query_args)
+                record_text = str(record_info.tokenized_record)
+                for model_name in model_names:
+                    token_count_key = (
+                        model_name,
+                        False,
+                        app,
+                        endpoint,
+                        record_info.query_args,
+                    )
+                    if token_count_key not in self._subset_token_counts:
+                        if model_name not in tokenizers:
+                            tokenizers[model_name] = get_tokenizer(model_name)
+                        tokenizer = tokenizers[model_name]
+                        num_tokens = len(tokenizer.tokenize(query_args_text)) + len(
+                            tokenizer.tokenize(record_text)
+                        )
+                        self._subset_token_counts[token_count_key] = num_tokens
+                        new_token_counts.setdefault(model_name, []).append(
+                            ((app, endpoint, record_info.query_args), num_tokens)
+                        )
+        if response_store is not None:
+            for model_name, token_counts in new_token_counts.items():
+                response_store.add_token_counts(model_name, code_hash, token_counts)
+            response_store.close()
+
+    def get_approximate_token_counter(
+        self,
+        model_name: str,
+        app: Any,
+        endpoint: Any,
+        record_infos: list[SubsetRecordInfo],
+    ) -> ApproximateTokenCounter:
+        """
+        Fit the approximate token counter of model_name's tokenizer for the records of an
+        endpoint on a sample of approximate_token_counter_sample_size records.
+        """
+        if (model_name, app, endpoint) not in self._approximate_token_counters:
+            sampled_record_infos = sample_calibration_records(
+                record_infos, self.approximate_token_counter_sample_size
+            )
+            texts = [str(record_info.query_args) for record_info in sampled_record_infos]
+            texts += [
+                str(record_info.tokenized_record) for record_info in sampled_record_infos
+            ]
+            counter = fit_approximate_token_counter(
+                model_name, get_tokenizer(model_name), texts
+            )
+            print(
+                f"Approximate token counter for {model_name} and {endpoint}: "
+                f"{counter.tokens_per_char:.4f} tokens per character, max relative error "
+                f"{counter.max_relative_error:.2%}, mean relative error "
+                f"{counter.mean_relative_error:.2%} on {counter.num_samples} texts"
+            )
+            self._approximate_token_counters[(model_name, app, endpoint)] = counter
+        return self._approximate_token_counters[(model_name, app, endpoint)]
+
+    def walk_data_subset(
+        self,
+        token_limit: int,
+        random_seed: int,
+        model_name: str,
+        api_responses: Any = None,
+        approximate_token_counts: bool = False,
+    ) -> SubsetWalk:
+        """
+        Walk the records circularly from a random starting record until token_limit tokens
+        are counted. The steps of a walk for a smaller token limit with the same random seed
+        are a prefix of the steps of this walk. Pass the same api_responses for all the random
+        seeds to reuse the prepared records, and their token counts, across the walks.
+        The walk stops early if a full cycle over the records adds no new eligible record,
+        as none of the following steps can change the subset. The following cycles repeat the
+        steps of this last cycle, see count_repeated_entities.
+        With approximate_token_counts, the tokens are counted with an approximate token
+        counter fitted per endpoint instead of the tokenizer, e.g. for selecting random seeds.
+        """
+        tokenizer = get_tokenizer(model_name)
+        if api_responses is None:
+            api_responses = self.read_api_response()
+        subset_record_index = self.get_subset_record_index(api_responses)
+        num_tokens = 0
+        num_ineligible_visits = 0
+        token_limit_reached = True
+        num_repeated_steps = 0
+        walk_state: dict[str, Any] = {}
+        steps: list[SubsetWalkStep] = []
+        app = None
+        endpoint = None
+        random.seed(random_seed)
+        for (app, endpoint), record_infos in subset_record_index.items():
+            starting_index = random.randint(0, len(record_infos) - 1)
+            query_index = starting_index
+            included_query_args: set[str] = set()
+            steps_without_progress = 0
+            approximate_token_counter = (
+                self.get_approximate_token_counter(model_name, app, endpoint, record_infos)
+                if approximate_token_counts
+                else None
+            )
+            while num_tokens < token_limit:
+                record_info = record_infos[query_index]
+                if record_info.preparable:
+                    count_tokens, include = self.is_subset_record_eligible(
+                        record_info.features, walk_state
+                    )
+                else:
+                    count_tokens, include = False, False
+                query_index += 1
+                if query_index == len(record_infos):
+                    query_index = 0  # circular indexing
+                if count_tokens:
+                    token_count_key = (
+                        model_name,
+                        approximate_token_counts,
+                        app,
+                        endpoint,
+                        record_info.query_args,
+                    )
+                    if token_count_key not in self._subset_token_counts:
+                        if approximate_token_counter is not None:
+                            self._subset_token_counts[token_count_key] = (
+                                approximate_token_counter.count(str(record_info.query_args))
+                                + approximate_token_counter.count(
+                                    str(record_info.tokenized_record)
+                                )
+                            )
+                        else:
+                            self._subset_token_counts[token_count_key] = len(
+                                tokenizer.tokenize(str(record_info.query_args))
+                            ) + len(tokenizer.tokenize(str(record_info.tokenized_record)))
+                    num_tokens += self._subset_token_counts[token_count_key]
+                steps.append(
+                    SubsetWalkStep(
+                        query_args=record_info.query_args,
+                        record=record_info.record,
+                        cumulative_tokens=num_tokens,
+                        include=include,
+                    )
+                )
+                if not include:
+                    num_ineligible_visits += 1
+                if include and record_info.query_args not in included_query_args:
+                    included_query_args.add(record_info.query_args)
+                    steps_without_progress = 0
+                else:
+                    steps_without_progress += 1
+                if (
+                    steps_without_progress >= len(record_infos)
+                    and num_tokens < token_limit
+                ):
+                    token_limit_reached = False
+                    print(
+                        f"Stopped the walk for random seed {random_seed} after a full cycle over the "
+                        f"{len(record_infos)} records of {endpoint} without a new eligible record: "
+                        f"{num_tokens} of {token_limit} tokens, {len(included_query_args)} eligible records, "
+                        f"{num_ineligible_visits} ineligible visits"
+                    )
+                    cycle_start_tokens = (
+                        steps[-len(record_infos) - 1].cumulative_tokens
+                        if len(steps) > len(record_infos)
+                        else 0
+                    )
+                    if num_tokens > cycle_start_tokens:
+                        # the walk would reach token_limit by repeating the cycle over the records
+                        # of this endpoint, without visiting the next endpoints
+                        num_repeated_steps = len(record_infos)
+                    break
+            if num_repeated_steps > 0:
+                break
+        return SubsetWalk(
+            app=app,
+            endpoint=endpoint,
+            steps=steps,
+            num_tokens=num_tokens,
+            token_limit_reached=token_limit_reached,
+            num_ineligible_visits=num_ineligible_visits,
+            num_repeated_steps=num_repeated_steps,
+        )
+
+    def create_nested_data_subsets(
+        self,
+        token_limits: list[int],
+        random_seed: int,
+        model_name: str,
+        api_responses: Any = None,
+        approximate_token_counts: bool = False,
+    ) -> dict[int, tuple[Any, int]]:
+        """
+        Create the data subsets for all the token_limits with a single walk for the largest
+        token limit. Each subset is the same as the one create_data_subsets returns for its
+        token limit and random_seed.
+        """
+        walk = self.walk_data_subset(
+            max(token_limits),
+            random_seed,
+            model_name,
+            api_responses=api_responses,
+            approximate_token_counts=approximate_token_counts,
+        )
+        subsets: dict[int, tuple[Any, int]] = {}
+        for token_limit in token_limits:
+            num_tokens = 0
+            output_query_dict: Any = {}
+            num_entities = 0
+            for step in walk.steps:
+                num_tokens = step.cumulative_tokens
+                if step.include and (
+                    num_tokens < token_limit or len(output_query_dict) == 0
+                ):
+                    num_entities += 1
+                    output_query_dict[step.query_args] = step.record
+                if num_tokens >= token_limit:
+                    break
+            if num_tokens < token_limit and walk.num_repeated_steps > 0:
+                num_entities += count_repeated_entities(walk, token_limit)
+            print(f"token_limit: {token_limit}, num_tokens: {num_tokens}")
+            if num_tokens < token_limit:
+                print(
+                    f"The subset for token_limit {token_limit} and random seed {random_seed} "
+                    f"has only {num_tokens} tokens"
+                )
+            if walk.app is not None and walk.endpoint is not None:
+                subsets[token_limit] = (
+                    {walk.app: {walk.endpoint: output_query_dict}},
+                    num_entities,
+                )
+            else:
+                subsets[token_limit] = None, 0
+        return subsets
+
+    def create_data_subsets(
+        self,
+        token_limit: int,
+        random_seed: int,
+        model_name: str,
+        min_entities: Optional[int] = None,
+        approximate_token_counts: bool = False,
+    ) -> tuple[Any, int]:
+        """
+        The data subset for token_limit and random_seed and its number of entities. min_entities
+        is not used.
+        """
+        return self.create_nested_data_subsets(
+            [token_limit],
+            random_seed,
+            model_name,
+            approximate_token_counts=approximate_token_counts,
+        )[token_limit]
 
 class BookingGetRoomListWithAvailabilityTaskList(TaskList):
 
@@ -48,78 +514,47 @@ class BookingGetRoomListWithAvailabilityTaskList(TaskList):
         ]
         return task_list  # type:ignore
 
-    def create_data_subsets(
-        self,
-        token_limit: int,
-        random_seed: int,
-        model_name: str,
-        min_entities: Optional[int] = None,
-    ) -> tuple[Any, int]:
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        api_responses = json.load(open(self._api_response_fpath))
-        num_tokens = 0
-        seen_hotel_ids: Any = []
-        output_query_dict: Any = {}
-        app = None
-        endpoint = None
-        random.seed(random_seed)
-        num_entities = 0
-        for app, endpoint_info in api_responses.items():
-            for endpoint, queries in endpoint_info.items():
-                starting_index = random.randint(0, len(queries) - 1)
-                queries_list = list(queries.keys())
-                query_index = starting_index
-                while num_tokens < token_limit:
-                    query_args = queries_list[query_index]
-                    query_result = queries[query_args]
-                    has_duplicate_names = False
-                    try:
-                        if "unavailable" in query_result.keys():
-                            del query_result["unavailable"]
-                        seen_names = []
-                        for content in query_result["available"]:
-                            if content["name"] not in seen_names:
-                                seen_names.append(content["name"])
-                            else:
-                                has_duplicate_names = True
-                                break
-                            if "room_name" in content.keys():
-                                del content["room_name"]  # conflicts with room_name
-                            if "transactional_policy_data" in content.keys():
-                                del content["transactional_policy_data"]
-                            if "transactional_policy_objects" in content.keys():
-                                del content["transactional_policy_objects"]
-                            if "policy_display_details" in content.keys():
-                                del content["policy_display_details"]
-                            if "block_text" in content.keys():
-                                del content["block_text"]
-                            if "paymentterms" in content.keys():
-                                del content["paymentterms"]
-                    except BaseException as e:
-                        print(e)
-                        pass
-                    query_index += 1
-                    if query_index == len(queries):
-                        query_index = 0  # circular indexing
-                    query_args_dict = json.loads(query_args.replace("'", '"'))
-                    hotel_id = query_args_dict["hotel_id"]
-                    if hotel_id not in seen_hotel_ids:
-                        # include this record in the output data
-                        num_tokens += len(tokenizer.tokenize(str(query_args))) + len(
-                            tokenizer.tokenize(str(query_result))
-                        )
-                        if not has_duplicate_names and (
-                            num_tokens < token_limit or len(output_query_dict) == 0
-                        ):
-                            print(num_tokens)
-                            num_entities += 1
-                            output_query_dict[query_args] = query_result
-
-        print(f"num_tokens: {num_tokens}")
-        if app is not None and endpoint is not None:
-            return {app: {endpoint: output_query_dict}}, num_entities
-        else:
-            return None, 0
+    def prepare_subset_record(
+        self, query_args: str, query_result: Any
+    ) -> tuple[Any, Any, Any]:
+        has_duplicate_names = False
+        try:
+            if "unavailable" in query_result.keys():
+                del query_result["unavailable"]
+            seen_names = set()
+            for content in query_result["available"]:
+                if content["name"] not in seen_names:
+                    seen_names.add(content["name"])
+                else:
+                    has_duplicate_names = True
+                    break
+                if "room_name" in content.keys():
+                    del content["room_name"]  # conflicts with room_name
+                if "transactional_policy_data" in content.keys():
+                    del content["transactional_policy_data"]
+                if "transactional_policy_objects" in content.keys():
+                    del content["transactional_policy_objects"]
+                if "policy_display_details" in content.keys():
+                    del content["policy_display_details"]
+                if "block_text" in content.keys():
+                    del content["block_text"]
+                if "paymentterms" in content.keys():
+                    del content["paymentterms"]
+        except BaseException as e:
+            print(e)
+            pass
+        query_args_dict = base.parse_query_args(query_args)
+        hotel_id = query_args_dict["hotel_id"]
+        return query_result, query_result, (hotel_id, has_duplicate_names)
+
+    def is_subset_record_eligible(
+        self, features: Any, walk_state: dict[str, Any]
+    ) -> tuple[bool, bool]:
+        hotel_id, has_duplicate_names = features
+        seen_hotel_ids = walk_state.setdefault("seen_hotel_ids", set())
+        # include this record in the output data
+        count_tokens = hotel_id not in seen_hotel_ids
+        return count_tokens, count_tokens and not has_duplicate_names
 
 class BookingSearchFlightsMultiStopsTaskList(TaskList):
 
@@ -142,88 +577,65 @@ class BookingSearchFlightsMultiStopsTaskList(TaskList):
         # TODO: need to correct the type
         return task_list  # type:ignore
 
-    def create_data_subsets(
-        self,
-        token_limit: int,
-        random_seed: int,
-        model_name: str,
-        min_entities: Optional[int] = None,
-    ) -> tuple[Any, int]:
+    def prepare_subset_record(
+        self, query_args: str, query_result: Any
+    ) -> tuple[Any, Any, Any]:
         # Make sure to delete flightDeals
         # Also, make sure in consecutive entities, you don't have duplicate departure and arrival airport codes as extracted below:
         # departure_airport = flight_segment["departureAirport"]["code"]
         # arrival_airport = flight_segment["arrivalAirport"]["code"]
-
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        api_responses = json.load(open(self._api_response_fpath))
-        num_tokens = 0
-        seen_departure_arrival_airport_codes: Any = []
-        output_query_dict: Any = {}
-        app = None
-        endpoint = None
-        random.seed(random_seed)
-        num_entities = 0
-        for app, endpoint_info in api_responses.items():
-            for endpoint, queries in endpoint_info.items():
-                starting_index = random.randint(0, len(queries) - 1)
-                queries_list = list(queries.keys())
-                query_index = starting_index
-                while num_tokens < token_limit:
-                    query_args = queries_list[query_index]
-                    query_result_full = queries[query_args]
-                    not_eligible_record = False
-                    query_result = query_result_full["data"]
-                    try:
-                        if "flightDeals" in query_result.keys():
-                            del query_result["flightDeals"]
-                        flight_offers = query_result["flightOffers"]
-                        seen_departure_arrival_airport_codes_from_this_query = []
-                        for flight_offer in flight_offers:
-                            flight_segments = flight_offer["segments"]
-                            for flight_segment in flight_segments:
-                                departure_airport_code = flight_segment[
-                                    "departureAirport"
-                                ]["code"]
-                                arrival_airport_code = flight_segment["arrivalAirport"][
-                                    "code"
-                                ]
-                                if (
-                                    f"{departure_airport_code}_{arrival_airport_code}"
-                                    in seen_departure_arrival_airport_codes
-                                    and f"{departure_airport_code}_{arrival_airport_code}"
-                                    not in seen_departure_arrival_airport_codes_from_this_query
-                                ):
-                                    # This means that the airport codes are seen in a different entity/query result before. We do not want to include such cases
-                                    not_eligible_record = True
-                                    break
-                                else:
-                                    seen_departure_arrival_airport_codes.append(
-                                        f"{departure_airport_code}_{arrival_airport_code}"
-                                    )
-                                    seen_departure_arrival_airport_codes_from_this_query.append(
-                                        f"{departure_airport_code}_{arrival_airport_code}"
-                                    )
-                    except BaseException as e:
-                        print(e)
-                        pass
-                    query_index += 1
-                    if query_index == len(queries):
-                        query_index = 0  # circular indexing
-                    if not not_eligible_record:
-                        # include this record in the output data
-                        num_tokens += len(tokenizer.tokenize(str(query_args))) + len(
-                            tokenizer.tokenize(str(query_result))
-                        )
-                        if num_tokens < token_limit or len(output_query_dict) == 0:
-                            print(num_tokens)
-                            num_entities += 1
-                            output_query_dict[query_args] = {"data": query_result}
-
-        print(f"num_tokens: {num_tokens}")
-        if app is not None and endpoint is not None:
-            return {app: {endpoint: output_query_dict}}, num_entities
-        else:
-            return None, 0
+        query_result = query_result["data"]
+        # the departure and arrival airport codes of the segments of each flight offer, up to the
+        # first segment whose codes cannot be read
+        departure_arrival_airport_codes_by_offer: list[list[str]] = []
+        try:
+            if "flightDeals" in query_result.keys():
+                del query_result["flightDeals"]
+            flight_offers = query_result["flightOffers"]
+            for flight_offer in flight_offers:
+                offer_codes: list[str] = []
+                departure_arrival_airport_codes_by_offer.append(offer_codes)
+                flight_segments = flight_offer["segments"]
+                for flight_segment in flight_segments:
+                    departure_airport_code = flight_segment["departureAirport"]["code"]
+                    arrival_airport_code = flight_segment["arrivalAirport"]["code"]
+                    offer_codes.append(f"{departure_airport_code}_{arrival_airport_code}")
+        except BaseException as e:
+            print(e)
+            pass
+        return (
+            {"data": query_result},
+            query_result,
+            tuple(tuple(offer_codes) for offer_codes in departure_arrival_airport_codes_by_offer),
+        )
+
+    def is_subset_record_eligible(
+        self, features: Any, walk_state: dict[str, Any]
+    ) -> tuple[bool, bool]:
+        # the codes of all the records visited by the walk, including the ineligible ones
+        seen_departure_arrival_airport_codes = walk_state.setdefault(
+            "seen_departure_arrival_airport_codes", set()
+        )
+        seen_departure_arrival_airport_codes_from_this_query = set()
+        not_eligible_record = False
+        for offer_codes in features:
+            for departure_arrival_airport_codes in offer_codes:
+                if (
+                    departure_arrival_airport_codes in seen_departure_arrival_airport_codes
+                    and departure_arrival_airport_codes
+                    not in seen_departure_arrival_airport_codes_from_this_query
+                ):
+                    # This means that the airport codes are seen in a different entity/query result before. We do not want to include such cases
+                    # Only the rest of the segments of this flight offer are skipped, the codes
+                    # of the next flight offers are still seen
+                    not_eligible_record = True
+                    break
+                seen_departure_arrival_airport_codes.add(departure_arrival_airport_codes)
+                seen_departure_arrival_airport_codes_from_this_query.add(
+                    departure_arrival_airport_codes
+                )
+        # include this record in the output data
+        return not not_eligible_record, not not_eligible_record
 
 
 class BookingGetAvailabilityTaskList(TaskList):
@@ -247,66 +659,26 @@ class BookingGetAvailabilityTaskList(TaskList):
         # TODO: need to correct the type
         return task_list  # type:ignore
 
-    def create_data_subsets(
-        self,
-        token_limit: int,
-        random_seed: int,
-        model_name: str,
-        min_entities: Optional[int] = None,
-    ) -> tuple[Any, int]:
-
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        api_responses = json.load(open(self._api_response_fpath))
-        num_tokens = 0
-        output_query_dict: Any = {}
-        app = None
-        endpoint = None
-        random.seed(random_seed)
-        num_entities = 0
-        for app, endpoint_info in api_responses.items():
-            for endpoint, queries in endpoint_info.items():
-                starting_index = random.randint(0, len(queries) - 1)
-                queries_list = list(queries.keys())
-                query_index = starting_index
-                while num_tokens < token_limit:
-                    query_args = queries_list[query_index]
-                    query_result_full = queries[query_args]
-                    not_eligible_record = False
-                    query_result = query_result_full["data"]
-                    for data_elem in query_result:
-                        if "fullDay" in data_elem:
-                            del data_elem["fullDay"]
-                        timeslot_offers = data_elem["timeSlotOffers"]
-                        for timeslot_offer in timeslot_offers:
-                            if "languageOptions" in timeslot_offer:
-                                timeslot_offer_lang = timeslot_offer["languageOptions"]
-                                if "__typename" in timeslot_offer_lang:
-                                    del timeslot_offer_lang["__typename"]
-                                if "type" in timeslot_offer_lang:
-                                    del timeslot_offer_lang["type"]
-                            timeslot_offer_items = timeslot_offer["items"]
-                            for timeslot_offer_item in timeslot_offer_items:
-                                if "cancellationPolicy" in timeslot_offer_item:
-                                    del timeslot_offer_item["cancellationPolicy"]
-
-                    query_index += 1
-                    if query_index == len(queries):
-                        query_index = 0  # circular indexing
-                    if not not_eligible_record:
-                        # include this record in the output data
-                        num_tokens += len(tokenizer.tokenize(str(query_args))) + len(
-                            tokenizer.tokenize(str(query_result))
-                        )
-                        if num_tokens < token_limit or len(output_query_dict) == 0:
-                            print(num_tokens)
-                            num_entities += 1
-                            output_query_dict[query_args] = {"data": query_result}
-
-        print(f"num_tokens: {num_tokens}")
-        if app is not None and endpoint is not None:
-            return {app: {endpoint: output_query_dict}}, num_entities
-        else:
-            return None, 0
+    def prepare_subset_record(
+        self, query_args: str, query_result: Any
+    ) -> tuple[Any, Any, Any]:
+        query_result = query_result["data"]
+        for data_elem in query_result:
+            if "fullDay" in data_elem:
+                del data_elem["fullDay"]
+            timeslot_offers = data_elem["timeSlotOffers"]
+            for timeslot_offer in timeslot_offers:
+                if "languageOptions" in timeslot_offer:
+                    timeslot_offer_lang = timeslot_offer["languageOptions"]
+                    if "__typename" in timeslot_offer_lang:
+                        del timeslot_offer_lang["__typename"]
+                    if "type" in timeslot_offer_lang:
+                        del timeslot_offer_lang["type"]
+                timeslot_offer_items = timeslot_offer["items"]
+                for timeslot_offer_item in timeslot_offer_items:
+                    if "cancellationPolicy" in timeslot_offer_item:
+                        del timeslot_offer_item["cancellationPolicy"]
+        return {"data": query_result}, query_result, None
 
 
 class BookingSearchCarRentalsTaskList(TaskList):
@@ -329,50 +701,11 @@ class BookingSearchCarRentalsTaskList(TaskList):
         ]
         return task_list
 
-    def create_data_subsets(
-        self,
-        token_limit: int,
-        random_seed: int,
-        model_name: str,
-        min_entities: Optional[int] = None,
-    ) -> tuple[Any, int]:
-
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        api_responses = json.load(open(self._api_response_fpath))
-        num_tokens = 0
-        output_query_dict: Any = {}
-        app = None
-        endpoint = None
-        random.seed(random_seed)
-        num_entities = 0
-        for app, endpoint_info in api_responses.items():
-            for endpoint, queries in endpoint_info.items():
-                starting_index = random.randint(0, len(queries) - 1)
-                queries_list = list(queries.keys())
-                query_index = starting_index
-                while num_tokens < token_limit:
-                    query_args = queries_list[query_index]
-                    query_result_full = queries[query_args]
-                    not_eligible_record = False
-                    query_result = query_result_full["data"]
-                    query_index += 1
-                    if query_index == len(queries):
-                        query_index = 0  # circular indexing
-                    if not not_eligible_record:
-                        # include this record in the output data
-                        num_tokens += len(tokenizer.tokenize(str(query_args))) + len(
-                            tokenizer.tokenize(str(query_result))
-                        )
-                        if num_tokens < token_limit or len(output_query_dict) == 0:
-                            print(num_tokens)
-                            num_entities += 1
-                            output_query_dict[query_args] = {"data": query_result}
-
-        print(f"num_tokens: {num_tokens}")
-        if app is not None and endpoint is not None:
-            return {app: {endpoint: output_query_dict}}, num_entities
-        else:
-            return None, 0
+    def prepare_subset_record(
+        self, query_args: str, query_result: Any
+    ) -> tuple[Any, Any, Any]:
+        query_result = query_result["data"]
+        return {"data": query_result}, query_result, None
 
 class BookingGetSeatMapTaskList(TaskList):
 
@@ -394,89 +727,50 @@ class BookingGetSeatMapTaskList(TaskList):
         ]
         return task_list
 
-    def create_data_subsets(
-        self,
-        token_limit: int,
-        random_seed: int,
-        model_name: str,
-        min_entities: Optional[int] = None,
-    ) -> tuple[Any, int]:
-
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        api_responses = json.load(open(self._api_response_fpath))
-        num_tokens = 0
-        output_query_dict: Any = {}
-        app = None
-        endpoint = None
-        random.seed(random_seed)
-        num_entities = 0
-        for app, endpoint_info in api_responses.items():
-            for endpoint, queries in endpoint_info.items():
-                starting_index = random.randint(0, len(queries) - 1)
-                queries_list = list(queries.keys())
-                query_index = starting_index
-                while num_tokens < token_limit:
-                    query_args = queries_list[query_index]
-                    query_result_full = queries[query_args]
-                    not_eligible_record = False
-                    query_result = query_result_full["data"]
-                    # if "flexibleTicket" in query_result:
-                    #     del query_result["flexibleTicket"]
-                    # if "mobileTravelPlan" in query_result:
-                    #     del query_result["mobileTravelPlan"]
-                    # if "travelInsurance" in query_result:
-                    #     if "content" in query_result["travelInsurance"]:
-                    #         del query_result["travelInsurance"]["content"]
-                    #     if "recommendation" in query_result["travelInsurance"]:
-                    #         del query_result["travelInsurance"]["recommendation"]
-                    #     if "options" in query_result["travelInsurance"]:
-                    #         if "disclaimer" in query_result["travelInsurance"]["options"]:
-                    #             del query_result["travelInsurance"]["options"]["disclaimer"]
-                    #         if "travellers" in query_result["travelInsurance"]["options"]:
-                    #             del query_result["travelInsurance"]["options"]["travellers"]
-                    #         if "priceBreakdown" in query_result["travelInsurance"]["options"]:
-                    #             if "fee" in query_result["travelInsurance"]["options"]["priceBreakdown"]:
-                    #                 del query_result["travelInsurance"]["options"]["priceBreakdown"]["fee"]
-                    #             if "tax" in query_result["travelInsurance"]["options"]["priceBreakdown"]:
-                    #                 del query_result["travelInsurance"]["options"]["priceBreakdown"]["tax"]
-                    #             if "totalWithoutDiscount" in query_result["travelInsurance"]["options"]["priceBreakdown"]:
-                    #                 del query_result["travelInsurance"]["options"]["priceBreakdown"]["totalWithoutDiscount"]
-                    if "seatMap" in query_result:
-                        # if "airProductReference" in query_result["seatMap"]:
-                        #     del query_result["seatMap"]["airProductReference"]
-                        if "seatMapOption" in query_result["seatMap"]:
-                            for seat_map_option in query_result["seatMap"]["seatMapOption"]:
-                                # if "travellers" in seat_map_option:
-                                #     del seat_map_option["travellers"]
-                                if "cabins" in seat_map_option:
-                                    for cabin in seat_map_option["cabins"]:
-                                        for row in cabin["rows"]:
-                                            for seat in row["seats"]:
-                                                if "priceBreakdown" in seat:
-                                                    del seat["priceBreakdown"]
-
-                    # if "checkedInBaggage" in query_result:
-                    #     if "airProductReference" in query_result["checkedInBaggage"]:
-                    #         del query_result["checkedInBaggage"]["airProductReference"]
-                    #     if "options" in query_result["checkedInBaggage"]:
-                    #         for option in query_result["checkedInBaggage"]["options"]:
-                    #             if "travellers" in option:
-                    #                 del option["travellers"]
-                    query_index += 1
-                    if query_index == len(queries):
-                        query_index = 0  # circular indexing
-                    if not not_eligible_record:
-                        # include this record in the output data
-                        num_tokens += len(tokenizer.tokenize(str(query_args))) + len(
-                            tokenizer.tokenize(str(query_result))
-                        )
-                        if num_tokens < token_limit or len(output_query_dict) == 0:
-                            print(num_tokens)
-                            num_entities += 1
-                            output_query_dict[query_args] = {"data": query_result}
-
-        print(f"num_tokens: {num_tokens}")
-        if app is not None and endpoint is not None:
-            return {app: {endpoint: output_query_dict}}, num_entities
-        else:
-            return None, 0
+    def prepare_subset_record(
+        self, query_args: str, query_result: Any
+    ) -> tuple[Any, Any, Any]:
+        query_result = query_result["data"]
+        # if "flexibleTicket" in query_result:
+        #     del query_result["flexibleTicket"]
+        # if "mobileTravelPlan" in query_result:
+        #     del query_result["mobileTravelPlan"]
+        # if "travelInsurance" in query_result:
+        #     if "content" in query_result["travelInsurance"]:
+        #         del query_result["travelInsurance"]["content"]
+        #     if "recommendation" in query_result["travelInsurance"]:
+        #         del query_result["travelInsurance"]["recommendation"]
+        #     if "options" in query_result["travelInsurance"]:
+        #         if "disclaimer" in query_result["travelInsurance"]["options"]:
+        #             del query_result["travelInsurance"]["options"]["disclaimer"]
+        #         if "travellers" in query_result["travelInsurance"]["options"]:
+        #             del query_result["travelInsurance"]["options"]["travellers"]
+        #         if "priceBreakdown" in query_result["travelInsurance"]["options"]:
+        #             if "fee" in query_result["travelInsurance"]["options"]["priceBreakdown"]:
+        #                 del query_result["travelInsurance"]["options"]["priceBreakdown"]["fee"]
+        #             if "tax" in query_result["travelInsurance"]["options"]["priceBreakdown"]:
+        #                 del query_result["travelInsurance"]["options"]["priceBreakdown"]["tax"]
+        #             if "totalWithoutDiscount" in query_result["travelInsurance"]["options"]["priceBreakdown"]:
+        #                 del query_result["travelInsurance"]["options"]["priceBreakdown"]["totalWithoutDiscount"]
+        if "seatMap" in query_result:
+            # if "airProductReference" in query_result["seatMap"]:
+            #     del query_result["seatMap"]["airProductReference"]
+            if "seatMapOption" in query_result["seatMap"]:
+                for seat_map_option in query_result["seatMap"]["seatMapOption"]:
+                    # if "travellers" in seat_map_option:
+                    #     del seat_map_option["travellers"]
+                    if "cabins" in seat_map_option:
+                        for cabin in seat_map_option["cabins"]:
+                            for row in cabin["rows"]:
+                                for seat in row["seats"]:
+                                    if "priceBreakdown" in seat:
+                                        del seat["priceBreakdown"]
+
+        # if "checkedInBaggage" in query_result:
+        #     if "airProductReference" in query_result["checkedInBaggage"]:
+        #         del query_result["checkedInBaggage"]["airProductReference"]
+        #     if "options" in query_result["checkedInBaggage"]:
+        #         for option in query_result["checkedInBaggage"]["options"]:
+        #             if "travellers" in option:
+        #                 del option["travellers"]
+        return {"data": query_result}, query_result, None
@@ -0,0 +1,299 @@
+import operator
+import re
+import string
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Iterator, Optional, Type
+
+from ..large_response_utils import manipulate_response
+from .base import Task, parse_query_args
+from .data_structures import LongResponseQASample, TaskAttributes
+from .response_index import get_response_index
+
+# Tasks can be defined declaratively with a TaskSpec instead of hand-coding their question,
+# answer and QA samples: the questions are asked about the entities of the first record of the
+# api response (e.g. the rooms of its hotel), and the answer of a question aggregates a value of
+# the entities of all the records that match its arguments. compile_task_spec compiles the paths
+# of a spec into accessor functions once and creates the Task class of the spec.
+#
+# A path is a dotted list of keys, where "key[]" iterates over the list at key, e.g.
+# "data.flightOffers[].segments[].legs[]". A path starting with "$query_args." gets an argument
+# of the API call of a record instead of a value of its entities.
+
+QUERY_ARGS_PREFIX = "$query_args."
+AGGREGATES = ("first", "list", "unique_list", "count", "min", "max")
+
+# the errors of reading a record that does not have the structure of the spec, which end the
+# QA samples of the api response
+DATA_ERRORS = (LookupError, TypeError, ValueError, AttributeError, ArithmeticError)
+
+_PATH_KEY = re.compile(r"[^.\[\]$]+(\[\])?\Z")
+
+
+def normalize_text(value: str) -> str:
+    return value.strip().lower()
+
+
+@dataclass(frozen=True)
+class TaskSpec:
+    name: str
+    # str.format template of the question, with the arguments as fields
+    question: str
+    # path of the entities of a record
+    entities: str
+    # {argument: path of its value in an entity (or the query args) of the first record}
+    arguments: dict[str, str]
+    # {argument: path of the value of an entity (or the query args) that must be equal to it}
+    match: dict[str, str]
+    # path of the value of the matching entities that is aggregated into the answer
+    value: str
+    aggregate: str = "first"
+    # applied to the matched values and the arguments before comparing them
+    normalize: Optional[Callable[[Any], Any]] = None
+    format_answer: Callable[[Any], str] = str
+    max_samples: Optional[int] = 5
+    evaluation_criterias: tuple[Callable[[LongResponseQASample], Any], ...] = ()
+    task_attributes: tuple[TaskAttributes, ...] = ()
+
+
+def _parse_path(path: str) -> list[tuple[str, bool]]:
+    steps = []
+    for key in path.split("."):
+        if not _PATH_KEY.match(key):
+            raise ValueError(f"Invalid path {path!r}")
+        steps.append((key[:-2], True) if key.endswith("[]") else (key, False))
+    return steps
+
+
+def compile_getter(path: str) -> Callable[[Any], Any]:
+    """The function that gets the value at a path without "[]" of an object."""
+    steps = _parse_path(path)
+    if any(iterate for _, iterate in steps):
+        raise ValueError(f"The path {path!r} of a value cannot iterate over a list")
+    keys = [key for key, _ in steps]
+    if len(keys) == 1:
+        return operator.itemgetter(keys[0])
+
+    def get(obj: Any) -> Any:
+        for key in keys:
+            obj = obj[key]
+        return obj
+
+    return get
+
+
+def compile_iterator(path: str) -> Callable[[Any], Iterator[Any]]:
+    """The function that iterates over the values at a path of an object, in scan order."""
+    steps = _parse_path(path)
+
+    def iterate(obj: Any, i: int = 0) -> Iterator[Any]:
+        if i == len(steps):
+            yield obj
+            return
+        key, iterate_values = steps[i]
+        value = obj[key]
+        if iterate_values:
+            for item in value:
+                yield from iterate(item, i + 1)
+        else:
+            yield from iterate(value, i + 1)
+
+    return iterate
+
+
+class _Selector:
+    # the values at the paths of a spec, either all from the entities or all from the query args
+
+    def __init__(self, paths: list[str], normalize: Optional[Callable[[Any], Any]]) -> None:
+        self.getters = [compile_getter(path) for path in paths]
+        self.normalize = normalize
+
+    def get_key(self, obj: Any) -> tuple[Any, ...]:
+        if self.normalize is None:
+            return tuple(get(obj) for get in self.getters)
+        return tuple(self.normalize(get(obj)) for get in self.getters)
+
+
+class CompiledTaskSpec:
+    """The accessor functions of a TaskSpec, see compile_task_spec."""
+
+    def __init__(self, spec: TaskSpec) -> None:
+        if spec.aggregate not in AGGREGATES:
+            raise ValueError(
+                f"Unknown aggregate {spec.aggregate}, the aggregates are {AGGREGATES}"
+            )
+        fields = {field for _, field, _, _ in string.Formatter().parse(spec.question) if field}
+        if not fields <= set(spec.arguments):
+            raise ValueError(f"The question of {spec.name} has fields that are not arguments")
+        if not set(spec.match) <= set(spec.arguments):
+            raise ValueError(f"The match of {spec.name} has keys that are not arguments")
+        self.spec = spec
+        self.iter_entities = compile_iterator(spec.entities)
+        self.get_value = compile_getter(spec.value)
+        self.query_args_arguments = {
+            argument: compile_getter(path[len(QUERY_ARGS_PREFIX) :])
+            for argument, path in spec.arguments.items()
+            if path.startswith(QUERY_ARGS_PREFIX)
+        }
+        self.entity_arguments = {
+            argument: compile_getter(path)
+            for argument, path in spec.arguments.items()
+            if not path.startswith(QUERY_ARGS_PREFIX)
+        }
+        self.record_match_arguments = [
+            argument
+            for argument, path in spec.match.items()
+            if path.startswith(QUERY_ARGS_PREFIX)
+        ]
+        self.entity_match_arguments = [
+            argument
+            for argument, path in spec.match.items()
+            if not path.startswith(QUERY_ARGS_PREFIX)
+        ]
+        self.record_match = _Selector(
+            [
+                spec.match[argument][len(QUERY_ARGS_PREFIX) :]
+                for argument in self.record_match_arguments
+            ],
+            spec.normalize,
+        )
+        self.entity_match = _Selector(
+            [spec.match[argument] for argument in self.entity_match_arguments], spec.normalize
+        )
+
+    def iter_records_by_key(
+        self, api_response: dict[Any, Any]
+    ) -> Iterator[tuple[Hashable, Any]]:
+        for query_args, record in api_response.items():
+            yield self.record_match.get_key(parse_query_args(query_args)), record
+
+    def iter_entities_by_key(
+        self, api_response: dict[Any, Any]
+    ) -> Iterator[tuple[Hashable, Any]]:
+        for record in api_response.values():
+            for entity in self.iter_entities(record):
+                yield self.entity_match.get_key(entity), entity
+
+    def get_argument_key(self, arguments: list[str], values: dict[str, Any]) -> tuple[Any, ...]:
+        if self.spec.normalize is None:
+            return tuple(values[argument] for argument in arguments)
+        return tuple(self.spec.normalize(values[argument]) for argument in arguments)
+
+    def iter_matching_values(
+        self, api_response: dict[Any, Any], arguments: dict[str, Any]
+    ) -> Iterator[Any]:
+        """
+        The values of the entities that match the arguments, in scan order. The records are
+        looked up by their query args and the entities of the records without query args to
+        match by their values, in indexes shared by the questions about the api response. An
+        error of the scan is raised when the matching values before it have been consumed.
+        """
+        entity_key = self.get_argument_key(self.entity_match_arguments, arguments)
+        if len(self.record_match_arguments) == 0:
+            entities = get_response_index(api_response, self.iter_entities_by_key)
+            for entity in entities.get(entity_key):
+                yield self.get_value(entity)
+            entities.raise_scan_error()
+            return
+        records = get_response_index(api_response, self.iter_records_by_key)
+        record_key = self.get_argument_key(self.record_match_arguments, arguments)
+        for record in records.get(record_key):
+            for entity in self.iter_entities(record):
+                if self.entity_match.get_key(entity) == entity_key:
+                    yield self.get_value(entity)
+        records.raise_scan_error()
+
+    def get_answer(self, api_response: dict[Any, Any], arguments: dict[str, Any]) -> str:
+        aggregate = self.spec.aggregate
+        format_answer = self.spec.format_answer
+        if aggregate == "first":
+            for value in self.iter_matching_values(api_response, arguments):
+                return format_answer(value)
+            return "None"
+        values = list(self.iter_matching_values(api_response, arguments))
+        if aggregate == "count":
+            return str(len(values))
+        if len(values) == 0:
+            return "None"
+        if aggregate == "min":
+            return format_answer(min(values))
+        if aggregate == "max":
+            return format_answer(max(values))
+        answers = [format_answer(value) for value in values]
+        if aggregate == "unique_list":
+            answers = list(dict.fromkeys(answers))
+        return ", ".join(answers)
+
+    def iter_arguments(self, api_response: dict[Any, Any]) -> Iterator[dict[str, Any]]:
+        """The distinct arguments of the questions about the entities of the first record."""
+        if len(api_response) == 0:
+            return
+        query_args, record = next(iter(api_response.items()))
+        query_args_values: dict[str, Any] = {}
+        if len(self.query_args_arguments) > 0:
+            query_args_dict = parse_query_args(query_args)
+            query_args_values = {
+                argument: get(query_args_dict)
+                for argument, get in self.query_args_arguments.items()
+            }
+        considered_arguments = []
+        for entity in self.iter_entities(record):
+            arguments = dict(query_args_values)
+            for argument, get in self.entity_arguments.items():
+                arguments[argument] = get(entity)
+            if arguments not in considered_arguments:
+                considered_arguments.append(arguments)
+                yield arguments
+
+
+class CompiledTask(Task):
+    """A Task whose questions and answers are defined by the TaskSpec of compile_task_spec."""
+
+    compiled_spec: CompiledTaskSpec
+
+    def get_question(self, **arguments: Any) -> str:
+        return self.compiled_spec.spec.question.format(**arguments)
+
+    def get_answer(self, api_response: dict[Any, Any], **arguments: Any) -> str:
+        return self.compiled_spec.get_answer(api_response, arguments)
+
+    def get_qa_samples(
+        self, api_response: dict[Any, Any], index: int = 0
+    ) -> list[LongResponseQASample]:
+        max_samples = self.compiled_spec.spec.max_samples
+        qa_samples: list[LongResponseQASample] = []
+        try:
+            first_record_response = api_response
+            api_response = manipulate_response(api_response, index)
+            for arguments in self.compiled_spec.iter_arguments(first_record_response):
+                if max_samples is not None and len(qa_samples) >= max_samples:
+                    break
+                question = self.get_question(**arguments)
+                answer = self.get_answer(api_response, **arguments)
+                if answer is not None and answer != "None":
+                    qa_samples.append(
+                        LongResponseQASample(
+                            api_response=api_response, question=question, gold_answer=answer
+                        )
+                    )
+        except DATA_ERRORS:
+            # a record without the structure of the spec, or an index out of the api response
+            pass
+        return qa_samples
+
+
+def compile_task_spec(spec: TaskSpec, module: str) -> Type[Task]:
+    """
+    The Task class of spec, named spec.name. module is the __name__ of the module that
+    defines the class (as a module attribute named spec.name), for pickling.
+    """
+    return type(
+        spec.name,
+        (CompiledTask,),
+        {
+            "__module__": module,
+            "__qualname__": spec.name,
+            "EVALUATION_CRITERIAS": list(spec.evaluation_criterias),
+            "TASK_ATTRIBUTES": list(spec.task_attributes),
+            "compiled_spec": CompiledTaskSpec(spec),
+        },
+    )
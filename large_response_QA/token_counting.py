@@ -0,0 +1,51 @@
+import random
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class ApproximateTokenCounter:
+    """Approximate the number of tokens of a text from its number of characters, with a tokens
+    per character ratio fitted for one tokenizer on a sample of texts from one endpoint.
+    The relative errors are measured on the texts used for fitting.
+    """
+
+    model_name: str
+    tokens_per_char: float
+    max_relative_error: float
+    mean_relative_error: float
+    num_samples: int
+
+    def count(self, text: str) -> int:
+        return round(len(text) * self.tokens_per_char)
+
+
+def fit_approximate_token_counter(
+    model_name: str, tokenizer: Any, texts: list[str]
+) -> ApproximateTokenCounter:
+    exact_counts = [len(tokenizer.tokenize(text)) for text in texts]
+    num_chars = sum(len(text) for text in texts)
+    tokens_per_char = sum(exact_counts) / num_chars if num_chars > 0 else 0.0
+
+    relative_errors = [
+        abs(round(len(text) * tokens_per_char) - exact_count) / exact_count
+        for text, exact_count in zip(texts, exact_counts)
+        if exact_count > 0
+    ]
+    return ApproximateTokenCounter(
+        model_name=model_name,
+        tokens_per_char=tokens_per_char,
+        max_relative_error=max(relative_errors, default=0.0),
+        mean_relative_error=(
+            sum(relative_errors) / len(relative_errors) if relative_errors else 0.0
+        ),
+        num_samples=len(texts),
+    )
+
+
+def sample_calibration_records(
+    records: list[Any], sample_size: int, seed: int = 0
+) -> list[Any]:
+    if len(records) <= sample_size:
+        return records
+    return random.Random(seed).sample(records, sample_size)
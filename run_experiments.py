@@ -1,14 +1,38 @@
 import argparse
-import json
 import os
 import pickle
+from functools import partial
 from multiprocessing import Pool
-from typing import Any
+from typing import Any, Optional
 import pandas as pd
 import large_response_QA.tasks.task_list as task_list_module
 import yaml
 
-from large_response_QA.large_response_utils import generate, get_lm
+from large_response_QA import json_codec
+from large_response_QA.prompt_store import (
+    PromptGroup,
+    PromptStore,
+    get_prompts_key,
+    iter_prompt_groups,
+    load_task_class,
+)
+from large_response_QA.prompt_tokens import PromptTokenCache
+from large_response_QA.qa_store import EndpointQASamples, get_qa_set, get_task_qa_samples
+from large_response_QA.serializers import DEFAULT_RESPONSE_FORMAT, get_response_format
+from large_response_QA.subset_store import (
+    BinaryDataSubset,
+    BinaryEndpointResponses,
+    get_binary_data_subset_path,
+    get_converted_data_subset_path,
+)
+from large_response_QA.tasks.data_structures import LongResponseQASample
+from large_response_QA.tasks.multi_question import parse_multi_question_answers
+from large_response_QA.large_response_utils import (
+    DEFAULT_TOKENIZER_MODEL,
+    generate,
+    get_data_subset_file_name,
+    get_lm,
+)
 
 try:
     from dotenv import load_dotenv
@@ -24,16 +48,41 @@ def run_tasks_for_one_api_response(
     model_name: str,
     llm_parameters: dict[str, Any],
     index: int,
+    prompt_token_cache: Optional[PromptTokenCache] = None,
+    multi_question: bool = False,
+    endpoint_qa_samples: Optional[EndpointQASamples] = None,
 ) -> list[Any]:
     output_list = []
+    if isinstance(api_response, BinaryEndpointResponses):
+        api_response = api_response.load()
     llm = get_lm(model_name, parameters=llm_parameters)
+    if multi_question:
+        return run_multi_question_tasks(
+            api_response,
+            task_list,
+            model_name,
+            llm,
+            index,
+            prompt_token_cache,
+            endpoint_qa_samples,
+        )
     for task in task_list.task_list:
-        task_obj = task()
-        qa_pairs = task_obj.get_qa_samples(api_response, index=index)
+        task_obj = task_list.create_task(task)
+        qa_pairs = get_task_qa_samples(task_obj, api_response, index, endpoint_qa_samples)
         if len(qa_pairs) > 0:
-            prompts = [
-                task_obj.get_prompt(qa_sample=qa_sample) for qa_sample in qa_pairs
-            ]
+            if prompt_token_cache is not None:
+                # token IDs spliced from the cached token IDs of the api response
+                prompts = [
+                    prompt_token_cache.get_prompt(
+                        task_obj.get_prompt_parts(qa_sample),
+                        task_obj.get_record_offsets(qa_sample),
+                    )
+                    for qa_sample in qa_pairs
+                ]
+            else:
+                prompts = [
+                    task_obj.get_prompt(qa_sample=qa_sample) for qa_sample in qa_pairs
+                ]
             try:
                 generations = generate(
                     llm=llm, model_name=model_name, prompts=prompts, temperature=0
@@ -55,6 +104,150 @@ def run_tasks_for_one_api_response(
                 print(e)
     return output_list
 
+
+def run_multi_question_tasks(
+    api_response: Any,
+    task_list: task_list_module.TaskList,
+    model_name: str,
+    llm: Any,
+    index: int,
+    prompt_token_cache: Optional[PromptTokenCache] = None,
+    endpoint_qa_samples: Optional[EndpointQASamples] = None,
+) -> list[Any]:
+    """
+    Same as run_tasks_for_one_api_response, with all the questions of the tasks about the
+    api response asked in one prompt (see TaskList.get_multi_question_prompt_parts).
+    """
+    output_list: list[Any] = []
+    task_qa_samples = []
+    for task in task_list.task_list:
+        task_obj = task_list.create_task(task)
+        for qa_sample in get_task_qa_samples(
+            task_obj, api_response, index, endpoint_qa_samples
+        ):
+            task_qa_samples.append((task_obj, qa_sample))
+    multi_question_prompts = task_list.get_multi_question_prompt_parts(task_qa_samples)
+    if len(multi_question_prompts) == 0:
+        return output_list
+    if prompt_token_cache is not None:
+        prompts = [
+            prompt_token_cache.get_prompt(
+                prompt_parts, questions[0][0].get_record_offsets(questions[0][1])
+            )
+            for prompt_parts, questions in multi_question_prompts
+        ]
+    else:
+        prompts = ["".join(prompt_parts) for prompt_parts, _ in multi_question_prompts]
+    max_questions = max(len(questions) for _, questions in multi_question_prompts)
+    try:
+        generations = generate(
+            llm=llm,
+            model_name=model_name,
+            prompts=prompts,
+            temperature=0,
+            # the answers of all the questions are in one generation
+            max_tokens=max(256, 64 * max_questions),
+        )
+
+        print(f"len(prompts):{len(prompts)}, questions: {len(task_qa_samples)}")
+        for (_, questions), generation in zip(multi_question_prompts, generations):
+            answers = parse_multi_question_answers(generation, len(questions))
+            for (task_obj, qa_sample), answer in zip(questions, answers):
+                qa_sample.pred_answer = answer
+                qa_sample.metrics = task_obj.evaluate_task(qa_sample)
+                qa_sample.task_type = task_obj.TASK_ATTRIBUTES
+                print(
+                    f"{qa_sample.question}, gold: {qa_sample.gold_answer} , predicted: {qa_sample.pred_answer}"
+                )
+                print(f"metrics: {qa_sample.metrics}, task_type: {qa_sample.task_type}")
+                output_list.append(qa_sample)
+    except BaseException as e:
+        print(e)
+    return output_list
+
+
+def run_materialized_prompts(
+    prompt_group: PromptGroup,
+    model_name: str,
+    llm_parameters: dict[str, Any],
+    prompt_token_cache: Optional[PromptTokenCache] = None,
+) -> list[Any]:
+    """
+    Same as run_tasks_for_one_api_response for the prompts about an api response streamed from
+    a prompts file (see prompt_store.py). The prompts are not created from the data subset, the
+    tasks are only used to evaluate the answers.
+    """
+    output_list = []
+    llm = get_lm(model_name, parameters=llm_parameters)
+    for prompts in prompt_group.get_generation_batches():
+        if prompt_token_cache is not None:
+            prompt_inputs = [
+                prompt_token_cache.get_prompt(
+                    prompt_group.get_prompt_parts(prompt), prompt_group.record_offsets
+                )
+                for prompt in prompts
+            ]
+        else:
+            prompt_inputs = [
+                "".join(prompt_group.get_prompt_parts(prompt)) for prompt in prompts
+            ]
+        generate_kwargs = {}
+        if prompt_group.multi_question:
+            # the answers of all the questions are in one generation
+            max_questions = max(len(prompt.questions) for prompt in prompts)
+            generate_kwargs["max_tokens"] = max(256, 64 * max_questions)
+        try:
+            generations = generate(
+                llm=llm,
+                model_name=model_name,
+                prompts=prompt_inputs,
+                temperature=0,
+                **generate_kwargs,
+            )
+
+            print(f"len(prompts):{len(prompt_inputs)}")
+            for prompt, generation in zip(prompts, generations):
+                if prompt_group.multi_question:
+                    answers = parse_multi_question_answers(generation, len(prompt.questions))
+                else:
+                    answers = [generation]
+                for (sample_id, task_path, question, gold_answer), answer in zip(
+                    prompt.questions, answers
+                ):
+                    task_obj = load_task_class(task_path)()
+                    qa_sample = LongResponseQASample(
+                        api_response=prompt_group.api_response,
+                        question=question,
+                        gold_answer=gold_answer,
+                        pred_answer=answer,
+                        sample_id=sample_id,
+                    )
+                    qa_sample.metrics = task_obj.evaluate_task(qa_sample)
+                    qa_sample.task_type = task_obj.TASK_ATTRIBUTES
+                    print(
+                        f"{qa_sample.question}, gold: {qa_sample.gold_answer} , predicted: {qa_sample.pred_answer}"
+                    )
+                    print(f"metrics: {qa_sample.metrics}, task_type: {qa_sample.task_type}")
+                    output_list.append(qa_sample)
+        except BaseException as e:
+            print(e)
+    return output_list
+
+
+def get_result_row(result: LongResponseQASample) -> dict[str, Any]:
+    row = {
+        "api_response": result.api_response,
+        "question": result.question,
+        "gold_answer": result.gold_answer,
+        "pred_answer": result.pred_answer,
+        "metrics": result.metrics,
+        "task_type": [task_type.value for task_type in result.task_type or []],
+    }
+    if result.sample_id is not None:
+        # the results of the prompts streamed from a prompts file can be joined by sample ID
+        row["sample_id"] = result.sample_id
+    return row
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -75,7 +268,6 @@ if __name__ == "__main__":
         "-m",
         "--model_name",
         help="Name of the model.",
-        required=True,
         choices=[
             "meta-llama/llama-3-1-70b-instruct",
             "ibm-granite/granite-3.1-8b-instruct",
@@ -103,8 +295,15 @@ if __name__ == "__main__":
         type=int,
         default=0,  # 0 indicates no multiprocessing
     )
+    parser.add_argument(
+        "--prepare_prompts",
+        help="Only materialize the prompts into the prompt_dir of the config file, without a model.",
+        action="store_true",
+    )
 
     args = parser.parse_args()
+    if args.model_name is None and not args.prepare_prompts:
+        parser.error("the following arguments are required: -m/--model_name")
     abs_path_of_config_file = os.path.realpath(args.config)
     data_config = yaml.safe_load(open(args.config))
     data_dir = os.path.join(os.path.dirname(abs_path_of_config_file), data_config["data_dir"])
@@ -112,11 +311,39 @@ if __name__ == "__main__":
         os.path.dirname(abs_path_of_config_file), data_config["results_dir"]
     )
     task_lists = data_config["task_lists"]
+    prompt_store = None
+    if data_config.get("prompt_dir") is not None:
+        prompt_store = PromptStore(
+            os.path.join(os.path.dirname(abs_path_of_config_file), data_config["prompt_dir"])
+        )
+    elif args.prepare_prompts:
+        parser.error("--prepare_prompts needs a prompt_dir in the config file")
+    prompt_token_cache = None
+    if data_config.get("prompt_token_cache_dir") is not None and not args.prepare_prompts:
+        if os.getenv("LLM_PROVIDER", "VLLM").lower() == "vllm":
+            prompt_token_cache = PromptTokenCache(
+                args.model_name,
+                os.path.join(
+                    os.path.dirname(abs_path_of_config_file),
+                    data_config["prompt_token_cache_dir"],
+                ),
+            )
+        else:
+            print("The prompts are only passed as token IDs to vLLM, passing them as text")
+    # the data subsets created with the model's own tokenizer are used if there are any, unless
+    # subset_tokenizers maps the model to the tokenizer of other data subsets
+    subset_tokenizers = data_config.get("subset_tokenizers") or {}
+    subset_tokenizer_model_name = subset_tokenizers.get(args.model_name, args.model_name)
     if args.task_list in task_lists.keys():
         task_config = task_lists[args.task_list]
-        token_limit_position_limit_dict = json.loads(
+        token_limit_position_limit_dict = json_codec.loads(
             task_config["token_limit_position_limit_pairs"]
         )
+        response_format = get_response_format(
+            task_config.get("response_format", DEFAULT_RESPONSE_FORMAT)
+        ).name
+        multi_question = bool(task_config.get("multi_question", False))
+        materialize_qa_samples = bool(data_config.get("materialize_qa_samples", True))
     else:
         raise BaseException(
             "The name of the task list is not present in in the config. Please check the tasklists available in task_list.py"
@@ -137,38 +364,137 @@ if __name__ == "__main__":
         class_ = getattr(task_list_module, args.task_list)
         host = class_.host
         endpoint_name = class_.endpoint_name
-        # Initialize the TaskList object given the name of the class and the path to the dataset json
         data_file_path = os.path.join(
-            data_dir, f"{host}_{endpoint_name}_subset_{token_limit}.json"
+            data_dir, get_data_subset_file_name(host, endpoint_name, token_limit)
         )
-        task_list_obj = class_(data_file_path)
+        # the tokenizers whose data subsets the prompts may have been materialized from
+        prompts_subset_tokenizers: list[Optional[str]] = [None]
+        if subset_tokenizer_model_name not in (None, DEFAULT_TOKENIZER_MODEL):
+            tokenizer_data_file_path = os.path.join(
+                data_dir,
+                get_data_subset_file_name(
+                    host, endpoint_name, token_limit, subset_tokenizer_model_name
+                ),
+            )
+            if os.path.exists(tokenizer_data_file_path) or os.path.exists(
+                get_binary_data_subset_path(tokenizer_data_file_path)
+            ):
+                data_file_path = tokenizer_data_file_path
+                prompts_subset_tokenizers = [subset_tokenizer_model_name]
+            elif not os.path.exists(data_file_path) and not os.path.exists(
+                get_binary_data_subset_path(data_file_path)
+            ):
+                # e.g. a node with only the prompts
+                prompts_subset_tokenizers = [subset_tokenizer_model_name, None]
+            elif args.model_name in subset_tokenizers:
+                print(
+                    f"No data subset for the tokenizer {subset_tokenizer_model_name}, using {data_file_path}"
+                )
+        # Prefer the binary data subset file converted from the JSON one, if it is up to date
+        binary_data_file_path = get_converted_data_subset_path(data_file_path)
+        if binary_data_file_path is not None:
+            data_file_path = binary_data_file_path
+        # the data subset is only read if the prompts of a position are not materialized
+        task_list_obj = None
+        qa_set = None
         for position in range(position_limit):
             task_outputs = []
-            api_response_requests_for_task = []
-
-            for random_seed, data in task_list_obj.api_response.items():
-                for app, endpoint_info in data.items():
-                    for endpoint, query_info in endpoint_info.items():
-                        api_response_requests_for_task.append(
-                            (
-                                query_info,
-                                task_list_obj,
-                                args.model_name,
-                                llm_parameters,
-                                position,
-                            )
-                        )
-            output_lists = []
-            if args.num_processes == 0:
-                for api_response_request_for_task in api_response_requests_for_task:
-                    output_lists.append(
-                        run_tasks_for_one_api_response(*api_response_request_for_task)
+            prompts_fpath = None
+            if prompt_store is not None:
+                for prompts_subset_tokenizer in prompts_subset_tokenizers:
+                    prompts_key = get_prompts_key(
+                        args.task_list,
+                        token_limit,
+                        position,
+                        response_format,
+                        multi_question,
+                        task_config.get("max_questions_per_prompt"),
+                        prompts_subset_tokenizer,
                     )
+                    prompts_fpath = prompt_store.get_prompts_path(prompts_key, data_file_path)
+                    if prompts_fpath is not None:
+                        break
+            if prompts_fpath is None and task_list_obj is None:
+                # Initialize the TaskList object given the name of the class and the path to the dataset json
+                task_list_obj = class_(data_file_path)
+                task_list_obj.response_format = response_format
+                if task_config.get("max_questions_per_prompt") is not None:
+                    task_list_obj.max_questions_per_prompt = task_config[
+                        "max_questions_per_prompt"
+                    ]
+                # the QA samples do not depend on the model, they are loaded from the QA file of
+                # the data subset file, which is materialized by the first run
+                qa_set = (
+                    get_qa_set(task_list_obj, data_file_path, position_limit)
+                    if materialize_qa_samples
+                    else None
+                )
+            if prompt_store is not None and prompts_fpath is None:
+                prompts_fpath = prompt_store.save_prompts(
+                    prompts_key,
+                    task_list_obj,
+                    data_file_path,
+                    token_limit,
+                    position,
+                    multi_question,
+                    qa_set,
+                )
+            if args.prepare_prompts:
+                continue
+
+            output_lists = []
+            if prompts_fpath is not None:
+                # the prompts are streamed from the prompts file, one api response at a time
+                run_prompt_group = partial(
+                    run_materialized_prompts,
+                    model_name=args.model_name,
+                    llm_parameters=llm_parameters,
+                    prompt_token_cache=prompt_token_cache,
+                )
+                if args.num_processes == 0:
+                    for prompt_group in iter_prompt_groups(prompts_fpath):
+                        output_lists.append(run_prompt_group(prompt_group))
+                else:
+                    with Pool(processes=args.num_processes) as pool:
+                        output_lists = list(
+                            pool.imap(run_prompt_group, iter_prompt_groups(prompts_fpath))
+                        )
             else:
-                with Pool(processes=args.num_processes) as pool:
-                    output_lists = pool.starmap(
-                        run_tasks_for_one_api_response, api_response_requests_for_task
-                    )
+                # the data subset was read as the prompts of the position are not materialized
+                assert task_list_obj is not None
+                api_response_requests_for_task = []
+                for random_seed in task_list_obj.api_response:
+                    if isinstance(task_list_obj.api_response, BinaryDataSubset):
+                        # the records are decoded by the process running the tasks
+                        data = task_list_obj.api_response.endpoint_responses(random_seed)
+                    else:
+                        data = task_list_obj.api_response[random_seed]
+                    for app, endpoint_info in data.items():
+                        for endpoint, query_info in endpoint_info.items():
+                            api_response_requests_for_task.append(
+                                (
+                                    query_info,
+                                    task_list_obj,
+                                    args.model_name,
+                                    llm_parameters,
+                                    position,
+                                    prompt_token_cache,
+                                    multi_question,
+                                    qa_set.get(random_seed, app, endpoint, position)
+                                    if qa_set is not None
+                                    else None,
+                                )
+                            )
+                if args.num_processes == 0:
+                    for api_response_request_for_task in api_response_requests_for_task:
+                        output_lists.append(
+                            run_tasks_for_one_api_response(*api_response_request_for_task)
+                        )
+                else:
+                    with Pool(processes=args.num_processes) as pool:
+                        output_lists = pool.starmap(
+                            run_tasks_for_one_api_response, api_response_requests_for_task
+                        )
             for output_list in output_lists:
                 task_outputs.extend(output_list)
             task_results_dir_path = os.path.join(
@@ -185,27 +511,21 @@ if __name__ == "__main__":
             for task_output in task_outputs:
                 if isinstance(task_output, list):
                     for result in task_output:
-                        results_list.append({
-                            "api_response": result.api_response,
-                            "question": result.question,
-                            "gold_answer": result.gold_answer,
-                            "pred_answer": result.pred_answer,
-                            "metrics": result.metrics,
-                            "task_type": [task_type.value for task_type in result.task_type]
-                        })
+                        results_list.append(get_result_row(result))
                 else:
-                    results_list.append({
-                        "api_response": task_output.api_response,
-                        "question": task_output.question,
-                        "gold_answer": task_output.gold_answer,
-                        "pred_answer": task_output.pred_answer,
-                        "metrics": task_output.metrics,
-                        "task_type": [task_type.value for task_type in task_output.task_type]
-                    })
+                    results_list.append(get_result_row(task_output))
 
             df = pd.DataFrame.from_records(results_list)
-            df['api_response'] = df['api_response'].apply(json.dumps)
+            df['api_response'] = df['api_response'].apply(json_codec.dumps)
+            # the results of the other response formats and of the multi-question mode are
+            # kept next to the single-question JSON ones
+            results_file_name = f"{token_limit}_{position + 1}"
+            if response_format != DEFAULT_RESPONSE_FORMAT:
+                results_file_name += f"_{response_format}"
+            if multi_question:
+                results_file_name += "_multi_question"
+            results_file_name += ".csv"
             df.to_csv(
-                os.path.join(model_results_dir_path, f"{token_limit}_{position + 1}.csv"),
+                os.path.join(model_results_dir_path, results_file_name),
                 index=False,
             )
\ No newline at end of file
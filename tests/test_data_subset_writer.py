@@ -0,0 +1,35 @@
+import json
+from pathlib import Path
+from typing import Any
+
+from large_response_QA.large_response_utils import DataSubsetWriter
+
+
+def write_dataset(fpath: Path, dataset: dict[int, Any]) -> str:
+    with DataSubsetWriter(str(fpath)) as writer:
+        for random_seed, subset in dataset.items():
+            writer.write(random_seed, subset)
+    return fpath.read_text()
+
+
+def test_file_is_the_json_dump_of_the_dataset(tmp_path: Path) -> None:
+    dataset = {
+        3: {"app": {"endpoint": {"{'id': 1}": {"data": [1.5, None, "é\n", {"a": []}]}}}},
+        1: {"app": {"endpoint": {}}},
+        2: {"app": {"endpoint": {"{'id': 2}": {"data": {"nested": {"b": True}}}}}},
+    }
+    text = write_dataset(tmp_path / "subset.json", dataset)
+    assert text == json.dumps({str(key): value for key, value in dataset.items()}, indent=4)
+
+
+def test_empty_dataset(tmp_path: Path) -> None:
+    assert write_dataset(tmp_path / "subset.json", {}) == json.dumps({}, indent=4)
+
+
+def test_close_is_idempotent(tmp_path: Path) -> None:
+    fpath = tmp_path / "subset.json"
+    writer = DataSubsetWriter(str(fpath))
+    writer.write(1, {"app": {}})
+    writer.close()
+    writer.close()
+    assert json.loads(fpath.read_text()) == {"1": {"app": {}}}
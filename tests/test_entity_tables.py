@@ -0,0 +1,100 @@
+from typing import Any, Callable
+
+from large_response_QA.tasks.booking_search_flights_multi_stops_LIM import GetShortestFlight
+from large_response_QA.tasks.entity_tables import EntityTableSpec, get_entity_table
+
+
+def make_segment(departure: Any, arrival: Any, total_time: int) -> dict[str, Any]:
+    return {
+        "departureAirport": {"code": departure},
+        "arrivalAirport": {"code": arrival},
+        "totalTime": total_time,
+    }
+
+
+def get_shortest_flight_by_scan(
+    api_response: dict[Any, Any], departure_airport_code: str, arrival_airport_code: str
+) -> str:
+    """The scan of the nested dicts that GetShortestFlight answered with before the tables."""
+    shortest_time = None
+    for _, query_result in api_response.items():
+        for flight_offer in query_result["data"]["flightOffers"]:
+            for flight_segment in flight_offer["segments"]:
+                departure_airport = flight_segment["departureAirport"]["code"]
+                arrival_airport = flight_segment["arrivalAirport"]["code"]
+                if (
+                    departure_airport.strip().lower() == departure_airport_code.strip().lower()
+                    and arrival_airport.strip().lower() == arrival_airport_code.strip().lower()
+                ):
+                    time_duration = flight_segment["totalTime"]
+                    if shortest_time is None or time_duration < shortest_time:
+                        shortest_time = time_duration
+    return str(shortest_time) if shortest_time is not None else "None"
+
+
+def get_outcome(get_answer: Callable[..., str], *args: Any) -> str:
+    try:
+        return get_answer(*args)
+    except Exception as e:
+        return type(e).__name__
+
+
+def test_bad_values_of_other_parents_are_not_raised() -> None:
+    spec = EntityTableSpec(
+        iter_parents=lambda api_response: iter(api_response.items()),
+        iter_entities=lambda query_result: query_result["data"]["cars"],
+        columns={"price": lambda car: car["price"]},
+    )
+    api_response = {
+        "a": {"data": {"cars": [{"price": 12}, {"price": 10.5}]}},
+        "b": {"data": {"cars": [{}]}},
+        "c": {"data": {}},
+    }
+    cars = get_entity_table(api_response, spec)
+    rows = cars.get_rows(cars.get_parents("a"))
+    assert cars.get_values("price", rows) == [12, 10.5]
+
+
+def test_shortest_flight_with_malformed_segments_of_other_routes() -> None:
+    api_response = {
+        "q1": {
+            "data": {
+                "flightOffers": [
+                    {"segments": [make_segment("BOS", "SEA", 300), make_segment("LAX", 5, 10)]}
+                ]
+            }
+        },
+        "q2": {
+            "data": {
+                "flightOffers": [
+                    {"segments": [make_segment(" bos", "SEA ", 200)]},
+                    {"segments": [make_segment("JFK", None, 100)]},
+                ]
+            }
+        },
+    }
+    assert GetShortestFlight().get_answer(api_response, "BOS", "SEA") == "200"
+    for departure, arrival in [("BOS", "SEA"), ("LAX", "SFO"), ("JFK", "SFO"), ("ORD", "IAH")]:
+        assert get_outcome(
+            GetShortestFlight().get_answer, api_response, departure, arrival
+        ) == get_outcome(get_shortest_flight_by_scan, api_response, departure, arrival)
+
+
+def test_unhashable_parent_keys_are_compared_like_the_scan() -> None:
+    spec = EntityTableSpec(
+        iter_parents=lambda api_response: ((parent["id"], parent) for parent in api_response),
+        iter_entities=lambda parent: parent["cars"],
+        columns={"price": lambda car: car["price"]},
+    )
+    api_response: list[dict[str, Any]] = [
+        {"id": ["a"], "cars": [{"price": 1}]},
+        {"id": "a", "cars": [{"price": 2}]},
+        {"id": {"a": 1}, "cars": [{"price": 3}, {"price": 4}]},
+        {"id": ["a"], "cars": [{"price": 5}]},
+    ]
+    table = get_entity_table(api_response, spec)
+    table.raise_scan_error()
+    for key in [["a"], "a", {"a": 1}, ["b"]]:
+        assert table.get_values("price", table.get_rows(table.get_parents(key))) == [
+            car["price"] for parent in api_response if parent["id"] == key for car in parent["cars"]
+        ]
@@ -0,0 +1,124 @@
+import json
+import math
+from typing import Any
+
+import pytest
+
+from large_response_QA import json_codec
+
+NUMBER_TEXTS = [
+    str(2**63 - 1),
+    str(2**63),
+    str(2**64 - 1),
+    str(2**64),
+    str(-(2**63)),
+    str(-(2**63) - 1),
+    "-9223372036854775809",
+    "-9631901213360251928",
+    "123456789012345678",
+    "-123456789012345678",
+    "0.1234567890123456789",
+    "1e16",
+    "1E+16",
+    "1e-05",
+    "5e-324",
+    "1.7976931348623157e308",
+    "-0.0",
+    "NaN",
+    "Infinity",
+    "-Infinity",
+]
+
+VALUES: list[Any] = [
+    2**63 - 1,
+    2**63,
+    -(2**63),
+    -(2**63) - 1,
+    2**64,
+    -(2**70),
+    float("nan"),
+    float("inf"),
+    float("-inf"),
+    0.0001,
+    0.00001,
+    1e-7,
+    1e16,
+    1e15,
+    1.5e300,
+    5e-324,
+    -0.0,
+    12.0,
+    "café",
+    "\x7f\x80 ",
+    "😀 emoji",
+    "\ud800",
+    "line\nbreak \"quoted\" \\ back",
+    (1, "a", (2.5, None)),
+    {1: "a", 2.5: "b", None: "c", True: "d"},
+    {"nested": [{"a": None, "b": [True, False]}, [], {}]},
+    {"tuple": (1, 2), "float": 1.25, "nan": float("nan")},
+    {"null": None, "value": "null"},
+]
+
+
+def same(a: Any, b: Any) -> bool:
+    # NaN != NaN, so the values are compared by their types and reprs
+    return type(a) is type(b) and repr(a) == repr(b)
+
+
+@pytest.mark.parametrize("text", NUMBER_TEXTS)
+def test_loads_numbers_like_json(text: str) -> None:
+    for data in (text, f"[{text}, 1]", f'{{"a": {text}}}'.encode("utf-8")):
+        assert same(json_codec.loads(data), json.loads(data))
+
+
+@pytest.mark.parametrize("value", VALUES, ids=repr)
+def test_dumps_like_json(value: Any) -> None:
+    for indent in (None, 2, 4):
+        assert json_codec.dumps(value, indent=indent) == json.dumps(value, indent=indent)
+        assert json_codec.dumps([value, {"key": value}], indent=indent) == json.dumps(
+            [value, {"key": value}], indent=indent
+        )
+    separators = (",", ":")
+    assert json_codec.dumps(value, separators=separators) == json.dumps(
+        value, separators=separators
+    )
+    assert json_codec.dumps([value, {"key": value}], separators=separators) == json.dumps(
+        [value, {"key": value}], separators=separators
+    )
+
+
+@pytest.mark.parametrize("value", VALUES, ids=repr)
+def test_round_trip_like_json(value: Any) -> None:
+    text = json.dumps(value, indent=4)
+    assert same(json_codec.loads(text), json.loads(text))
+    assert json_codec.dumps(json_codec.loads(text), indent=4) == text
+
+
+def test_loads_strings_like_json() -> None:
+    for text in ['"caf\\u00e9"', '"\\ud83d\\ude00"', '"\\ud800"', '"café"', '{"\\u0000": 1}']:
+        assert same(json_codec.loads(text), json.loads(text))
+
+
+def test_non_finite_floats_are_not_written_as_null() -> None:
+    assert json_codec.dumps({"a": float("nan")}, indent=4) == '{\n    "a": NaN\n}'
+    assert math.isinf(json_codec.loads("[Infinity]")[0])
+
+
+def test_dumps_subclasses_and_unsupported_types_like_json() -> None:
+    import datetime
+    import enum
+
+    class Number(enum.IntEnum):
+        ONE = 1
+
+    class Text(str):
+        pass
+
+    value = {"number": Number.ONE, "text": Text("a")}
+    assert json_codec.dumps(value, indent=4) == json.dumps(value, indent=4)
+    assert json_codec.dumps(value, separators=(",", ":")) == json.dumps(
+        value, separators=(",", ":")
+    )
+    with pytest.raises(TypeError):
+        json_codec.dumps({"date": datetime.date(2024, 1, 1)}, indent=4)
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from large_response_QA import large_response_utils
+from large_response_QA.large_response_utils import extract_endpoints_data
+from large_response_QA.manifest import (
+    get_file_signature,
+    get_text_hash,
+    load_manifest,
+    save_manifest,
+)
+
+APP_ENDPOINTS = [("app-a", "Search"), ("app-a", "Get/Details"), ("app-b", "Search")]
+
+
+def test_manifest_round_trip(tmp_path: Path) -> None:
+    fpath = str(tmp_path / "steps.manifest")
+    assert load_manifest(fpath) == {}
+    manifest = {"files": {"a.json": [10, 123]}, "token_counts": {get_text_hash("é"): 3}}
+    save_manifest(manifest, fpath)
+    assert load_manifest(fpath) == manifest
+    assert not os.path.exists(fpath + ".tmp")
+
+
+def test_unreadable_manifest_is_ignored(tmp_path: Path) -> None:
+    fpath = tmp_path / "steps.manifest"
+    fpath.write_text('{"files": ')
+    assert load_manifest(str(fpath)) == {}
+
+
+def test_file_signature_changes_with_the_file(tmp_path: Path) -> None:
+    fpath = tmp_path / "data.json"
+    fpath.write_text("{}")
+    os.utime(fpath, ns=(1, 1_000_000_000))
+    signature = get_file_signature(str(fpath))
+    assert signature == [2, 1_000_000_000]
+    os.utime(fpath, ns=(1, 2_000_000_000))
+    assert get_file_signature(str(fpath)) != signature
+
+
+def test_text_hash() -> None:
+    assert get_text_hash("abc") == get_text_hash("abc")
+    assert get_text_hash("abc") != get_text_hash("abd")
+    # lone surrogates, which the json module loads, are hashed too
+    assert get_text_hash("\ud800") != get_text_hash("\udc00")
+
+
+def write_response_cache(fpath: Path, response_cache: dict[str, Any], mtime: int) -> None:
+    fpath.write_text(json.dumps(response_cache))
+    os.utime(fpath, ns=(mtime, mtime))
+
+
+def read_outputs(output_dir: Path) -> dict[str, Any]:
+    return {
+        fpath.name: json.loads(fpath.read_text()) for fpath in sorted(output_dir.glob("*.json"))
+    }
+
+
+def test_incremental_extraction_matches_a_full_extraction(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    all_read_fpaths: list[str] = []
+    load_response_cache = large_response_utils.load_response_cache
+
+    def counting_load_response_cache(fpath: str) -> Any:
+        all_read_fpaths.append(os.path.basename(fpath))
+        return load_response_cache(fpath)
+
+    monkeypatch.setattr(large_response_utils, "load_response_cache", counting_load_response_cache)
+    cache_dir = tmp_path / "caches"
+    cache_dir.mkdir()
+    output_dir = tmp_path / "outputs"
+    output_dir.mkdir()
+    manifest_path = str(tmp_path / "extraction.manifest")
+
+    def extract() -> tuple[dict[str, Any], list[str]]:
+        all_read_fpaths.clear()
+        extract_endpoints_data(APP_ENDPOINTS, str(cache_dir), str(output_dir), manifest_path)
+        outputs = read_outputs(output_dir)
+        read_fpaths = sorted(all_read_fpaths)
+        # the same outputs as a full extraction without the manifest
+        full_output_dir = tmp_path / "full_outputs"
+        shutil.rmtree(full_output_dir, ignore_errors=True)
+        full_output_dir.mkdir()
+        extract_endpoints_data(APP_ENDPOINTS, str(cache_dir), str(full_output_dir))
+        assert outputs == read_outputs(full_output_dir)
+        return outputs, read_fpaths
+
+    write_response_cache(
+        cache_dir / "1.json",
+        {"app-a": {"Search": {"{'q': 1}": [1]}, "Get/Details": {"{'id': 1}": {"a": 1}}}},
+        1,
+    )
+    write_response_cache(cache_dir / "2.json", {"APP-B": {"search": {"{'q': 2}": [2]}}}, 1)
+    (cache_dir / "notes.json").write_text("[]")
+    outputs, read_fpaths = extract()
+    assert read_fpaths == ["1.json", "2.json"]
+    assert outputs["app-a_Get_Details.json"] == {"app-a": {"Get/Details": {"{'id': 1}": {"a": 1}}}}
+    # nothing changed
+    assert extract() == (outputs, [])
+    # a changed file is read once, and only its endpoints are extracted again
+    write_response_cache(cache_dir / "2.json", {"app-b": {"Search": {"{'q': 3}": [3]}}}, 2)
+    outputs, read_fpaths = extract()
+    assert read_fpaths == ["2.json"]
+    assert outputs["app-b_Search.json"] == {"app-b": {"Search": {"{'q': 3}": [3]}}}
+    # a new file with an endpoint of another file
+    write_response_cache(cache_dir / "3.json", {"app-a": {"Search": {"{'q': 4}": [4]}}}, 1)
+    outputs, read_fpaths = extract()
+    assert read_fpaths == ["1.json", "3.json"]
+    assert outputs["app-a_Search.json"] == {
+        "app-a": {"Search": {"{'q': 1}": [1], "{'q': 4}": [4]}}
+    }
+    # a removed file
+    os.remove(cache_dir / "3.json")
+    outputs, read_fpaths = extract()
+    assert read_fpaths == ["1.json"]
+    assert outputs["app-a_Search.json"] == {"app-a": {"Search": {"{'q': 1}": [1]}}}
+    # a modified output file is extracted again
+    (output_dir / "app-a_Get_Details.json").write_text("{}")
+    assert extract() == (outputs, ["1.json"])
@@ -0,0 +1,13 @@
+from large_response_QA.tasks import evals
+from large_response_QA.tasks.data_structures import LongResponseQASample
+from large_response_QA.tasks.multi_question import parse_multi_question_answers
+
+
+def test_list_answers_are_joined_like_the_gold_answers() -> None:
+    generation = '{"1": ["12A", "12B", "14C"], "2": 3, "3": "ORD"}'
+    answers = parse_multi_question_answers(generation, 4)
+    assert answers == ["12A, 12B, 14C", "3", "ORD", None]
+    qa_sample = LongResponseQASample(
+        api_response={}, question="", gold_answer="14C, 12A, 12B", pred_answer=answers[0]
+    )
+    assert evals.unordered_list_str_match(qa_sample)
@@ -0,0 +1,87 @@
+import gzip
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from large_response_QA.prompt_store import PromptStore, get_prompts_key, iter_prompt_groups
+from large_response_QA.tasks.task_list import BookingSearchCarRentalsTaskList
+
+HOST = BookingSearchCarRentalsTaskList.host
+ENDPOINT = BookingSearchCarRentalsTaskList.endpoint_name
+
+
+def make_data_subsets(num_records: int) -> dict[str, Any]:
+    return {
+        str(random_seed): {
+            HOST: {
+                ENDPOINT: {
+                    f"{{'pick_up_latitude': {i}}}": {
+                        "data": {
+                            "search_results": [
+                                {
+                                    "vehicle_id": str(random_seed * 10 + i),
+                                    "vehicle_info": {
+                                        "v_name": f"Car é{i}",
+                                        "fuel_policy": "Like for like",
+                                    },
+                                    "rating_info": {"cleanliness": 8.5 + i / 10},
+                                    "pricing_info": {"price": i * 10.5},
+                                }
+                            ]
+                        }
+                    }
+                    for i in range(num_records)
+                }
+            }
+        }
+        for random_seed in range(2)
+    }
+
+
+def save_prompts(
+    tmp_path: Path, response_format: str, multi_question: bool = False
+) -> tuple[str, BookingSearchCarRentalsTaskList]:
+    data_fpath = tmp_path / "subset.json"
+    data_fpath.write_text(json.dumps(make_data_subsets(3)))
+    task_list = BookingSearchCarRentalsTaskList(str(data_fpath))
+    task_list.response_format = response_format
+    key = get_prompts_key(
+        type(task_list).__name__, 1000, 0, response_format, multi_question, None, None
+    )
+    prompts_fpath = PromptStore(str(tmp_path / "prompts")).save_prompts(
+        key, task_list, str(data_fpath), 1000, 0, multi_question
+    )
+    return prompts_fpath, task_list
+
+
+@pytest.mark.parametrize("response_format", ["json", "minified_json", "yaml"])
+@pytest.mark.parametrize("multi_question", [False, True])
+def test_prompt_groups_have_the_api_responses(
+    tmp_path: Path, response_format: str, multi_question: bool
+) -> None:
+    prompts_fpath, task_list = save_prompts(tmp_path, response_format, multi_question)
+    api_responses = [
+        endpoint_info[ENDPOINT]
+        for data in task_list.api_response.values()
+        for endpoint_info in data.values()
+    ]
+    prompt_groups = list(iter_prompt_groups(prompts_fpath))
+    assert len(prompt_groups) == len(api_responses)
+    for prompt_group, api_response in zip(prompt_groups, api_responses):
+        assert prompt_group.api_response == api_response
+        assert len(prompt_group.prompts) > 0
+
+
+@pytest.mark.parametrize(
+    "response_format, has_api_response", [("json", False), ("minified_json", False), ("yaml", True)]
+)
+def test_api_responses_are_only_written_when_they_cannot_be_loaded(
+    tmp_path: Path, response_format: str, has_api_response: bool
+) -> None:
+    prompts_fpath, _ = save_prompts(tmp_path, response_format)
+    with gzip.open(prompts_fpath, "rt", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f][1:]
+    assert len(lines) > 0
+    assert all(("api_response" in line) == has_api_response for line in lines)
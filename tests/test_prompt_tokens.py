@@ -0,0 +1,150 @@
+import random
+import re
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from large_response_QA import prompt_tokens
+from large_response_QA.prompt_tokens import PromptTokenCache
+from large_response_QA.serializers import dumps_json, dumps_json_record, join_json_records
+
+INSTRUCTIONS = "Answer the question about the api response.\n```json\n"
+QUESTION = "Question: What is the price?\n\nOnly respond with the answer."
+
+
+class RegexTokenizer:
+    """Tokenizes the pre-tokens of pattern, like the byte-level BPE tokenizers do before the merges."""
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern = re.compile(pattern)
+        self.vocab: dict[str, int] = {}
+        self.encoded_texts: list[str] = []
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:
+        self.encoded_texts.append(text)
+        token_ids = [
+            self.vocab.setdefault(token, len(self.vocab) + 1)
+            for token in self.pattern.findall(text)
+        ]
+        return ([0] if add_special_tokens else []) + token_ids
+
+
+# the whitespace before a word or punctuation is split from the longer whitespace runs, as in the
+# pre-tokenizer of Llama 3, so the tokens never cross the boundaries of the records
+SPLIT_WHITESPACE_PATTERN = r" ?[^\s\w]+[\r\n]*|\s+(?!\S)|\s+| ?\w+"
+# the whitespace runs are tokens, so the newline at the end of a record and the indentation of
+# the next record are merged
+GREEDY_WHITESPACE_PATTERN = r"\s+|\w+|[^\w\s]+"
+
+
+def make_tokenizer(monkeypatch: pytest.MonkeyPatch, pattern: str) -> RegexTokenizer:
+    tokenizer = RegexTokenizer(pattern)
+    monkeypatch.setattr(prompt_tokens, "get_tokenizer", lambda model_name: tokenizer)
+    return tokenizer
+
+
+def make_records(num_records: int) -> dict[str, Any]:
+    return {
+        f"{{'hotel_id': {i}}}": {"name": f"Hotel {i}", "price": i * 10.5, "rooms": [i, "é"]}
+        for i in range(num_records)
+    }
+
+
+def make_prompt_parts(
+    records: dict[str, Any]
+) -> tuple[tuple[str, str, str], list[tuple[str, int, int]]]:
+    api_response, record_offsets = join_json_records(
+        [
+            (query_args, dumps_json_record(query_args, record))
+            for query_args, record in records.items()
+        ]
+    )
+    return (INSTRUCTIONS, api_response + "\n```\n\n", QUESTION), record_offsets
+
+
+def shuffled(records: dict[str, Any], seed: int) -> dict[str, Any]:
+    items = list(records.items())
+    random.Random(seed).shuffle(items)
+    return dict(items)
+
+
+def test_join_json_records() -> None:
+    for records in [{}, make_records(1), make_records(4)]:
+        fragments = [
+            (query_args, dumps_json_record(query_args, record))
+            for query_args, record in records.items()
+        ]
+        text, record_offsets = join_json_records(fragments)
+        assert text == dumps_json(records)
+        assert [
+            (query_args, text[start:end]) for query_args, start, end in record_offsets
+        ] == fragments
+
+
+def test_joined_token_ids_match_the_encoding_of_the_prompt(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tokenizer = make_tokenizer(monkeypatch, SPLIT_WHITESPACE_PATTERN)
+    cache = PromptTokenCache("model", str(tmp_path))
+    records = make_records(5)
+    for seed in range(4):
+        prompt_parts, record_offsets = make_prompt_parts(shuffled(records, seed))
+        prompt = cache.get_prompt(prompt_parts, record_offsets)
+        assert isinstance(prompt, dict)
+        assert prompt["prompt_token_ids"] == tokenizer.encode(
+            "".join(prompt_parts), add_special_tokens=True
+        )
+        # the token offsets of the records are those of their text and the text after them
+        api_response = prompt_parts[1]
+        response_token_ids, record_token_offsets = cache.get_response_token_ids(
+            api_response, record_offsets
+        )
+        chunk_ends = [start for _, start, _ in record_offsets[1:]] + [len(api_response)]
+        for (_, start, _), chunk_end, (_, token_start, token_end) in zip(
+            record_offsets, chunk_ends, record_token_offsets
+        ):
+            assert response_token_ids[token_start:token_end] == tokenizer.encode(
+                api_response[start:chunk_end]
+            )
+    assert cache.num_spliced_prompts == 4
+    assert cache.num_text_prompts == 0
+
+
+def test_mismatching_joined_token_ids_are_not_used(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tokenizer = make_tokenizer(monkeypatch, GREEDY_WHITESPACE_PATTERN)
+    cache = PromptTokenCache("model", str(tmp_path))
+    prompt_parts, record_offsets = make_prompt_parts(make_records(3))
+    assert not cache._check_joined_records(*prompt_parts, record_offsets)
+    prompt = cache.get_prompt(prompt_parts, record_offsets)
+    if isinstance(prompt, dict):
+        assert prompt["prompt_token_ids"] == tokenizer.encode(
+            "".join(prompt_parts), add_special_tokens=True
+        )
+    else:
+        assert prompt == "".join(prompt_parts)
+
+
+def test_check_is_kept_for_the_text_around_the_records(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tokenizer = make_tokenizer(monkeypatch, SPLIT_WHITESPACE_PATTERN)
+    records = make_records(6)
+
+    def num_prompt_encodes() -> int:
+        return sum(text.startswith(INSTRUCTIONS + "{") for text in tokenizer.encoded_texts)
+
+    cache = PromptTokenCache("model", str(tmp_path))
+    for seed in range(5):
+        cache.get_prompt(*make_prompt_parts(shuffled(records, seed)))
+    # the other orders of the records have the same text around the boundaries of the records
+    assert num_prompt_encodes() == 1
+    # and the result of the check is kept for the next runs
+    cache = PromptTokenCache("model", str(tmp_path))
+    cache.get_prompt(*make_prompt_parts(shuffled(records, 5)))
+    assert num_prompt_encodes() == 1
+    # but not for the text around other records
+    cache.get_prompt(*make_prompt_parts({"{'id': 1}": "text ending with spaces  "}))
+    assert num_prompt_encodes() == 2
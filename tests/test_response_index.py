@@ -0,0 +1,57 @@
+from typing import Any, Iterator
+
+from large_response_QA.tasks.booking_get_availability_LIM import GetLabel
+from large_response_QA.tasks.response_index import ResponseIndex
+
+
+def iter_items_by_id(api_response: list[Any]) -> Iterator[tuple[Any, Any]]:
+    for item in api_response:
+        yield item["id"], item
+
+
+def test_unhashable_keys_are_compared_like_the_scan() -> None:
+    api_response = [
+        {"id": "a", "n": 0},
+        {"id": ["a"], "n": 1},
+        {"id": {"a": 1}, "n": 2},
+        {"id": ["a"], "n": 3},
+        {"id": "a", "n": 4},
+    ]
+    index = ResponseIndex(api_response, iter_items_by_id)
+    index.raise_scan_error()
+    for key in ["a", ["a"], {"a": 1}, ("a",), ["b"], "b"]:
+        assert index.get(key) == [item for item in api_response if item["id"] == key]
+
+
+def get_label_by_scan(api_response: dict[Any, Any], id: Any) -> str:
+    """The scan of the nested dicts that GetLabel answered with before the indexes."""
+    for _, query_result in api_response.items():
+        for data_elem in query_result["data"]:
+            for timeslot_offer in data_elem["timeSlotOffers"]:
+                if timeslot_offer["id"] == id:
+                    return str(timeslot_offer["label"])
+    return "None"
+
+
+def test_compiled_task_with_unhashable_identifiers() -> None:
+    ids: list[Any] = ["x", ["x"], {"id": "x"}, ["y", 1], "y"]
+    api_response = {
+        f"{{'id': {i}}}": {
+            "data": [
+                {
+                    "timeSlotOffers": [
+                        {"id": id, "label": f"label {i} {j}"} for j, id in enumerate(ids[i:])
+                    ]
+                }
+            ]
+        }
+        for i in range(3)
+    }
+    # the compiled tasks are typed as Task
+    task: Any = GetLabel()
+    for id in ids + [["z"]]:
+        assert task.get_answer(api_response, id=id) == get_label_by_scan(api_response, id)
+    qa_samples = task.get_qa_samples(api_response)
+    assert [(qa_sample.question, qa_sample.gold_answer) for qa_sample in qa_samples] == [
+        (task.get_question(id=id), get_label_by_scan(api_response, id)) for id in ids
+    ]
@@ -0,0 +1,121 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from large_response_QA.response_store import ResponseStore
+from large_response_QA.tasks import task_list
+from large_response_QA.tasks.task_list import BookingSearchCarRentalsTaskList
+
+HOST = BookingSearchCarRentalsTaskList.host
+ENDPOINT = BookingSearchCarRentalsTaskList.endpoint_name
+
+
+class WhitespaceTokenizer:
+    def __init__(self) -> None:
+        self.num_calls = 0
+
+    def tokenize(self, text: str) -> list[str]:
+        self.num_calls += 1
+        return text.split()
+
+
+def make_endpoint_data(num_records: int, host: str = HOST) -> dict[str, Any]:
+    return {
+        host: {
+            ENDPOINT: {
+                f"{{'pick_up_latitude': {i}}}": {
+                    "data": {
+                        "search_results": [
+                            {"vehicle_id": str(i), "name": " ".join(["car"] * (i % 7 + 1))}
+                        ]
+                    }
+                }
+                for i in range(num_records)
+            }
+        }
+    }
+
+
+@pytest.fixture
+def tokenizer(monkeypatch: pytest.MonkeyPatch) -> WhitespaceTokenizer:
+    tokenizer = WhitespaceTokenizer()
+    monkeypatch.setattr(task_list, "get_tokenizer", lambda model_name: tokenizer)
+    return tokenizer
+
+
+def test_round_trip(tmp_path: Path) -> None:
+    endpoint_data = make_endpoint_data(5)
+    endpoint_data[HOST][ENDPOINT]["{'pick_up_latitude': 'é'}"] = {"data": [1.5, None, "ü"]}
+    with ResponseStore(str(tmp_path / "responses.sqlite")) as store:
+        store.replace_endpoint_data(endpoint_data, HOST, ENDPOINT)
+        assert store.has_endpoint(HOST.upper(), ENDPOINT.lower())
+        data = store.get_endpoint_data(HOST, ENDPOINT)
+    assert data == endpoint_data
+    assert list(data[HOST][ENDPOINT]) == list(endpoint_data[HOST][ENDPOINT])
+    with ResponseStore(str(tmp_path / "responses.sqlite")) as store:
+        assert store.get_endpoint_data(HOST, ENDPOINT) == endpoint_data
+        assert store.get_endpoint_data(HOST, "other") == {}
+
+
+def test_re_extraction(tmp_path: Path) -> None:
+    with ResponseStore(str(tmp_path / "responses.sqlite")) as store:
+        store.replace_endpoint_data(make_endpoint_data(5), HOST, ENDPOINT)
+        signature = store.get_endpoint_signature(HOST, ENDPOINT)
+        store.add_token_counts(
+            "tokenizer", "hash", [((HOST, ENDPOINT, "{'pick_up_latitude': 0}"), 3)]
+        )
+        assert store.get_token_counts("tokenizer", "hash", HOST, ENDPOINT) == {
+            (HOST, ENDPOINT, "{'pick_up_latitude': 0}"): 3
+        }
+        # the responses of an endpoint extracted again replace the previous ones, in any case
+        store.replace_endpoint_data(make_endpoint_data(3, HOST.upper()), HOST, ENDPOINT)
+        assert store.get_endpoint_data(HOST, ENDPOINT) == make_endpoint_data(3, HOST.upper())
+        assert store.get_endpoint_signature(HOST, ENDPOINT) != signature
+        assert store.get_token_counts("tokenizer", "hash", HOST, ENDPOINT) == {}
+        # an endpoint without responses is recorded as extracted
+        store.replace_endpoint_data({}, HOST, ENDPOINT)
+        assert store.has_endpoint(HOST, ENDPOINT)
+        assert store.get_endpoint_data(HOST, ENDPOINT) == {}
+
+
+def test_token_counts_are_keyed_by_the_record_cleanup_code(
+    tmp_path: Path, tokenizer: WhitespaceTokenizer, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    store_fpath = str(tmp_path / "responses.sqlite")
+    with ResponseStore(store_fpath) as store:
+        store.replace_endpoint_data(make_endpoint_data(5), HOST, ENDPOINT)
+    task_list_obj = BookingSearchCarRentalsTaskList(store_fpath)
+    task_list_obj.count_subset_record_tokens(["model"], task_list_obj.api_response)
+    assert tokenizer.num_calls == 10
+    # the counts of the previous run are reused
+    task_list_obj = BookingSearchCarRentalsTaskList(store_fpath)
+    task_list_obj.count_subset_record_tokens(["model"], task_list_obj.api_response)
+    assert tokenizer.num_calls == 10
+    # and counted again when the record cleanup changes
+    monkeypatch.setattr(
+        BookingSearchCarRentalsTaskList, "get_subset_record_code_hash", lambda self: "changed"
+    )
+    task_list_obj = BookingSearchCarRentalsTaskList(store_fpath)
+    task_list_obj.count_subset_record_tokens(["model"], task_list_obj.api_response)
+    assert tokenizer.num_calls == 20
+
+
+def test_subsets_from_the_store_match_the_subsets_from_json(
+    tmp_path: Path, tokenizer: WhitespaceTokenizer
+) -> None:
+    endpoint_data = make_endpoint_data(40)
+    json_fpath = tmp_path / "data.json"
+    json_fpath.write_text(json.dumps(endpoint_data))
+    store_fpath = str(tmp_path / "responses.sqlite")
+    with ResponseStore(store_fpath) as store:
+        store.replace_endpoint_data(endpoint_data, HOST, ENDPOINT)
+    json_task_list = BookingSearchCarRentalsTaskList(str(json_fpath))
+    store_task_list = BookingSearchCarRentalsTaskList(store_fpath)
+    store_task_list.count_subset_record_tokens(["model"], store_task_list.api_response)
+    for random_seed in range(5):
+        for token_limit in [10, 60, 1000]:
+            assert store_task_list.create_data_subsets(
+                token_limit, random_seed, "model"
+            ) == json_task_list.create_data_subsets(token_limit, random_seed, "model")
@@ -0,0 +1,149 @@
+import copy
+import json
+import random
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from large_response_QA.tasks import task_list
+from large_response_QA.tasks.task_list import (
+    BookingGetAvailabilityTaskList,
+    BookingSearchFlightsMultiStopsTaskList,
+)
+
+
+def make_record(offers: list[list[tuple[str, str]]]) -> dict[str, Any]:
+    return {
+        "data": {
+            "flightDeals": [],
+            "flightOffers": [
+                {
+                    "segments": [
+                        {
+                            "departureAirport": {"code": departure},
+                            "arrivalAirport": {"code": arrival},
+                        }
+                        for departure, arrival in offer
+                    ]
+                }
+                for offer in offers
+            ],
+        }
+    }
+
+
+def baseline_eligibility(records: list[dict[str, Any]]) -> list[bool]:
+    """The eligibility check of the original create_data_subsets walk of the flight task list."""
+    eligible = []
+    seen_departure_arrival_airport_codes: Any = []
+    for query_result_full in records:
+        not_eligible_record = False
+        query_result = query_result_full["data"]
+        try:
+            if "flightDeals" in query_result.keys():
+                del query_result["flightDeals"]
+            flight_offers = query_result["flightOffers"]
+            seen_departure_arrival_airport_codes_from_this_query = []
+            for flight_offer in flight_offers:
+                flight_segments = flight_offer["segments"]
+                for flight_segment in flight_segments:
+                    departure_airport_code = flight_segment["departureAirport"]["code"]
+                    arrival_airport_code = flight_segment["arrivalAirport"]["code"]
+                    if (
+                        f"{departure_airport_code}_{arrival_airport_code}"
+                        in seen_departure_arrival_airport_codes
+                        and f"{departure_airport_code}_{arrival_airport_code}"
+                        not in seen_departure_arrival_airport_codes_from_this_query
+                    ):
+                        not_eligible_record = True
+                        break
+                    else:
+                        seen_departure_arrival_airport_codes.append(
+                            f"{departure_airport_code}_{arrival_airport_code}"
+                        )
+                        seen_departure_arrival_airport_codes_from_this_query.append(
+                            f"{departure_airport_code}_{arrival_airport_code}"
+                        )
+        except BaseException:
+            pass
+        eligible.append(not not_eligible_record)
+    return eligible
+
+
+def subset_eligibility(records: list[dict[str, Any]]) -> list[bool]:
+    task_list_class = BookingSearchFlightsMultiStopsTaskList
+    task_list = task_list_class.__new__(task_list_class)
+    walk_state: dict[str, Any] = {}
+    eligible = []
+    for i, record in enumerate(records):
+        _, _, features = task_list.prepare_subset_record(str(i), record)
+        count_tokens, include = task_list.is_subset_record_eligible(features, walk_state)
+        assert count_tokens == include
+        eligible.append(include)
+    return eligible
+
+
+def test_seen_codes_of_later_offers_are_recorded() -> None:
+    records = [
+        make_record([[("A", "B")]]),
+        make_record([[("A", "B")], [("C", "D")]]),
+        make_record([[("C", "D")]]),
+    ]
+    assert baseline_eligibility(copy.deepcopy(records)) == [True, False, False]
+    assert subset_eligibility(records) == [True, False, False]
+
+
+def test_matches_baseline_on_overlapping_offers() -> None:
+    rng = random.Random(0)
+    airports = ["A", "B", "C", "D"]
+    for _ in range(500):
+        records = []
+        for _ in range(rng.randint(1, 6)):
+            offers = [
+                [(rng.choice(airports), rng.choice(airports)) for _ in range(rng.randint(0, 3))]
+                for _ in range(rng.randint(0, 3))
+            ]
+            record = make_record(offers)
+            if rng.random() < 0.1 and len(offers) > 0 and len(offers[-1]) > 0:
+                # a segment whose codes cannot be read
+                del record["data"]["flightOffers"][-1]["segments"][-1]["arrivalAirport"]
+            records.append(record)
+        assert subset_eligibility(copy.deepcopy(records)) == baseline_eligibility(records)
+
+
+class WhitespaceTokenizer:
+    def tokenize(self, text: str) -> list[str]:
+        return text.split()
+
+
+def test_malformed_record_is_not_eligible(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    monkeypatch.setattr(task_list, "get_tokenizer", lambda model_name: WhitespaceTokenizer())
+    queries = {
+        f"{{'id': {i}}}": {
+            "data": [{"fullDay": "x", "timeSlotOffers": [{"items": [{"price": i}]}]}]
+        }
+        for i in range(4)
+    }
+    # an availability without its time slot offers
+    del queries["{'id': 2}"]["data"][0]["timeSlotOffers"]
+    host = BookingGetAvailabilityTaskList.host
+    endpoint = BookingGetAvailabilityTaskList.endpoint_name
+    fpath = tmp_path / "data.json"
+    fpath.write_text(json.dumps({host: {endpoint: queries}}))
+    task_list_obj = BookingGetAvailabilityTaskList(str(fpath))
+    record_infos = task_list_obj.get_subset_record_index(task_list_obj.api_response)[
+        (host, endpoint)
+    ]
+    assert [record_info.preparable for record_info in record_infos] == [True, True, False, True]
+    assert "{'id': 2} of Get_Availability cannot be prepared" in capsys.readouterr().out
+    task_list_obj.count_subset_record_tokens(["model"], task_list_obj.api_response)
+    for random_seed in range(4):
+        walk = task_list_obj.walk_data_subset(
+            10000, random_seed, "model", api_responses=task_list_obj.api_response
+        )
+        subset, _ = task_list_obj.create_data_subsets(10000, random_seed, "model")
+        assert sorted(subset[host][endpoint]) == ["{'id': 0}", "{'id': 1}", "{'id': 3}"]
+        assert walk.num_ineligible_visits > 0
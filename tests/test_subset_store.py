@@ -0,0 +1,49 @@
+import json
+import os
+from pathlib import Path
+
+from large_response_QA.subset_store import (
+    BinaryDataSubset,
+    convert_json_data_subset,
+    get_binary_data_subset_path,
+    get_converted_data_subset_path,
+)
+
+
+def write_data_subset(fpath: Path, num_records: int) -> dict:
+    dataset = {
+        "0": {
+            "app": {
+                "endpoint": {f"{{'id': {i}}}": {"data": {"id": i}} for i in range(num_records)}
+            }
+        }
+    }
+    fpath.write_text(json.dumps(dataset))
+    return dataset
+
+
+def test_converted_data_subset(tmp_path: Path) -> None:
+    json_fpath = tmp_path / "subset_1000.json"
+    dataset = write_data_subset(json_fpath, 3)
+    assert get_converted_data_subset_path(str(json_fpath)) is None
+    binary_fpath = convert_json_data_subset(str(json_fpath))
+    assert get_converted_data_subset_path(str(json_fpath)) == binary_fpath
+    assert dict(BinaryDataSubset(binary_fpath)) == dataset
+
+
+def test_binary_data_subset_of_a_regenerated_json_file_is_not_used(tmp_path: Path) -> None:
+    json_fpath = tmp_path / "subset_1000.json"
+    write_data_subset(json_fpath, 3)
+    binary_fpath = convert_json_data_subset(str(json_fpath))
+    write_data_subset(json_fpath, 4)
+    assert get_converted_data_subset_path(str(json_fpath)) is None
+    # the binary file is used as it is without its JSON file
+    os.remove(json_fpath)
+    assert get_converted_data_subset_path(str(json_fpath)) == binary_fpath
+
+
+def test_binary_data_subset_of_an_older_version_is_not_used(tmp_path: Path) -> None:
+    json_fpath = tmp_path / "subset_1000.json"
+    write_data_subset(json_fpath, 3)
+    Path(get_binary_data_subset_path(str(json_fpath))).write_bytes(b"LRQASUB1[]")
+    assert get_converted_data_subset_path(str(json_fpath)) is None
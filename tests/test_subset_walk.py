@@ -0,0 +1,213 @@
+import copy
+import json
+import random
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from large_response_QA.tasks import task_list
+from large_response_QA.tasks.task_list import (
+    BookingGetRoomListWithAvailabilityTaskList,
+    BookingSearchCarRentalsTaskList,
+    BookingSearchFlightsMultiStopsTaskList,
+)
+
+HOST = "booking-com15.p.rapidapi.com"
+
+
+class WhitespaceTokenizer:
+    def tokenize(self, text: str) -> list[str]:
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def tokenizer(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(task_list, "get_tokenizer", lambda model_name: WhitespaceTokenizer())
+
+
+def write_api_responses(tmp_path: Path, endpoint: str, queries: dict[str, Any]) -> str:
+    fpath = tmp_path / f"{HOST}_{endpoint}.json"
+    fpath.write_text(json.dumps({HOST: {endpoint: queries}}))
+    return str(fpath)
+
+
+def make_room_lists(rng: random.Random, num_records: int) -> dict[str, Any]:
+    return {
+        str({"hotel_id": str(i)}).replace("'", '"'): {
+            "available": [
+                {"name": f"room {rng.randint(0, 3)}", "block_text": "text " * rng.randint(0, 5)}
+                for _ in range(rng.randint(1, 3))
+            ],
+            "unavailable": [],
+        }
+        for i in range(num_records)
+    }
+
+
+def baseline_room_list_subset(
+    queries: dict[str, Any], token_limit: int, random_seed: int
+) -> tuple[Any, int]:
+    """The original create_data_subsets walk of the room list task list."""
+    tokenizer = WhitespaceTokenizer()
+    num_tokens = 0
+    output_query_dict: Any = {}
+    random.seed(random_seed)
+    num_entities = 0
+    starting_index = random.randint(0, len(queries) - 1)
+    queries_list = list(queries.keys())
+    query_index = starting_index
+    while num_tokens < token_limit:
+        query_args = queries_list[query_index]
+        query_result = queries[query_args]
+        has_duplicate_names = False
+        if "unavailable" in query_result.keys():
+            del query_result["unavailable"]
+        seen_names = []
+        for content in query_result["available"]:
+            if content["name"] not in seen_names:
+                seen_names.append(content["name"])
+            else:
+                has_duplicate_names = True
+                break
+            if "block_text" in content.keys():
+                del content["block_text"]
+        query_index += 1
+        if query_index == len(queries):
+            query_index = 0  # circular indexing
+        num_tokens += len(tokenizer.tokenize(str(query_args))) + len(
+            tokenizer.tokenize(str(query_result))
+        )
+        if not has_duplicate_names and (num_tokens < token_limit or len(output_query_dict) == 0):
+            num_entities += 1
+            output_query_dict[query_args] = query_result
+    return {HOST: {"Get_Room_List_With_Availability": output_query_dict}}, num_entities
+
+
+def test_revisits_are_counted_like_the_baseline(tmp_path: Path) -> None:
+    rng = random.Random(0)
+    for num_records in [1, 2, 5, 9]:
+        queries = make_room_lists(rng, num_records)
+        fpath = write_api_responses(tmp_path, "Get_Room_List_With_Availability", queries)
+        task_list_obj = BookingGetRoomListWithAvailabilityTaskList(fpath)
+        token_limits = [1, 10, 50, 200, 1000, 5000]
+        for random_seed in range(10):
+            subsets = task_list_obj.create_nested_data_subsets(
+                token_limits, random_seed, "model", api_responses=task_list_obj.api_response
+            )
+            for token_limit in token_limits:
+                assert subsets[token_limit] == baseline_room_list_subset(
+                    copy.deepcopy(queries), token_limit, random_seed
+                )
+
+
+def test_walk_of_eligible_records_repeats_them(tmp_path: Path) -> None:
+    queries = {f"{{'id': {i}}}": {"data": {"name": "car " * (i + 1)}} for i in range(3)}
+    fpath = write_api_responses(tmp_path, "Search_Car_Rentals", queries)
+    task_list_obj = BookingSearchCarRentalsTaskList(fpath)
+    walk = task_list_obj.walk_data_subset(1000, 0, "model")
+    # a second cycle over the 3 records adds no new record
+    assert len(walk.steps) == 6
+    assert walk.num_tokens == 2 * (5 + 6 + 7)
+    assert not walk.token_limit_reached
+    assert walk.num_repeated_steps == 3
+    assert walk.num_ineligible_visits == 0
+    # the records are counted on each visit until the limit, as by a walk that goes on
+    for token_limit in [1, 18, 19, 36, 37, 1000]:
+        num_tokens = 0
+        num_entities = 0
+        step_tokens = [
+            step.cumulative_tokens - previous_step.cumulative_tokens
+            for previous_step, step in zip(walk.steps[2:], walk.steps[3:])
+        ]
+        while num_tokens < token_limit:
+            for tokens in step_tokens:
+                num_tokens += tokens
+                if num_tokens < token_limit or num_entities == 0:
+                    num_entities += 1
+                if num_tokens >= token_limit:
+                    break
+        assert task_list_obj.create_data_subsets(token_limit, 0, "model")[1] == num_entities
+
+
+def test_walk_stops_without_progress(tmp_path: Path) -> None:
+    # revisited flights are not eligible and add no tokens, so the walk cannot reach the limit
+    queries = {
+        f"{{'id': {i}}}": {
+            "data": {
+                "flightOffers": [
+                    {
+                        "segments": [
+                            {
+                                "departureAirport": {"code": f"A{i}"},
+                                "arrivalAirport": {"code": f"B{i}"},
+                            }
+                        ]
+                    }
+                ]
+            }
+        }
+        for i in range(4)
+    }
+    fpath = write_api_responses(tmp_path, "Search_Flights_Multi_Stops", queries)
+    task_list_obj = BookingSearchFlightsMultiStopsTaskList(fpath)
+    walk = task_list_obj.walk_data_subset(10000, 0, "model")
+    assert len(walk.steps) == 8
+    assert [step.include for step in walk.steps] == [True] * 4 + [False] * 4
+    assert walk.num_tokens == walk.steps[3].cumulative_tokens
+    assert not walk.token_limit_reached
+    assert walk.num_repeated_steps == 0
+    assert walk.num_ineligible_visits == 4
+    subset, num_entities = task_list_obj.create_data_subsets(10000, 0, "model")
+    assert len(subset[HOST]["Search_Flights_Multi_Stops"]) == 4
+    assert num_entities == 4
+
+
+def make_flights(rng: random.Random, num_records: int) -> dict[str, Any]:
+    airports = ["A", "B", "C", "D"]
+    return {
+        f"{{'id': {i}}}": {
+            "data": {
+                "flightOffers": [
+                    {
+                        "segments": [
+                            {
+                                "departureAirport": {"code": rng.choice(airports)},
+                                "arrivalAirport": {"code": rng.choice(airports)},
+                            }
+                            for _ in range(rng.randint(0, 2))
+                        ]
+                    }
+                    for _ in range(rng.randint(0, 2))
+                ]
+            }
+        }
+        for i in range(num_records)
+    }
+
+
+def test_nested_data_subsets_match_the_data_subsets_of_each_limit(tmp_path: Path) -> None:
+    rng = random.Random(1)
+    token_limits = [5, 40, 120, 400, 3000]
+    for task_list_class, make_queries in [
+        (BookingGetRoomListWithAvailabilityTaskList, make_room_lists),
+        (BookingSearchFlightsMultiStopsTaskList, make_flights),
+    ]:
+        for num_records in [1, 3, 8]:
+            fpath = write_api_responses(
+                tmp_path, task_list_class.endpoint_name, make_queries(rng, num_records)
+            )
+            task_list_obj = task_list_class(fpath)
+            num_exhausted = 0
+            for random_seed in range(6):
+                walk = task_list_obj.walk_data_subset(max(token_limits), random_seed, "model")
+                num_exhausted += not walk.token_limit_reached
+                subsets = task_list_obj.create_nested_data_subsets(
+                    token_limits, random_seed, "model", api_responses=task_list_obj.api_response
+                )
+                for token_limit in token_limits:
+                    assert subsets[token_limit] == task_list_class(fpath).create_data_subsets(
+                        token_limit, random_seed, "model"
+                    )
+            # the walks of the largest token limit end before it
+            assert num_exhausted > 0